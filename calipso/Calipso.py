@@ -23,6 +23,7 @@ from Tkinter import Tk, Label, Toplevel, Menu, PanedWindow, \
     SUNKEN, StringVar, Text, IntVar
 import logging
 from sys import platform as _platform
+from timeit import default_timer as clock
 from tkColorChooser import askcolor
 import tkFileDialog
 import tkMessageBox
@@ -36,19 +37,18 @@ import constants
 from extractdialog import ExtractDialog
 from importdialog import ImportDialog
 from settingsdialog import SettingsDialog
-from log.log import logger, error_check
+from log.log import logger, error_check, RenderTimings
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
-from plot.plot_depolar_ratio import render_depolarized
-from plot.plot_backscattered import render_backscattered
-from plot.plot_vfm import render_vfm
-from plot.plot_iwp import render_iwp
-from plot.plot_horiz_avg import render_horiz_avg
-from plot.plot_aerosol_subtype import render_aerosol_subtype
+from plot.plot_view import PlotView
+from plot.renderers import RENDERERS
 from polygon.manager import ShapeManager
 from tools.linearalgebra import distance
 from tools.navigationtoolbar import NavigationToolbar2CALIPSO
 from tools.optionmenu import ShapeOptionMenu
+from tools.prefetcher import Prefetcher
+from tools.tilepyramid import TilePyramid
+from tools.renderworker import RenderWorker
 from tools.tools import Catcher, center
 from toolswindow import ToolsWindow
 from db import db
@@ -79,6 +79,12 @@ class Calipso(object):
         self.shape_var = StringVar()
         self.__data_block = LoadData('Empty')
         self.plot_type = IntVar()
+        # Set to plot every granule of the day of the file as one, see LoadData.set_stitched
+        self.stitched = IntVar()
+        # Prepares plot data off the Tk thread, see set_plot
+        self.__render_worker = RenderWorker(r)
+        # Windows either side of the one on screen, prepared while the user looks at it
+        self.__prefetcher = Prefetcher(self.__render_worker)
 
 
         self.width = self.__root.winfo_screenwidth()
@@ -112,6 +118,8 @@ class Calipso(object):
         self.__parent_fig = Figure(figsize=(16, 11))
         self.__fig = self.__parent_fig.add_subplot(1, 1, 1)
         self.__parent_fig.set_tight_layout(True)
+        # Axes of the plot on screen, reused by pans of the same plot type
+        self.__plot_view = None
         self.__drawplot_canvas = FigureCanvasTkAgg(self.__parent_fig,
                                                    master=self.__drawplot_frame)
         # Create ToolsWindow class and pass itself + the root
@@ -182,6 +190,9 @@ class Calipso(object):
                                   value=Plot.horiz_avg)
         menu_views.add_radiobutton(label='Aerosol Subtype', variable=self.plot_type,
                                    value=Plot.aerosol_subtype)
+        menu_views.add_separator()
+        menu_views.add_checkbutton(label='Stitch Granules of the Day', variable=self.stitched,
+                                   command=self.stitch_granules)
         menu_bar.add_cascade(label='Views', menu=menu_views)
         self.plot_type.set(1)       # Set initial value to backscatter
 
@@ -304,12 +315,32 @@ class Calipso(object):
             if self.__file is not None and fl is not self.__file:
                 self.new_file_flag = True
             self.__file = fl
+            # Drop renders of the previous file and close its granules before loading the new one
+            self.__render_worker.cancel()
+            self.__prefetcher.clear()
+            self.__data_block.get_granule_cache().clear()
             self.__data_block = LoadData(fl)
+            self.__data_block.set_stitched(bool(self.stitched.get()))
             segments = self.__file.rpartition('/')
             self.__label_file_dialog.config(width=50, bg=white, relief=SUNKEN, justify=LEFT,
                                             text=segments[2])
             CONF.session_hdf.change(fl)
 
+    def stitch_granules(self):
+        """
+        Switch between plotting the file alone and plotting every granule of its day stitched
+        into one, as set from the Views menu. Profile indices count from the first granule of
+        the day when stitched, the plot on screen is drawn again for the same range
+        """
+        stitched = bool(self.stitched.get())
+        logger.info('Stitching granules of the day ' + str(stitched))
+        # Windows prepared from the other profiles no longer match the x range
+        self.__render_worker.cancel()
+        self.__prefetcher.clear()
+        self.__data_block.set_stitched(stitched)
+        if self.plot != Plot.baseplot:
+            self.set_plot(self.plot, self.xrange, self.yrange)
+
     def export_db(self, only_selected=False):
         """
         Notify the database that a save is taking place, the
@@ -458,171 +489,135 @@ class Calipso(object):
         if plot_type == Plot.baseplot:
             # Hide the axis and print an image
             self.__shapemanager.set_plot(Plot.baseplot)
+            self.__plot_view = None
 
             im = mpimg.imread(PATH + '/dat/CALIPSO.jpg')
             self.__fig.get_yaxis().set_visible(False)
             self.__fig.get_xaxis().set_visible(False)
             self.__fig.imshow(im)
-        elif plot_type == Plot.backscattered:
-            try:
-                # Clear any references to the current figure, construct a new figure
-                # and render the backscattered plot to it
-                logger.info('Setting plot to backscattered xrange: ' +
-                            str(xrange_) + ' yrange: ' + str(yrange))
-                self.__file = self.__data_block.get_file_name(1)
-                logger.info('Using file ' + self.__file)
-                # Reset if the file is not empty AND we are using granules from different time/place
-                if self.__shapemanager.get_hdf() != '' and \
-                                self.__file[-25:-4] != self.__shapemanager.get_hdf()[-25:-4]:
-                    self.__shapemanager.reset(all_=True)
-                else:
-                    self.__shapemanager.clear_refs()
-                self.__shapemanager.set_hdf(self.__file)
-                self.__parent_fig.clear()
-                self.__fig = self.__parent_fig.add_subplot(1, 1, 1)
-                self.__fig = render_backscattered(self.__file, xrange_, yrange, self.__fig, self.__parent_fig)
-                self.__shapemanager.set_current(Plot.backscattered, self.__fig)
-                self.__drawplot_canvas.show()
-                self.__toolbar.update()
-                self.plot = Plot.backscattered
-            except IOError:
-                logger.error('IOError, no file exists')
-                tkMessageBox.showerror('File Not Found', 'No File Exists')
-            except IndexError:
-                tkMessageBox.showerror('Backscattered Plot', 'Index out of bounds')
-
-        elif plot_type == Plot.depolarized:
-            try:
-                # Clear any references to the current figure, construct a new figure
-                # and render the depolarized plot to it
-                logger.info('Setting plot to depolarized xrange: ' +
-                            str(xrange_) + ' yrange: ' + str(yrange))
-                self.__file = self.__data_block.get_file_name(1)
-                logger.info('Using file ' + self.__file)
-                # Reset if the file is not empty AND we are using granules from different time/place
-                if self.__shapemanager.get_hdf() != '' and \
-                                self.__file[-25:-4] != self.__shapemanager.get_hdf()[-25:-4]:
-                    self.__shapemanager.reset(all_=True)
-                else:
-                    self.__shapemanager.clear_refs()
-                self.__shapemanager.set_hdf(self.__file)
-                self.__parent_fig.clear()
-                self.__fig = self.__parent_fig.add_subplot(1, 1, 1)
-                self.__fig = render_depolarized(self.__file, xrange_, yrange, self.__fig, self.__parent_fig)
-                self.__shapemanager.set_current(Plot.depolarized, self.__fig)
-                self.__drawplot_canvas.show()
-                self.__toolbar.update()
-                self.plot = Plot.depolarized
-            except IOError:
-                logger.error('IOError, no file exists')
-                tkMessageBox.showerror('File Not Found', "No File Exists")
-
-        elif plot_type == Plot.vfm:
-            try:
-                # Clear any references to the current figure, construct a new figure
-                # and render the depolarized plot to it
-                logger.info('Setting plot to vfm xrange: ' +
-                            str(xrange_) + ' yrange: ' + str(yrange))
-                self.__file = self.__data_block.get_file_name(2)
-                logger.info('Using file ' + self.__file)
-                # Reset if the file is not empty AND we are using granules from different time/place
-                if self.__shapemanager.get_hdf() != '' and \
-                                self.__file[-25:-4] != self.__shapemanager.get_hdf()[-25:-4]:
-                    self.__shapemanager.reset(all_=True)
-                else:
-                    self.__shapemanager.clear_refs()
-                self.__shapemanager.set_hdf(self.__file)
-                self.__parent_fig.clear()
-                self.__fig = self.__parent_fig.add_subplot(1, 1, 1)
-                self.__fig = render_vfm(self.__file, xrange_, yrange, self.__fig, self.__parent_fig)
-                self.__shapemanager.set_current(Plot.vfm, self.__fig)
-                self.__drawplot_canvas.show()
-                self.__toolbar.update()
-                self.plot = Plot.vfm
-            except IOError:
-                logger.error('IOError, no file exists')
-                tkMessageBox.showerror('File Not Found', "No File Exists")
-
-        elif plot_type == Plot.iwp:
-            try:
-                # Clear any references to the current figure, construct a new figure
-                # and render the depolarized plot to it
-                logger.info('Setting plot to iwp xrange: ' +
-                            str(xrange_) + ' yrange: ' + str(yrange))
-                self.__file = self.__data_block.get_file_name(2)
-                logger.info('Using file ' + self.__file)
-                # Reset if the file is not empty AND we are using granules from different time/place
-                if self.__shapemanager.get_hdf() != '' and \
-                                self.__file[-25:-4] != self.__shapemanager.get_hdf()[-25:-4]:
-                    self.__shapemanager.reset(all_=True)
-                else:
-                    self.__shapemanager.clear_refs()
-                self.__shapemanager.set_hdf(self.__file)
-                self.__parent_fig.clear()
-                self.__fig = self.__parent_fig.add_subplot(1, 1, 1)
-                self.__fig = render_iwp(self.__file, xrange_, yrange, self.__fig, self.__parent_fig)
-                self.__shapemanager.set_current(Plot.iwp, self.__fig)
-                self.__drawplot_canvas.show()
-                self.__toolbar.update()
-                self.plot = Plot.iwp
-            except IOError:
-                logger.error('IOError, no file exists')
-                tkMessageBox.showerror('File Not Found', "No File Exists")
-
-        elif plot_type == Plot.horiz_avg:
-            try:
-                # Clear any references to the current figure, construct a new figure
-                # and render the depolarized plot to it
-                logger.info('Setting plot to horiz_avg xrange: ' +
-                            str(xrange_) + ' yrange: ' + str(yrange))
-                self.__file = self.__data_block.get_file_name(2)
-                logger.info('Using file ' + self.__file)
-                # Reset if the file is not empty AND we are using granules from different time/place
-                if self.__shapemanager.get_hdf() != '' and \
-                                self.__file[-25:-4] != self.__shapemanager.get_hdf()[-25:-4]:
-                    self.__shapemanager.reset(all_=True)
-                else:
-                    self.__shapemanager.clear_refs()
-                self.__shapemanager.set_hdf(self.__file)
-                self.__parent_fig.clear()
-                self.__fig = self.__parent_fig.add_subplot(1, 1, 1)
-                self.__fig = render_horiz_avg(self.__file, xrange_, yrange, self.__fig, self.__parent_fig)
-                self.__shapemanager.set_current(Plot.horiz_avg, self.__fig)
-                self.__drawplot_canvas.show()
-                self.__toolbar.update()
-                self.plot = Plot.horiz_avg
-            except IOError:
-                logger.error('IOError, no file exists')
-                tkMessageBox.showerror('File Not Found', "No File Exists")
-
-        elif plot_type == Plot.aerosol_subtype:
-            try:
-                # Clear any references to the current figure, construct a new figure
-                # and render the depolarized plot to it
-                logger.info('Setting plot to aerosol_subtype xrange: ' +
-                            str(xrange_) + ' yrange: ' + str(yrange))
-                self.__file = self.__data_block.get_file_name(2)
-                logger.info('Using file ' + self.__file)
-                # Reset if the file is not empty AND we are using granules from different time/place
-                if self.__shapemanager.get_hdf() != '' and \
-                                self.__file[-25:-4] != self.__shapemanager.get_hdf()[-25:-4]:
-                    self.__shapemanager.reset(all_=True)
-                else:
-                    self.__shapemanager.clear_refs()
-                self.__shapemanager.set_hdf(self.__file)
+        elif plot_type in RENDERERS:
+            level, name, title, prepare, draw = RENDERERS[plot_type]
+            # The plot asked for, panning or stitching before it is drawn renders it again
+            self.plot = plot_type
+            logger.info('Setting plot to ' + name + ' xrange: ' +
+                        str(xrange_) + ' yrange: ' + str(yrange))
+            prepare_range = self.__preparer(plot_type, xrange_, yrange)
+            # Times each stage of this render, on the worker and then on the Tk thread
+            timings = RenderTimings(name, xrange_)
+            prefetched = self.__prefetcher.find(plot_type, self.__data_block.get_file_name(level),
+                                                xrange_)
+            if prefetched is not None:
+                # Prepared ahead of a pan, only the drawing is left
+                logger.info('Drawing prefetched ' + name + ' ' + str(prefetched.get_x_range()))
+                self.__render_worker.cancel()
+                self.__draw_plot(plot_type, prefetched, xrange_, yrange, timings)
+            else:
+                # Read, decode, average and regrid on the render worker so the main loop keeps
+                # running, the canvas is only touched once the data is ready. Panning again
+                # before then cancels this render
+                self.__render_worker.submit(
+                    lambda: timings.run(prepare_range, xrange_),
+                    lambda prepared: self.__draw_plot(plot_type, prepared, xrange_, yrange,
+                                                      timings),
+                    lambda error: self.__render_failed(plot_type, error))
+        else:
+            logger.warning('Plot Type not yet supported')
+
+    def __draw_plot(self, plot_type, prepared, xrange_, yrange, timings):
+        """
+        Draw the data prepared by the render worker. A pan of the plot on screen only updates
+        its image and limits, any other plot clears the figure and draws new axes. The canvas
+        redraws once the main loop is idle and the windows either side are then prefetched
+
+        :param int plot_type: one of the plot types in ``RENDERERS``
+        :param prepared: :py:class:`plot.prepared_plot.PreparedPlot` returned by the worker
+        :param list xrange\_: accepts a range of time to plot
+        :param list yrange: accepts a range of altitude to plot
+        :param timings: :py:class:`log.log.RenderTimings` of the render, finished once drawn
+        """
+        level, name, title, prepare, draw = RENDERERS[plot_type]
+        self.__file = self.__data_block.get_file_name(level)
+        logger.info('Using file ' + self.__file)
+        # Reset if the file is not empty AND we are using granules from different time/place
+        if self.__shapemanager.get_hdf() != '' and \
+                        self.__file[-25:-4] != self.__shapemanager.get_hdf()[-25:-4]:
+            self.__shapemanager.reset(all_=True)
+        else:
+            self.__shapemanager.clear_refs()
+        self.__shapemanager.set_hdf(self.__file)
+        self.__shapemanager.set_stitched(self.__data_block.is_stitched())
+        with timings.activate():
+            if self.__plot_view is not None and self.__plot_view.get_plot_type() == plot_type:
+                # Keep the layout of the first render, only the tick labels have changed
+                self.__parent_fig.set_tight_layout(False)
+                self.__fig = self.__plot_view.update(prepared, yrange)
+            else:
+                self.__parent_fig.set_tight_layout(True)
                 self.__parent_fig.clear()
-                self.__fig = self.__parent_fig.add_subplot(1, 1, 1)
-                self.__fig = render_aerosol_subtype(self.__file, xrange_, yrange, self.__fig, self.__parent_fig)
-                self.__shapemanager.set_current(Plot.aerosol_subtype, self.__fig)
-                self.__drawplot_canvas.show()
-                self.__toolbar.update()
-                self.plot = Plot.aerosol_subtype
-            except IOError:
-                logger.error('IOError, no file exists')
-                tkMessageBox.showerror('File Not Found', "No File Exists")
+                axes = self.__parent_fig.add_subplot(1, 1, 1)
+                self.__fig = draw(prepared, yrange, axes, self.__parent_fig)
+                self.__plot_view = PlotView(plot_type, axes, self.__fig)
+            self.__shapemanager.set_current(plot_type, self.__fig)
+        # Idle callbacks run in order, so the second one runs right after the canvas has drawn
+        start = clock()
+        self.__drawplot_canvas.draw_idle()
+        self.__root.after_idle(lambda: self.__drawn(timings, start))
+        self.__toolbar.update()
+
+        self.__prefetcher.prefetch(plot_type, self.__file, xrange_, prepared,
+                                   self.__preparer(plot_type, xrange_, yrange))
+
+    @staticmethod
+    def __drawn(timings, start):
+        """
+        Finish the timings of a render once the canvas has drawn it
 
+        :param timings: :py:class:`log.log.RenderTimings` of the render
+        :param float start: ``clock()`` when the draw was requested
+        """
+        timings.add('canvas draw', clock() - start)
+        timings.finish()
+
+    def __preparer(self, plot_type, xrange_, yrange):
+        """
+        Return a function preparing a range of *plot_type* from the current file on the render
+        worker. Ranges as wide as *xrange\_* are prepared directly, or composited from the tile
+        pyramid once they are ``constants.TILE_MIN_RANGE`` profiles or wider
+
+        :param int plot_type: one of the plot types in ``RENDERERS``
+        :param list xrange\_: accepts a range of time to plot
+        :param list yrange: accepts a range of altitude to plot
+        """
+        level, name, title, prepare, draw = RENDERERS[plot_type]
+        data_block = self.__data_block
+        tiled = xrange_[1] - xrange_[0] >= constants.TILE_MIN_RANGE
+
+        def prepare_range(x_range):
+            # Held in use, so the granule cache can not close the file while it is read
+            with data_block.use_granule(level) as granule:
+                if tiled:
+                    # One pyramid per granule and plot type, kept by the granule
+                    return TilePyramid.from_granule(granule, name, prepare).composite(x_range)
+                return prepare(granule, x_range, yrange)
+        return prepare_range
+
+    def __render_failed(self, plot_type, error):
+        """
+        Report a render that failed on the render worker
+
+        :param int plot_type: one of the plot types in ``RENDERERS``
+        :param error: exception raised while preparing the plot
+        """
+        title = RENDERERS[plot_type][2]
+        if isinstance(error, IOError):
+            logger.error('IOError, no file exists')
+            tkMessageBox.showerror('File Not Found', 'No File Exists')
+        elif isinstance(error, IndexError):
+            tkMessageBox.showerror(title + ' Plot', 'Index out of bounds')
         else:
-            logger.warning('Plot Type not yet supported')
+            # The render worker already logged the traceback
+            logger.error('%s plot failed: %s: %s' % (title, type(error).__name__, error))
+            tkMessageBox.showerror(title + ' Plot', str(error))
 
     def pan(self, event):
         """
@@ -729,6 +724,9 @@ class Calipso(object):
         f = tkFileDialog.askopenfilename(**options)
         if f is '':
             return
+        if self.__shapemanager.is_stitched():
+            tkMessageBox.showerror('load', 'Shapes cannot be loaded while granules are stitched')
+            return
         self.__shapemanager.read_plot(f)
 
     def about(self):
@@ -798,6 +796,9 @@ class Calipso(object):
 
         :param event: A Tkinter passed event object
         """
+        if self.__shapemanager.is_stitched():
+            tkMessageBox.showerror('extract', 'Data cannot be extracted while granules are stitched')
+            return
         shape = self.__shapemanager.find_shape(event)
         logger.info("Extracting data for %s" % shape.get_tag())
         ExtractDialog(self.__root, shape, self.__file, self.xrange, self.yrange). \
@@ -894,17 +895,20 @@ class Calipso(object):
                 saved = self.save_json()
                 if saved:
                     error_check()
+                    self.__render_worker.shutdown()
                     self.__root.destroy()
                 else:
                     return
             elif answer is False:
                 logger.info('Dumping unsaved shapes')
                 error_check()
+                self.__render_worker.shutdown()
                 self.__root.destroy()
             elif answer is None:
                 return
         else:
             error_check()
+            self.__render_worker.shutdown()
             self.__root.destroy()
 
     ############################################################
@@ -0,0 +1,198 @@
+###################################
+#   batchrender.py
+#
+#   Headless rendering of quicklook PNGs for many granules at once, e.g.
+#
+#   python batchrender.py '/data/2017-07-01/*.hdf' -p backscattered vfm -o quicklooks
+#
+#   Run from the calipso folder like the application, the renderers load
+#   their colormaps from dat/
+###################################
+import argparse
+from collections import OrderedDict
+import glob
+import json
+import multiprocessing
+import os
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import constants
+from log.log import logger
+from plot.renderers import RENDERERS, find_renderer
+from tools.granulecache import GranuleCache
+
+MANIFEST = 'manifest.json'
+
+# Granules opened by the current worker process, see render_task
+_granule_cache = None
+
+
+def find_granules(patterns):
+    """
+    Expand directories and glob patterns into a sorted list of HDF files
+
+    :param patterns: list of directories, file names or glob patterns
+    """
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.hdf')
+        files.update(os.path.abspath(f) for f in glob.glob(pattern))
+    return sorted(files)
+
+
+def granule_level(filename):
+    """ Return 1 for an L1 file, 2 for an L2 VFM file and 0 for anything else """
+    name = os.path.basename(filename)
+    if 'L1' in name:
+        return 1
+    if 'L2' in name and 'VFM' in name:
+        return 2
+    return 0
+
+
+def make_tasks(files, plots, x_range, alt_range, output):
+    """
+    Pair every file with every requested plot read from its level of file, in the order of the
+    files
+    """
+    tasks = []
+    for filename in files:
+        level = granule_level(filename)
+        for plot in plots:
+            if find_renderer(plot)[1][0] == level:
+                tasks.append((filename, plot, tuple(x_range), tuple(alt_range), output))
+    return tasks
+
+
+def init_worker(budget):
+    global _granule_cache
+    _granule_cache = GranuleCache(budget)
+
+
+def render_task(task):
+    """
+    Render one plot of one granule to a PNG on the Agg backend, run in a worker process
+
+    :param task: tuple of the file, plot name, x range, altitude range and output folder
+    :returns: the manifest entry of the task
+    """
+    filename, plot, x_range, alt_range, output = task
+    level, name, title, prepare, draw = find_renderer(plot)[1]
+    png = os.path.join(output, '%s_%s_%d-%d.png' % (
+        os.path.splitext(os.path.basename(filename))[0], name, x_range[0], x_range[1]))
+    entry = {'file': filename, 'plot': name, 'x_range': x_range, 'alt_range': alt_range,
+             'png': png, 'error': None}
+
+    start = time.time()
+    try:
+        with _granule_cache.use(lambda: _granule_cache.get(filename, 15 if level == 2 else 1)) \
+                as granule:
+            prepared = prepare(granule, x_range, alt_range)
+        figure = Figure(figsize=(16, 11))
+        FigureCanvasAgg(figure)
+        figure.set_tight_layout(True)
+        draw(prepared, alt_range, figure.add_subplot(1, 1, 1), figure)
+        figure.savefig(png)
+    except Exception as e:
+        # One bad file or plot is recorded in the manifest instead of failing the whole batch
+        logger.exception('Could not render %s of %s' % (name, filename))
+        entry['error'] = '%s: %s' % (type(e).__name__, e)
+    entry['seconds'] = time.time() - start
+    return entry
+
+
+def render_granule(tasks):
+    """
+    Render every task of one file in turn, run in a worker process so the file is only opened
+    by that worker
+
+    :param tasks: list of the tasks of one file, see :py:func:`render_task`
+    :returns: list of the manifest entries of the tasks
+    """
+    return [render_task(task) for task in tasks]
+
+
+def render_batch(files, plots, x_range, alt_range, output, processes=None,
+                 budget=constants.GRANULE_CACHE_BUDGET):
+    """
+    Render *plots* of every file in *files* across a pool of worker processes and write the
+    PNGs and a JSON manifest of them to *output*
+
+    :param files: L1 and L2 VFM HDF files
+    :param plots: plot names, e.g. ``['backscattered', 'vfm']``
+    :param x_range: Tuple of first and last profile index to render
+    :param alt_range: Tuple of first and last altitude to render
+    :param str output: folder for the PNGs and manifest
+    :param int processes: worker processes, defaults to the number of CPUs
+    :param int budget: granule cache budget of each worker in bytes
+    :returns: the manifest
+    """
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    # Hand out every plot of a file together so each file is only opened by one worker
+    rendered = OrderedDict()
+    for task in make_tasks(files, plots, x_range, alt_range, output):
+        rendered.setdefault(task[0], []).append(task)
+    processes = processes or multiprocessing.cpu_count()
+
+    start = time.time()
+    pool = multiprocessing.Pool(processes, init_worker, (budget,))
+    try:
+        entries = [entry for granule_entries in pool.imap(render_granule, rendered.values())
+                   for entry in granule_entries]
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    manifest = {
+        'plots': list(plots),
+        'x_range': list(x_range),
+        'alt_range': list(alt_range),
+        'processes': processes,
+        'granules': len(rendered),
+        'renders': len(entries),
+        'failed': sum(1 for entry in entries if entry['error'] is not None),
+        'seconds': elapsed,
+        'granules_per_minute': len(rendered) * 60.0 / elapsed if elapsed > 0 else 0.0,
+        'entries': entries,
+    }
+    with open(os.path.join(output, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=4)
+    return manifest
+
+
+def main():
+    names = sorted(renderer[1] for renderer in RENDERERS.values())
+    parser = argparse.ArgumentParser(description='Render CALIPSO quicklooks without the GUI')
+    parser.add_argument('granules', nargs='+',
+                        help='L1 and L2 VFM HDF files, folders of them or glob patterns')
+    parser.add_argument('-p', '--plots', nargs='+', default=['backscattered'], choices=names,
+                        help='plots to render, L1 plots from L1 files and L2 plots from VFM files')
+    parser.add_argument('-x', '--x-range', nargs=2, type=int, default=[0, 1000],
+                        metavar=('FIRST', 'LAST'), help='range of profiles to render')
+    parser.add_argument('-a', '--alt-range', nargs=2, type=int, default=[0, 20],
+                        metavar=('BOTTOM', 'TOP'), help='range of altitudes in km')
+    parser.add_argument('-o', '--output', default='quicklooks',
+                        help='folder for the PNGs and ' + MANIFEST)
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes, defaults to the number of CPUs')
+    args = parser.parse_args()
+
+    files = find_granules(args.granules)
+    if not files:
+        parser.error('no HDF files found')
+    manifest = render_batch(files, args.plots, args.x_range, args.alt_range,
+                            os.path.abspath(args.output), args.processes)
+    print('Rendered %d plots of %d granules in %.1f s (%d failed), %.2f granules per minute' % (
+        manifest['renders'], manifest['granules'], manifest['seconds'], manifest['failed'],
+        manifest['granules_per_minute']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+###################################
+#   benchmark.py
+#
+#   Times each stage of the plot pipeline and each end to end render on
+#   synthetic granule sized arrays, so it runs without any CALIPSO files, e.g.
+#
+#   python benchmark.py
+#   python benchmark.py -s avg_horz_data vfm_rows2block render_vfm -r 5
+#
+#   Every run is appended to a JSON history. The run fails when a stage is
+#   slower, or uses more memory, than the recent runs on the same machine
+#   by more than the threshold, or when a stage of the L1 path stops
+#   returning float32. Run it from the calipso folder like the application,
+#   the renderers load their colormaps from dat/
+###################################
+import argparse
+from collections import OrderedDict
+import ctypes
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+
+from plot.altitude_grid import get_regridder, get_uniform_alt
+from plot.avg_lidar_data import avg_horz_data
+from plot.downsample import downsample
+from plot.interpret_vfm_type import extract_type, extract_water_phase, extract_horiz_avg, \
+    extract_aerosol_subtype, decode_lut
+from plot.PCF_genTimeUtils import calipso_time2num
+from plot.plot_aerosol_subtype import render_aerosol_subtype
+from plot.plot_backscattered import prepare_backscattered, render_backscattered
+from plot.plot_depolar_ratio import prepare_depolarized, render_depolarized
+from plot.plot_horiz_avg import render_horiz_avg
+from plot.plot_iwp import render_iwp
+from plot.plot_vfm import render_vfm
+from plot.regrid_lidar import Regridder
+from plot.vfm_row2block import vfm_rows2block, PROFILES_PER_ROW
+from tools.granulecache import Granule
+from tools.granulestore import write_granule
+from tools.syntheticgranule import lidar_altitudes, synthetic_pair
+
+HISTORY = 'benchmark_history.json'
+
+# Differences below these are noise whatever the threshold: seconds, bytes and pages
+SLACK = {'seconds': 0.005, 'peak_bytes': 1 << 20, 'allocations': 256}
+
+# Y range of the end to end renders in km
+ALT_RANGE = (0, 20)
+
+# Canvas of the end to end renders in pixels, that of a 16 x 11 inch figure at 100 dpi
+CANVAS = (1600, 1100)
+
+# The dtype the result of these stages must have. The L1 datasets are float32 on disk and the
+# rasters made from them must stay float32, an upcast doubles the memory of a full orbit render
+DTYPES = {
+    'avg_horz_data': np.float32,
+    'regrid_linear': np.float32,
+    'downsample_mean': np.float32,
+    'prepare_backscattered': np.float32,
+    'prepare_depolarized': np.float32,
+}
+
+
+class Fixture(object):
+    """
+    Synthetic inputs shared by the stages, each built on first use. A full L1 and L2 VFM granule
+    pair from :py:mod:`tools.syntheticgranule` is written to *directory* and opened like any
+    other file
+
+    :param str directory: folder for the synthetic granules
+    """
+
+    def __init__(self, directory):
+        self.__directory = directory
+        self.__inputs = dict()
+
+    def get(self, name, build):
+        if name not in self.__inputs:
+            self.__inputs[name] = build()
+        return self.__inputs[name]
+
+    def get_l1(self):
+        return self.get('pair', lambda: synthetic_pair(datetime(2017, 7, 1)))[0]
+
+    def get_l2(self):
+        return self.get('pair', lambda: synthetic_pair(datetime(2017, 7, 1)))[1]
+
+    def get_backscatter(self):
+        """ The total backscatter altitude x profile, as the renderers pass it """
+        return self.get_l1()[0]['Total_Attenuated_Backscatter_532'].T
+
+    def get_averaged(self):
+        return self.get('averaged', lambda: avg_horz_data(self.get_backscatter(), 15))
+
+    def get_unpacked(self):
+        return self.get('unpacked', lambda: vfm_rows2block(
+            self.get_l2()[0]['Feature_Classification_Flags']))
+
+    def get_granule(self, level):
+        """ The synthetic L1 or L2 granule opened as a :py:class:`tools.granulecache.Granule` """
+        def build():
+            datasets, metadata = self.get_l1() if level == 1 else self.get_l2()
+            path = os.path.join(self.__directory, 'CAL_LID_L%d_Synthetic' % level)
+            write_granule(path, datasets, metadata)
+            return Granule(path, PROFILES_PER_ROW if level == 2 else 1)
+        return self.get(('granule', level), build)
+
+
+def render_stage(render, level):
+    """ Stage of an end to end render of the whole granule, drawn to an Agg canvas """
+    def setup(fixture):
+        granule = fixture.get_granule(level)
+
+        def run():
+            # Start from the raw file every time instead of the decoded products of the last run
+            granule.clear_products()
+            figure = Figure(figsize=(16, 11))
+            FigureCanvasAgg(figure)
+            render(granule, granule.get_x_range(), ALT_RANGE, figure.add_subplot(1, 1, 1), figure)
+            figure.canvas.draw()
+        return run
+    return setup
+
+
+def prepare_stage(prepare, level):
+    """ Stage preparing the whole granule, without drawing it """
+    def setup(fixture):
+        granule = fixture.get_granule(level)
+
+        def run():
+            granule.clear_products()
+            return prepare(granule, granule.get_x_range(), ALT_RANGE)
+        return run
+    return setup
+
+
+def regrid_stage(method):
+    def setup(fixture):
+        if method == 'linear':
+            altitude, matrix = lidar_altitudes(), fixture.get_averaged()
+        else:
+            altitude, matrix = lidar_altitudes()[33:-5], extract_type(fixture.get_unpacked())
+        regridder = get_regridder(altitude, ALT_RANGE[1], method)
+        return lambda: regridder(matrix)
+    return setup
+
+
+def extract_stage(extract):
+    def setup(fixture):
+        unpacked = fixture.get_unpacked()
+        return lambda: extract(unpacked)
+    return setup
+
+
+# Every stage by name, each a function taking the Fixture and returning the function timed
+STAGES = OrderedDict([
+    ('calipso_time2num', lambda fixture: lambda: calipso_time2num(
+        fixture.get_l1()[0]['Profile_UTC_Time'][:, 0])),
+    ('avg_horz_data', lambda fixture: lambda: avg_horz_data(fixture.get_backscatter(), 15)),
+    ('regridder_build', lambda fixture: lambda: Regridder(
+        lidar_altitudes(), get_uniform_alt(ALT_RANGE[1], lidar_altitudes()))),
+    ('regrid_linear', regrid_stage('linear')),
+    ('downsample_mean', lambda fixture: lambda: downsample(
+        fixture.get_averaged(), CANVAS[0], CANVAS[1])),
+    ('vfm_rows2block', lambda fixture: lambda: vfm_rows2block(
+        fixture.get_l2()[0]['Feature_Classification_Flags'])),
+    ('extract_type', extract_stage(extract_type)),
+    ('extract_water_phase', extract_stage(extract_water_phase)),
+    ('extract_horiz_avg', extract_stage(extract_horiz_avg)),
+    ('extract_aerosol_subtype', extract_stage(extract_aerosol_subtype)),
+    ('decode_lut_aerosol', extract_stage(
+        lambda unpacked: decode_lut(unpacked, extract_aerosol_subtype))),
+    ('regrid_nearest', regrid_stage('nearest')),
+    ('prepare_backscattered', prepare_stage(prepare_backscattered, 1)),
+    ('prepare_depolarized', prepare_stage(prepare_depolarized, 1)),
+    ('render_backscattered', render_stage(render_backscattered, 1)),
+    ('render_depolarized', render_stage(render_depolarized, 1)),
+    ('render_vfm', render_stage(render_vfm, 2)),
+    ('render_iwp', render_stage(render_iwp, 2)),
+    ('render_horiz_avg', render_stage(render_horiz_avg, 2)),
+    ('render_aerosol_subtype', render_stage(render_aerosol_subtype, 2)),
+])
+
+
+def _memory_status():
+    """ Tuple of the current and peak resident memory in bytes, from /proc/self/status """
+    fields = dict()
+    with open('/proc/self/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            fields[name] = value
+    return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+
+
+def _reset_peak_memory():
+    """ Reset the peak resident memory to the current one, returns ``False`` if not possible """
+    try:
+        # Hand memory freed by earlier runs back first, or a run reusing it would look free
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError, AttributeError):
+        return False
+
+
+def measure_memory(run):
+    """
+    Run *run* once and return a tuple of the extra memory it needed at its peak in bytes, and
+    the number of allocations, counted as the fresh pages of memory it touched (minor page
+    faults). Peak memory is ``None`` where the peak can not be reset, i.e. outside Linux
+
+    :param run: function taking no arguments
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    can_peak = _reset_peak_memory()
+    before = _memory_status()[0] if can_peak else None
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt if resource else None
+    run()
+    if resource:
+        faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults
+    peak = max(_memory_status()[1] - before, 0) if can_peak else None
+    return peak, faults
+
+
+def result_dtype(result):
+    """ dtype of the array a stage returned, or of the raster of a prepared plot """
+    if hasattr(result, 'get_data'):
+        result = result.get_data()
+    return getattr(result, 'dtype', None)
+
+
+def run_stages(names, repeat, fixture):
+    """
+    Time the stages *names*, returning for each the best wall time of *repeat* runs in
+    ``seconds``, ``peak_bytes`` and ``allocations`` from one more run, and the ``dtype`` of
+    the result, ``None`` when the stage does not return an array
+
+    :param names: stage names from ``STAGES``
+    :param int repeat: timed runs of each stage
+    :param fixture: :py:class:`Fixture` of the inputs
+    """
+    results = OrderedDict()
+    for name in names:
+        run = STAGES[name](fixture)
+        # One run first so one time setup, e.g. building a regridder, is not timed
+        dtype = result_dtype(run())
+        seconds = min(timeit.repeat(run, number=1, repeat=repeat))
+        peak, allocations = measure_memory(run)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak, 'allocations': allocations,
+                         'dtype': None if dtype is None else str(dtype)}
+        print('%-24s %9.4f s %9s MB %9s pages' % (
+            name, seconds, '-' if peak is None else '%.1f' % (peak / 1048576.0),
+            '-' if allocations is None else allocations))
+    return results
+
+
+def machine():
+    """ Identifies where a run was made, runs are only compared with runs of the same machine """
+    return '%s %s python %s numpy %s' % (platform.node(), platform.machine(),
+                                          platform.python_version(), np.__version__)
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)['runs']
+
+
+def save_history(path, runs):
+    with open(path, 'w') as f:
+        json.dump({'runs': runs}, f, indent=4)
+
+
+def find_regressions(results, history, time_threshold, memory_threshold, window=5):
+    """
+    Compare *results* with the median of each metric over the last *window* runs of this machine
+    in *history*. A metric regresses when it exceeds the median times its threshold, plus the
+    ``SLACK`` of the metric
+
+    :returns: list of (stage, metric, value, baseline) tuples
+    """
+    runs = [run for run in history if run['machine'] == machine()][-window:]
+    thresholds = {'seconds': time_threshold, 'peak_bytes': memory_threshold,
+                  'allocations': memory_threshold}
+    regressions = []
+    for stage, metrics in results.items():
+        for metric, threshold in thresholds.items():
+            past = [run['results'][stage][metric] for run in runs
+                    if stage in run['results'] and run['results'][stage][metric] is not None]
+            if not past or metrics[metric] is None:
+                continue
+            baseline = float(np.median(past))
+            if metrics[metric] > baseline * threshold + SLACK[metric]:
+                regressions.append((stage, metric, metrics[metric], baseline))
+    return regressions
+
+
+def find_upcasts(results):
+    """
+    Return a list of (stage, dtype, expected dtype) tuples of the stages in *results* whose
+    result does not have the dtype ``DTYPES`` expects
+    """
+    return [(stage, metrics['dtype'], np.dtype(DTYPES[stage]).name)
+            for stage, metrics in results.items()
+            if stage in DTYPES and metrics['dtype'] != np.dtype(DTYPES[stage]).name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the plot pipeline on synthetic data')
+    parser.add_argument('-s', '--stages', nargs='+', default=list(STAGES), choices=list(STAGES),
+                        help='stages to run, all by default')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='timed runs of each stage, the fastest is kept')
+    parser.add_argument('--history', default=HISTORY, help='JSON file of the past runs')
+    parser.add_argument('--time-threshold', type=float, default=1.25,
+                        help='fail if a stage takes longer than this times its recent median')
+    parser.add_argument('--memory-threshold', type=float, default=1.25,
+                        help='fail if a stage needs more memory than this times its recent median')
+    parser.add_argument('--no-record', action='store_true',
+                        help='compare with the history without adding this run to it')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='vocal_benchmark_')
+    try:
+        results = run_stages(args.stages, args.repeat, Fixture(directory))
+    finally:
+        shutil.rmtree(directory)
+
+    history = load_history(args.history)
+    regressions = find_regressions(results, history, args.time_threshold, args.memory_threshold)
+    if not args.no_record:
+        history.append({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'machine': machine(),
+                        'results': results,
+                        'regressions': [list(regression[:2]) for regression in regressions]})
+        save_history(args.history, history)
+
+    for stage, metric, value, baseline in regressions:
+        print('REGRESSION %s %s: %.6g against a median of %.6g' % (stage, metric, value, baseline))
+    upcasts = find_upcasts(results)
+    for stage, dtype, expected in upcasts:
+        print('DTYPE %s: returned %s instead of %s' % (stage, dtype, expected))
+    sys.exit(1 if regressions or upcasts else 0)
+
+if __name__ == '__main__':
+    main()
@@ -61,6 +61,38 @@ IMADVHEIGHT = 300
 TXT = 0
 CSV = 1
 
+# Memory budget in bytes for granules kept open by tools.granulecache.GranuleCache
+GRANULE_CACHE_BUDGET = 256 * 1024 * 1024
+
+# Memory budget in bytes for the products, e.g. averaged backscatter and tiles, kept by each
+# granule. Counted in GRANULE_CACHE_BUDGET as well
+PRODUCT_BUDGET = 128 * 1024 * 1024
+
+# Profiles read at a time by tools.granulecache.Granule.iter_blocks, rounded down to whole
+# blocks. A chunk of one L1 backscatter dataset is about 7 MB, of the L2 flags about 2 MB
+STREAM_CHUNK_PROFILES = 3000
+
+# Number of prepared plot windows kept by tools.prefetcher.Prefetcher for panning
+PREFETCH_WINDOWS = 8
+
+# Profiles in a level 0 tile of tools.tilepyramid.TilePyramid. Divisible by the averaging widths
+# of the L1 plots and the 15 profiles of an L2 record, and gives a power of two number of columns
+TILE_PROFILES = 15 * 1024
+# Ranges at least this wide are composited from tiles instead of being prepared directly
+TILE_MIN_RANGE = TILE_PROFILES
+# Columns wanted across a composited range, about the width of the canvas
+TILE_TARGET_COLUMNS = 2048
+# Tiles are saved here between sessions
+TILE_DIR = os.path.join(expanduser('~'), '.vocal', 'tiles')
+# Bytes the tiles under TILE_DIR may take, the tiles of the granules used longest ago go first
+TILE_DIR_BUDGET = 2 * 1024 * 1024 * 1024
+
+# Granules converted to memory mappable .npy folders by tools.granulestore
+GRANULE_STORE_DIR = os.path.join(expanduser('~'), '.vocal', 'granules')
+
+# Renders whose stage timings are kept by log.log.TimingHistogram
+TIMING_RENDERS = 200
+
 # READ ONLY
 TAGS = ['aerosol', 'aerosol LC', 'clean continental', 'clean marine', 'cloud', 'cloud LC',
         'dust', 'polluted continental', 'polluted continental dust', 'polluted dust',
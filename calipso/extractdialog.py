@@ -10,13 +10,14 @@ import tkMessageBox
 
 import ccplot
 from ccplot.algorithms import interp2d_12
-from ccplot.hdf import HDF
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 import matplotlib as mpl
 import numpy as np
 
 from constants import TIME_VARIANCE
+from plot.PCF_genTimeUtils import calipso_time2num
+from tools.granulestore import open_granule
 from tools.tools import interpolation_search
 from log.log import logger
 
@@ -129,11 +130,11 @@ class ExtractDialog(Toplevel):
 
         # TODO Show correct plot when depolarized starts working
         # plot = self.shape.get_plot()
-        with HDF(self.filename) as product:
+        with open_granule(self.filename) as product:
             time = product['Profile_UTC_Time'][x1:x2, 0]
             height = product['metadata']['Lidar_Data_Altitudes']
             dataset = product['Total_Attenuated_Backscatter_532'][x1:x2]
-            n_time = np.array([mpl.dates.date2num(ccplot.utils.calipso_time2dt(t)) for t in time])
+            n_time = calipso_time2num(time)
 
             min_time = min(time_cords)
             max_time = max(time_cords)
@@ -147,9 +148,8 @@ class ExtractDialog(Toplevel):
                 raise ZeroDivisionError
 
             logger.info('Setting bounds for new subplot')
-            time = time[x1:x2]
+            n_time = n_time[x1:x2]
             dataset = dataset[x1:x2]
-            time = np.array([ccplot.utils.calipso_time2dt(t) for t in time])
 
             dataset = np.ma.masked_equal(dataset, -9999)
             _x = np.arange(x1, x2, dtype=np.float32)
@@ -171,7 +171,7 @@ class ExtractDialog(Toplevel):
             logger.info("Setting colormap, displaying")
             self.ax.imshow(
                 data.T,
-                extent=(mpl.dates.date2num(time[0]), mpl.dates.date2num(time[-1]), h1, h2),
+                extent=(n_time[0], n_time[-1], h1, h2),
                 cmap=cm,
                 aspect='auto',
                 norm=norm,
@@ -192,11 +192,11 @@ class ExtractDialog(Toplevel):
 
         # TODO Show correct plot when depolarized starts working
         # plot = self.shape.get_plot()
-        with HDF(self.filename) as product:
+        with open_granule(self.filename) as product:
             time = product['Profile_UTC_Time'][x1:x2, 0]
             height = product['metadata']['Lidar_Data_Altitudes']
             dataset = product['Total_Attenuated_Backscatter_532'][x1:x2]
-            n_time = np.array([mpl.dates.date2num(ccplot.utils.calipso_time2dt(t)) for t in time])
+            n_time = calipso_time2num(time)
 
             min_time = min(time_cords)
             max_time = max(time_cords)
@@ -255,6 +255,10 @@ class ImportDialog(Toplevel):
         """
         Import selected objects from internal_list into program
         """
+        if self.__master.get_shapemanager().is_stitched():
+            tkMessageBox.showerror('Import', 'Shapes cannot be imported while granules are stitched',
+                                   parent=self)
+            return
         items = self.tree.tree.selection()
         logger.info('Parsing selection')
         # For all selected items in window
@@ -3,14 +3,20 @@
 #
 #   @authors: Grant Mercer, Nathan Qian
 ###################################
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+import functools
+import json
 import logging.config
 import re
 import shutil
 import sys
+import threading
+from timeit import default_timer as clock
 import traceback
 from time import strftime as time
 
-from constants import PATH
+from constants import PATH, TIMING_RENDERS
 
 config = {
           'version': 1,
@@ -66,6 +72,170 @@ def error_check():
             logger.info('No Errors found')
             return
 
+
+# The RenderTimings current on each thread, see RenderTimings.activate
+_active = threading.local()
+
+
+class RenderTimings(object):
+    """
+    Structured record of the time spent in each stage of one render. A render is prepared on
+    the render worker and drawn on the Tk thread, so the record is made current on each thread
+    in turn with :py:meth:`activate`. Stages timed with :py:func:`timed` or
+    :py:func:`timed_stage` while it is current are added to it, a stage run more than once is
+    summed. Stages may nest, e.g. fill masking is part of averaging
+
+    :param str name: name of the plot rendered
+    :param x_range: Tuple of the first and last profile index rendered
+    """
+
+    def __init__(self, name, x_range=None):
+        self.__name = name
+        self.__x_range = x_range
+        self.__start = clock()
+        # stage -> [seconds, calls], in the order the stages first ran
+        self.__stages = OrderedDict()
+
+    @contextmanager
+    def activate(self):
+        """ Make this record current on the calling thread for the body of the with block """
+        previous = getattr(_active, 'timings', None)
+        _active.timings = self
+        try:
+            yield self
+        finally:
+            _active.timings = previous
+
+    def run(self, function, *args):
+        """ Call *function* with this record current and return its result """
+        with self.activate():
+            return function(*args)
+
+    def add(self, stage, seconds):
+        entry = self.__stages.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def as_dict(self):
+        return {
+            'plot': self.__name,
+            'x_range': list(self.__x_range) if self.__x_range is not None else None,
+            'total': clock() - self.__start,
+            'stages': OrderedDict((stage, {'seconds': seconds, 'calls': calls})
+                                  for stage, (seconds, calls) in self.__stages.items()),
+        }
+
+    def finish(self, histogram=None):
+        """
+        Log the record and add it to *histogram*, by default :py:data:`render_timings`
+
+        :returns: the record as a dictionary
+        """
+        record = self.as_dict()
+        logger.info('Render timings ' + json.dumps(record))
+        (histogram if histogram is not None else render_timings).add(record)
+        return record
+
+
+@contextmanager
+def timed(stage):
+    """
+    Time the body of the with block as *stage* of the current :py:class:`RenderTimings`. Does
+    nothing when no render is current, e.g. while prefetching
+
+    :param str stage: name of the stage, e.g. ``'read'``
+    """
+    timings = getattr(_active, 'timings', None)
+    if timings is None:
+        yield
+        return
+    start = clock()
+    try:
+        yield
+    finally:
+        timings.add(stage, clock() - start)
+
+
+def timed_stage(stage):
+    """ Decorator timing every call of the function as *stage*, see :py:func:`timed` """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(_active, 'timings', None) is None:
+                return function(*args, **kwargs)
+            with timed(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class TimingHistogram(object):
+    """
+    The records of the last *size* renders, summarized per stage as a histogram over fixed
+    buckets and a few percentiles. Safe to add to from any thread
+
+    :param int size: renders kept, defaults to ``constants.TIMING_RENDERS``
+    """
+
+    # Upper bounds of the buckets in seconds, a last bucket holds anything slower
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self, size=TIMING_RENDERS):
+        self.__records = deque(maxlen=size)
+        self.__lock = threading.Lock()
+
+    def add(self, record):
+        with self.__lock:
+            self.__records.append(record)
+
+    def get_records(self):
+        with self.__lock:
+            return list(self.__records)
+
+    def clear(self):
+        with self.__lock:
+            self.__records.clear()
+
+    def summary(self):
+        """
+        Per stage, and for the whole render as ``'total'``: the number of renders it ran in,
+        the mean, median, 90th percentile and maximum seconds and the count in each bucket
+        """
+        durations = OrderedDict()
+        for record in self.get_records():
+            durations.setdefault('total', []).append(record['total'])
+            for stage, entry in record['stages'].items():
+                durations.setdefault(stage, []).append(entry['seconds'])
+
+        summary = OrderedDict()
+        for stage, seconds in durations.items():
+            seconds.sort()
+            histogram = [0] * (len(TimingHistogram.BUCKETS) + 1)
+            for value in seconds:
+                histogram[sum(1 for bound in TimingHistogram.BUCKETS if value > bound)] += 1
+            summary[stage] = {
+                'count': len(seconds),
+                'mean': sum(seconds) / len(seconds),
+                'median': seconds[(len(seconds) - 1) // 2],
+                'p90': seconds[int(round(0.9 * (len(seconds) - 1)))],
+                'max': seconds[-1],
+                'histogram': histogram,
+            }
+        return summary
+
+    def to_json(self):
+        return json.dumps({'buckets': TimingHistogram.BUCKETS, 'summary': self.summary(),
+                           'renders': self.get_records()}, indent=4)
+
+    def dump(self, path):
+        """ Write the summary and every record kept to the JSON file *path* """
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+
+# Stage timings of the renders of the application
+render_timings = TimingHistogram()
+
 sys.excepthook = uncaught_exception
 # logging.config.fileConfig(r'/home/gdev/Github/vocal/calipso/log/logging.ini',
 # disable_existing_loggers=False)
@@ -0,0 +1,85 @@
+#
+# altitude_grid.py
+#
+# Registry of the uniform altitude grids built by uniform_alt_2 and of the
+# regridders onto them. The renderers only ever use two source altitude arrays,
+# the L1 Lidar_Data_Altitudes and the L2 [33:-5] slice of them, so each grid and
+# regridder is built once and shared by every render of every plot type
+#
+import threading
+
+import numpy as np
+
+from log.log import timed_stage
+from plot.uniform_alt_2 import uniform_alt_2
+from plot.regrid_lidar import Regridder
+
+# Uniform grids keyed by (max_altitude, bytes of the source altitudes)
+_grids = dict()
+
+# Regridders keyed by (max_altitude, method, bytes of the source altitudes)
+_regridders = dict()
+# Reentrant, get_regridder builds its grid with get_uniform_alt while holding it
+_lock = threading.RLock()
+
+
+def _altitude_key(altitude):
+    return np.ascontiguousarray(altitude, dtype=np.float64).tobytes()
+
+
+def get_uniform_alt(max_altitude, altitude):
+    """
+    Returns the grid ``uniform_alt_2(max_altitude, altitude)``, building it only the first time
+    the pair is seen. The returned array is shared, so it must not be modified
+
+    :param max_altitude: maximum altitude of the grid in km
+    :param altitude: lidar altitudes the grid is built from
+    """
+    key = (max_altitude, _altitude_key(altitude))
+    with _lock:
+        grid = _grids.get(key)
+        if grid is None:
+            grid = uniform_alt_2(max_altitude, altitude)
+            grid.setflags(write=False)
+            _grids[key] = grid
+        return grid
+
+
+def get_regridder(altitude, max_altitude, method='linear'):
+    """
+    Returns the :py:class:`plot.regrid_lidar.Regridder` from *altitude* onto the uniform grid
+    of :py:func:`get_uniform_alt`, building it only the first time it is asked for
+
+    :param altitude: lidar altitudes of the rows of the data to regrid
+    :param max_altitude: maximum altitude of the uniform grid in km
+    :param str method: 'linear' for continuous data, 'nearest' for categorical data
+    """
+    key = (max_altitude, method, _altitude_key(altitude))
+    with _lock:
+        regridder = _regridders.get(key)
+        if regridder is None:
+            regridder = Regridder(altitude, get_uniform_alt(max_altitude, altitude), method)
+            _regridders[key] = regridder
+        return regridder
+
+
+@timed_stage('regrid')
+def regrid_uniform(altitude, matrix, max_altitude, method='linear'):
+    """
+    Regrid *matrix*, stored altitude x profile on *altitude*, onto the uniform grid up to
+    *max_altitude*. Equivalent to
+    ``regrid_lidar(altitude, matrix, uniform_alt_2(max_altitude, altitude), method)``
+
+    :param altitude: lidar altitudes of the rows of *matrix*
+    :param matrix: altitude x profile array
+    :param max_altitude: maximum altitude of the uniform grid in km
+    :param str method: 'linear' or 'nearest'
+    """
+    return get_regridder(altitude, max_altitude, method)(matrix)
+
+
+def clear():
+    """ Forget every grid and regridder built so far """
+    with _lock:
+        _grids.clear()
+        _regridders.clear()
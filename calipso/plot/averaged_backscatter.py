@@ -0,0 +1,137 @@
+#
+# averaged_backscatter.py
+#
+# The 532 nm backscatter of a range of L1 profiles averaged once and shared by
+# the backscatter and depolarization ratio plots
+#
+from itertools import izip, repeat
+
+import numpy as np
+
+from log.log import timed_stage
+from plot.avg_lidar_data import avg_horz_chunks, profile_blocks, ChunkMean, CHUNK_PROFILES
+
+TOTAL = 'Total_Attenuated_Backscatter_532'
+PERPENDICULAR = 'Perpendicular_Attenuated_Backscatter_532'
+
+
+@timed_stage('averaging')
+def average_depolarization(total, perpendicular, N, nProfiles, averaged_total=None):
+    """
+    Average the total and perpendicular backscatter N profiles at a time and compute the
+    depolarization ratio perpendicular / (total - perpendicular) in one pass over both. The two
+    datasets are read a chunk at a time, each chunk goes through the same working buffers and
+    the ratio is computed in place in the averaged perpendicular chunk, so the only arrays the
+    size of the output are the two returned. Where the averaged parallel backscatter is 0 the
+    ratio is NaN
+
+    :param total: chunks of the total backscatter as yielded by
+                  :py:meth:`tools.granulecache.Granule.iter_blocks`, fill values and NaN are
+                  left out
+    :param perpendicular: chunks of the perpendicular backscatter, laid out like *total*
+    :param int N: number of profiles to average
+    :param int nProfiles: number of profiles in all the chunks
+    :param averaged_total: the total already averaged by
+                           :py:func:`plot.avg_lidar_data.avg_horz_chunks`, when given *total* is
+                           not read and may be None
+    :returns: tuple of the averaged total backscatter and the depolarization ratio, altitude x
+              averaged profile in the dtype of the data
+    """
+    if averaged_total is not None:
+        averaged_total = averaged_total.T
+        total = repeat((None, None))
+    chunks = ratio = None
+    for (offset, perp_chunk), (_, total_chunk) in izip(perpendicular, total):
+        perpendicular_blocks = profile_blocks(np.asarray(perp_chunk).T, N)
+        if chunks is None:
+            chunks = ChunkMean(perpendicular_blocks)
+            shape = (nProfiles // N, perpendicular_blocks.shape[2])
+            ratio = np.empty(shape, dtype=chunks.get_dtype())
+            if averaged_total is None:
+                averaged_total = np.empty(shape, dtype=chunks.get_dtype())
+        if total_chunk is not None:
+            total_blocks = profile_blocks(np.asarray(total_chunk).T, N)
+        offset //= N
+
+        for first in range(0, perpendicular_blocks.shape[0], CHUNK_PROFILES):
+            block = perpendicular_blocks[first:first + CHUNK_PROFILES]
+            rows = slice(offset + first, offset + first + block.shape[0])
+            if total_chunk is not None:
+                averaged_total[rows] = chunks.mean(total_blocks[first:first + CHUNK_PROFILES])
+            perp = chunks.mean(block)
+            # Parallel backscatter, then the ratio, in place in a float64 copy of the chunk
+            parallel = averaged_total[rows].astype(np.float64)
+            parallel -= perp
+            zero = parallel == 0
+            with np.errstate(invalid='ignore'):
+                np.divide(perp, parallel, out=perp, where=~zero)
+            perp[zero] = np.nan
+            ratio[rows] = perp
+    return averaged_total.T, ratio.T
+
+
+class AveragedBackscatter(object):
+    """
+    The backscatter of a range of L1 profiles averaged N profiles at a time. The total
+    backscatter and the depolarization ratio are each computed the first time they are asked
+    for and kept. Asked for the ratio first, both are averaged in a single pass over the two
+    datasets, asked for the total first, only the perpendicular backscatter is averaged
+    afterwards. The backscatter and depolarization plots of the same range and averaging width
+    share one through the granule's product cache
+
+    :param granule: L1 :py:class:`tools.granulecache.Granule`
+    :param int first: first profile index
+    :param int last: last profile index, exclusive
+    :param int N: number of profiles to average
+    """
+
+    def __init__(self, granule, first, last, N):
+        self.__granule = granule
+        self.__range = (first, last)
+        self.__N = N
+        self.__total = None
+        self.__ratio = None
+
+    @staticmethod
+    def from_granule(granule, first, last, N):
+        """
+        Returns the averaged backscatter of profiles ``first:last``, shared through the
+        granule's product cache
+
+        :param granule: L1 :py:class:`tools.granulecache.Granule`
+        :param int first: first profile index
+        :param int last: last profile index, exclusive
+        :param int N: number of profiles to average
+        """
+        # A range may run past the end of the granule, only the profiles it has are averaged
+        last = min(last, granule.get_num_profiles())
+        return granule.get_product(('averaged_backscatter', first, last, N),
+                                   lambda: AveragedBackscatter(granule, first, last, N))
+
+    def get_total(self):
+        """ Averaged 532 nm total attenuated backscatter, altitude x averaged profile """
+        if self.__total is None:
+            self.__total = avg_horz_chunks(self.__read(TOTAL), self.__N, self.__profiles())
+        return self.__total
+
+    def get_depolarization_ratio(self):
+        """ Depolarization ratio of the averaged backscatter, altitude x averaged profile """
+        if self.__ratio is None:
+            perpendicular = self.__read(PERPENDICULAR)
+            if self.__total is None:
+                self.__total, self.__ratio = average_depolarization(
+                    self.__read(TOTAL), perpendicular, self.__N, self.__profiles())
+            else:
+                self.__ratio = average_depolarization(
+                    None, perpendicular, self.__N, self.__profiles(), self.__total)[1]
+        return self.__ratio
+
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.__total, self.__ratio) if array is not None)
+
+    def __profiles(self):
+        return self.__range[1] - self.__range[0]
+
+    def __read(self, dataset):
+        # Read a chunk of whole averages at a time as the averaging consumes them
+        return self.__granule.iter_blocks(dataset, self.__range[0], self.__range[1], self.__N)
@@ -0,0 +1,144 @@
+#
+# colormaps.py
+#
+# Registry of the colormaps of the plots. Each .cmap file in dat/ is parsed by
+# ccplot once, on first use, and its ListedColormap, BoundaryNorm and RGBA lookup
+# table are then shared by every render of every plot
+#
+import threading
+
+import ccplot.utils
+import matplotlib as mpl
+import numpy as np
+
+# The .cmap file of each colormap, relative to the calipso folder
+CMAP_FILES = {
+    'backscatter': 'dat/calipso-backscatter.cmap',
+    'depolar': 'dat/calipso-depolar.cmap',
+    'vfm': 'dat/calipso-vfm.cmap',
+    'icewaterphase': 'dat/calipso-icewaterphase.cmap',
+    'horizontalaveraging': 'dat/calipso-horizontalaveraging.cmap',
+    'aerosol_subtype': 'dat/calipso-aerosol_subtype.cmap',
+}
+
+# Colormaps loaded so far keyed by name
+_colormaps = dict()
+_lock = threading.Lock()
+
+
+class Colormap(object):
+    """
+    A colormap read from a ccplot .cmap file: the ``ListedColormap`` and ``BoundaryNorm`` passed
+    to imshow, and a uint8 RGBA lookup table holding the colors followed by the under, over and
+    bad colors, for colorizing rasters without matplotlib. The objects are shared, they must not
+    be modified
+
+    :param dict cmap: colormap returned by ``ccplot.utils.cmap``
+    """
+
+    def __init__(self, cmap):
+        self.__cmap = mpl.colors.ListedColormap(cmap['colors'] / 255.0)
+        self.__cmap.set_under(cmap['under'] / 255.0)
+        self.__cmap.set_over(cmap['over'] / 255.0)
+        self.__cmap.set_bad(cmap['bad'] / 255.0)
+        self.__norm = mpl.colors.BoundaryNorm(cmap['bounds'], self.__cmap.N)
+        self.__bounds = np.asarray(cmap['bounds'], dtype=np.float64)
+
+        colors = self.__cmap.N
+        self.__under, self.__over, self.__bad = colors, colors + 1, colors + 2
+        self.__lut = np.concatenate([
+            self.__cmap(np.arange(colors), bytes=True),
+            self.__cmap([-1, colors], bytes=True),
+            self.__cmap(np.ma.masked_array([0], mask=[True]), bytes=True)])
+        self.__lut.setflags(write=False)
+        # Every uint8 value colorized once, so class rasters are colorized by a single take
+        self.__byte_lut = self.__lut[self.indices(np.arange(256))]
+        self.__byte_lut.setflags(write=False)
+        # The same tables with each RGBA row as one uint32, taking whole pixels is much faster
+        # than indexing the rows of an N x 4 table
+        self.__lut_pixels = self.__lut.view(np.uint32).ravel()
+        self.__byte_lut_pixels = self.__byte_lut.view(np.uint32).ravel()
+
+    def get_cmap(self):
+        return self.__cmap
+
+    def get_norm(self):
+        return self.__norm
+
+    def get_lut(self):
+        """ RGBA rows of the colors, then the under, over and bad colors """
+        return self.__lut
+
+    def get_byte_lut(self):
+        """ RGBA of every uint8 value, ``get_byte_lut()[raster]`` colorizes a uint8 raster """
+        return self.__byte_lut
+
+    def indices(self, data):
+        """
+        Rows of :py:meth:`get_lut` of every element of *data*, the color the norm and colormap
+        give it. NaN and masked elements get the bad color
+
+        :param data: array of values
+        """
+        values = np.ma.getdata(data)
+        bounds = self.__bounds
+        if values.dtype.kind == 'f':
+            # BoundaryNorm compares float32 data with the bounds rounded to float32
+            bounds = bounds.astype(values.dtype)
+        index = np.searchsorted(bounds, values, side='right') - 1
+        if self.__norm.Ncmap != len(bounds) - 1:
+            # More or fewer colors than bins, spread the bins across the colors like BoundaryNorm
+            scale = (self.__norm.Ncmap - 1) / float(len(bounds) - 2)
+            index = (index * scale).astype(index.dtype)
+        with np.errstate(invalid='ignore'):
+            index[values < bounds[0]] = self.__under
+            index[values >= bounds[-1]] = self.__over
+        index[np.isnan(values) | np.ma.getmaskarray(data)] = self.__bad
+        return index
+
+    def colorize(self, data):
+        """
+        RGBA uint8 image of *data*, as imshow would color it with this colormap and norm
+
+        :param data: 2d array of values
+        """
+        if data.dtype == np.uint8 and not np.ma.is_masked(data):
+            pixels = self.__byte_lut_pixels.take(np.ma.getdata(data))
+        else:
+            pixels = self.__lut_pixels.take(self.indices(data))
+        return pixels.view(np.uint8).reshape(data.shape + (4,))
+
+
+def get_colormap(name):
+    """
+    Return the shared :py:class:`Colormap` called *name*, reading its .cmap file on the first
+    request only
+
+    :param str name: one of ``CMAP_FILES``, e.g. ``'backscatter'``
+    """
+    with _lock:
+        colormap = _colormaps.get(name)
+        if colormap is None:
+            colormap = Colormap(ccplot.utils.cmap(CMAP_FILES[name]))
+            _colormaps[name] = colormap
+        return colormap
+
+
+def find_colormap(cmap):
+    """
+    Return the loaded :py:class:`Colormap` whose ``ListedColormap`` is *cmap*, or ``None`` if
+    *cmap* is not one of the shared colormaps
+
+    :param cmap: matplotlib colormap, e.g. of an image
+    """
+    with _lock:
+        for colormap in _colormaps.values():
+            if colormap.get_cmap() is cmap:
+                return colormap
+    return None
+
+
+def clear():
+    """ Forget every colormap loaded so far, e.g. after a .cmap file has been edited """
+    with _lock:
+        _colormaps.clear()
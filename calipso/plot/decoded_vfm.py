@@ -0,0 +1,104 @@
+#
+# decoded_vfm.py
+#
+# Feature_Classification_Flags read and unpacked once per range and shared by
+# the VFM, IWP, horizontal averaging and aerosol subtype plots
+#
+import numpy as np
+
+from log.log import timed
+from plot.vfm_row2block import vfm_chunks2block
+from plot.interpret_vfm_type import extract_type, extract_qa, extract_water_phase, \
+    extract_water_phase_qa, extract_sub_type, extract_type_confidence, extract_horiz_avg, \
+    extract_masked, AEROSOL, CLOUD, STRATOSPHERIC
+
+
+class DecodedVFM(object):
+    """
+    The Feature_Classification_Flags of a range of L2 records unpacked to the
+    (545, 15 * num_rows) grid used by the plots. Each bitfield is extracted from the unpacked
+    flags the first time it is asked for and kept as a uint8 array, so switching between the
+    plots built from the flags does not read or decode them again
+
+    :param flags: Feature_Classification_Flags unpacked by
+                  :py:func:`plot.vfm_row2block.vfm_rows2block` or
+                  :py:func:`plot.vfm_row2block.vfm_chunks2block`
+    """
+
+    def __init__(self, flags):
+        self.__flags = flags
+        self.__fields = dict()
+
+    @staticmethod
+    def from_granule(granule, first, last):
+        """
+        Returns the decoded flags of records ``first:last``, shared through the granule's
+        product cache so they are only read and unpacked on the first request for the range.
+        The records are read and unpacked a chunk at a time, never all at once
+
+        :param granule: L2 :py:class:`tools.granulecache.Granule`
+        :param int first: first record index
+        :param int last: last record index, exclusive
+        """
+        # A range may run past the end of the granule, only the records it has are decoded
+        last = min(last, granule.get_num_records())
+        return granule.get_product(
+            ('decoded_vfm', first, last),
+            lambda: DecodedVFM(vfm_chunks2block(
+                granule.iter_blocks('Feature_Classification_Flags', first, last), last - first)))
+
+    def get_flags(self):
+        """ The unpacked 16 bit flags """
+        return self.__flags
+
+    def get_type(self):
+        return self.__field('type', extract_type)
+
+    def get_qa(self):
+        return self.__field('qa', extract_qa)
+
+    def get_water_phase(self):
+        return self.__field('water_phase', extract_water_phase)
+
+    def get_water_phase_qa(self):
+        return self.__field('water_phase_qa', extract_water_phase_qa)
+
+    def get_sub_type(self):
+        return self.__field('sub_type', extract_sub_type)
+
+    def get_type_confidence(self):
+        return self.__field('type_confidence', extract_type_confidence)
+
+    def get_horiz_avg(self):
+        return self.__field('horiz_avg', extract_horiz_avg)
+
+    def get_aerosol_subtype(self):
+        """ Sub type where the feature is an aerosol and 0 everywhere else """
+        return self.__sub_type_of('aerosol_subtype', AEROSOL)
+
+    def get_cloud_subtype(self):
+        """ Sub type where the feature is a cloud and 0 everywhere else """
+        return self.__sub_type_of('cloud_subtype', CLOUD)
+
+    def get_psc_subtype(self):
+        """ Sub type where the feature is stratospheric and 0 everywhere else """
+        return self.__sub_type_of('psc_subtype', STRATOSPHERIC)
+
+    def nbytes(self):
+        return self.__flags.nbytes + sum(field.nbytes for field in self.__fields.values())
+
+    def __field(self, name, extract):
+        field = self.__fields.get(name)
+        if field is None:
+            with timed('vfm decode'):
+                field = extract(self.__flags).astype(np.uint8)
+            self.__fields[name] = field
+        return field
+
+    def __sub_type_of(self, name, feature_type):
+        # Built from the cached type and sub type fields rather than the flags
+        field = self.__fields.get(name)
+        if field is None:
+            field = extract_masked(self.get_sub_type(), self.get_type() == feature_type)
+            self.__fields[name] = field
+        return field
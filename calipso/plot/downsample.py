@@ -0,0 +1,79 @@
+#
+# downsample.py
+#
+# Reduces a raster to at most one sample per pixel of the canvas it is drawn
+# on. A wide x range holds many more profiles than the canvas has pixels, and
+# imshow would otherwise resample every one of them on every redraw
+#
+import numpy as np
+
+from log.log import timed_stage
+
+
+def figure_pixels(figure):
+    """
+    Return the width and height in pixels of *figure* as it is on its canvas, which the Tk
+    canvas resizes with the window
+
+    :param figure: ``matplotlib.figure.Figure``
+    """
+    return int(np.ceil(figure.bbox.width)), int(np.ceil(figure.bbox.height))
+
+
+def _bin_edges(length, bins):
+    """ Start index of each of *bins* runs splitting *length* samples as evenly as possible """
+    return (np.arange(bins) * length) // bins
+
+
+def _mean(data, edges, axis):
+    """ Mean of the runs starting at *edges* along *axis*, ignoring NaN, in the dtype of *data* """
+    if data.dtype.kind != 'f':
+        data = data.astype(np.float64)
+    valid = ~np.isnan(data)
+    sums = np.add.reduceat(np.where(valid, data, data.dtype.type(0)), edges, axis=axis)
+    counts = np.add.reduceat(valid, edges, axis=axis, dtype=np.int32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.divide(sums, counts, out=sums)
+
+
+def _mode(data, edges, axis):
+    """ Most common value of the runs starting at *edges* along *axis*, the lowest on a tie """
+    low, high = int(data.min()), int(data.max())
+    # Class rasters hold a handful of small values, counting each one in turn is far cheaper
+    # than sorting the raster to find them
+    classes = range(low, high + 1) if high - low < 32 else np.unique(data)
+    longest = np.diff(np.append(edges, data.shape[axis])).max()
+    count_type = np.uint8 if longest < 256 else np.int32
+    best = mode = None
+    for value in classes:
+        counts = np.add.reduceat((data == value).view(np.uint8), edges, axis=axis,
+                                 dtype=count_type)
+        if best is None:
+            best, mode = counts, np.full(counts.shape, value, data.dtype)
+        else:
+            np.copyto(mode, value, where=counts > best, casting='unsafe')
+            np.maximum(best, counts, out=best)
+    return mode
+
+
+@timed_stage('downsample')
+def downsample(data, columns, rows):
+    """
+    Reduce *data* to at most *columns* x *rows* samples. Integer rasters hold classes, e.g. the
+    VFM feature types, so each pixel gets the most common class of the samples it covers. Float
+    rasters such as the backscatter are averaged, NaN samples are left out of the mean and a
+    pixel with only NaN samples stays NaN. Dimensions already small enough are kept, so a
+    raster that fits is returned as is
+
+    :param data: altitude x column raster, as passed to ``imshow``
+    :param int columns: most columns to keep, e.g. the canvas width in pixels
+    :param int rows: most rows to keep, e.g. the canvas height in pixels
+    :rtype: numpy.ndarray
+    """
+    reduce_ = _mode if data.dtype.kind in 'biu' else _mean
+    data = np.ma.filled(data, np.nan) if data.dtype.kind == 'f' else np.ma.getdata(data)
+    if data.shape[1] > columns > 0:
+        data = reduce_(data, _bin_edges(data.shape[1], columns), 1)
+    if data.shape[0] > rows > 0:
+        data = reduce_(data, _bin_edges(data.shape[0], rows), 0)
+    return data
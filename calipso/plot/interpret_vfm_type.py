@@ -3,12 +3,24 @@
 #   Brian Magill
 #   7/25/2014
 #
+import threading
+
 import numpy as np
 
 mask_3bits = np.uint16(7)
 mask_2bits = np.uint16(3)
 mask_1bit = np.uint16(1)
 
+# Feature types with a sub type, see extract_type and extract_sub_type
+CLOUD = 2
+AEROSOL = 3
+STRATOSPHERIC = 4
+
+# Number of possible 16 bit flag values, the size of the decode_lut tables
+NUM_FLAG_VALUES = 65536
+_lookup_tables = dict()
+_lock = threading.Lock()
+
 def extract_type(vfm_array):
     """
     Extracts feature type for each element in a vertical feature mask array:
@@ -132,14 +144,66 @@ def extract_aerosol_subtype(vfm_array):
         6 = smoke
         7 = other
     """
-    feature_type = extract_type(vfm_array)
-    aerosol_sub_type = extract_sub_type(vfm_array)
+    return extract_sub_type_of(vfm_array, AEROSOL)
+
+def extract_cloud_subtype(vfm_array):
+    """
+    Extracts the cloud sub type using extract_type and extract_sub_type, 0 where the feature
+    is not a cloud. See extract_sub_type for the meaning of the values
+    """
+    return extract_sub_type_of(vfm_array, CLOUD)
 
-    # Iterate through both arrays and mask sub type values where the feature type is not 3
-    for i,j in np.nditer([feature_type, aerosol_sub_type], op_flags=['readwrite']):
-        if i != 3:
-            j[...] = 0
-    return aerosol_sub_type
+def extract_psc_subtype(vfm_array):
+    """
+    Extracts the polar stratospheric cloud sub type using extract_type and extract_sub_type,
+    0 where the feature is not a stratospheric feature. See extract_sub_type for the meaning of
+    the values
+    """
+    return extract_sub_type_of(vfm_array, STRATOSPHERIC)
+
+def extract_sub_type_of(vfm_array, feature_type):
+    """
+    Extracts the sub type where the feature type equals *feature_type* and 0 everywhere else.
+    The whole array is masked at once rather than element by element
+    """
+    return extract_masked(extract_sub_type(vfm_array), extract_type(vfm_array) == feature_type)
+
+def extract_masked(field, condition):
+    """
+    Zeroes *field* wherever *condition* is false, keeping the dtype of *field*. Use this to
+    build other conditional extractors from extracted bitfields, e.g. the cached fields of
+    plot.decoded_vfm.DecodedVFM
+    """
+    return field * condition
+
+def lookup_table(extract):
+    """
+    Returns a NUM_FLAG_VALUES entry uint8 table holding *extract* applied to every possible
+    16 bit flag value. Tables are built on first use and kept, the returned table is shared so
+    it must not be modified
+
+    :param extract: any of the extract_* functions in this module
+    """
+    with _lock:
+        table = _lookup_tables.get(extract)
+        if table is None:
+            flags = np.arange(NUM_FLAG_VALUES, dtype=np.uint16)
+            table = np.asarray(extract(flags)).astype(np.uint8)
+            table.setflags(write=False)
+            _lookup_tables[extract] = table
+        return table
+
+def decode_lut(vfm_array, extract):
+    """
+    Decodes every flag of *vfm_array* through the lookup table of *extract*. This is a single
+    gather for any extractor, so conditional extractors such as extract_aerosol_subtype cost the
+    same as a plain bitfield
+
+    :param vfm_array: array of 16 bit Feature_Classification_Flags
+    :param extract: any of the extract_* functions in this module
+    :rtype: uint8 array the shape of *vfm_array*
+    """
+    return np.take(lookup_table(extract), np.asarray(vfm_array, dtype=np.uint16))
 
 def extract_horiz_avg(vfm_array):
     """
@@ -2,26 +2,25 @@
 # Brian Magill
 # 8/11/2014
 #
-import ccplot.utils
 import numpy as np
 import matplotlib as mpl
-from ccplot.hdf import HDF
-from vfm_row2block import vfm_row2block
-from uniform_alt_2 import uniform_alt_2
-from regrid_lidar import regrid_lidar
-from interpret_vfm_type import extract_aerosol_subtype
-
-def render_aerosol_subtype(filename, x_range, y_range, fig, pfig):
+from decoded_vfm import DecodedVFM
+from altitude_grid import regrid_uniform
+from PCF_genTimeUtils import calipso_time2num
+from prepared_plot import PreparedPlot
+from colormaps import get_colormap
+from downsample import figure_pixels
+from log.log import timed
+
+def prepare_aerosol_subtype(granule, x_range, y_range):
     """
-    Renders the Vertical Feature Mask on the current plot. Note that L2 data is organized
-    differently than L1. See comments below and the CALIPSO data product catalogue for more
-    information before editing
+    Reads the Aerosol Subtype of the range from the granule and regrids it onto the uniform
+    altitude grid. Does not touch matplotlib, so it can run off the Tk thread
 
-    :param filename: L2 HDF file
+    :param granule: L2 granule from tools.granulecache
     :param x_range: Tuple of first and last profile index to load from ToolsWindow
     :param y_range: Tuple of first and last altitude index to load from ToolsWindow
-    :param fig: Matplotlib backend object
-    :param pfig: Matplotlib backend object
+    :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
     """
 
     # 15 profiles are in 1 record of VFM data. At the highest altitudes 5 profiles are averaged
@@ -30,61 +29,56 @@ def render_aerosol_subtype(filename, x_range, y_range, fig, pfig):
     prof_per_row = 15
 
     # constant variables
-    alt_len = 545
-    first_alt = y_range[0]
-    last_alt = y_range[1]
     first_lat = int(x_range[0]/prof_per_row)
     last_lat = int(x_range[1]/prof_per_row)
-    colormap = 'dat/calipso-aerosol_subtype.cmap'
-
-    # naming products within the HDF file
-    with HDF(filename) as product:
-        time = product['Profile_UTC_Time'][first_lat:last_lat, 0]
-        minimum = min(product['Profile_UTC_Time'][::])[0]
-        maximum = max(product['Profile_UTC_Time'][::])[0]
-
-        # Determine how far the file can be viewed
-        if time[-1] >= maximum and len(time) < 950:
-            raise IndexError
-        if time[0] < minimum:
-            raise IndexError
-
-        height = product['metadata']['Lidar_Data_Altitudes'][33:-5:]
-        dataset = product['Feature_Classification_Flags'][first_lat:last_lat]
-        latitude = product['Latitude'][first_lat:last_lat, 0]
-        latitude = latitude[::prof_per_row]
-        time = np.array([ccplot.utils.calipso_time2dt(t) for t in time])
-
-        # Mask all unknown values
-        dataset = np.ma.masked_equal(dataset, -999)
-
-        # Give the number of rows in the dataset
-        num_rows = dataset.shape[0]
-
-        # Create an empty array the size of of L1 array so they match on the plot
-        unpacked_aerosol_subtype = np.zeros((alt_len, prof_per_row * num_rows), np.uint8)
-
-        # Assign the values from 0-7 to subtype
-        aerosol_subtype = extract_aerosol_subtype(dataset)
-
-        # Place 15-wide, alt_len-tall blocks of data into the
-        for i in range(num_rows):
-            unpacked_aerosol_subtype[:, prof_per_row * i:prof_per_row * (i + 1)] = \
-                vfm_row2block(aerosol_subtype[i, :])
-        aerosol_subtype = unpacked_aerosol_subtype
-
-        max_alt = 20
-        unif_alt = uniform_alt_2(max_alt, height)
-        regrid_aerosol_subtype = regrid_lidar(height, aerosol_subtype, unif_alt)
-
-        # Format color map
-        cmap = ccplot.utils.cmap(colormap)
-        cm = mpl.colors.ListedColormap(cmap['colors'] / 255.0)
-        cm.set_under(cmap['under'] / 255.0)
-        cm.set_over(cmap['over'] / 255.0)
-        cm.set_bad(cmap['bad'] / 255.0)
-        norm = mpl.colors.BoundaryNorm(cmap['bounds'], cm.N)
 
+    # Determine how far the file can be viewed from the granule metadata
+    granule.check_range(first_lat, last_lat)
+
+    time = granule.get_time()[first_lat:last_lat]
+
+    height = granule.get_altitude()[33:-5:]
+    latitude = granule.get_latitude()[first_lat:last_lat]
+    latitude = latitude[::prof_per_row]
+    time = calipso_time2num(time)
+
+    # The flags are read and unpacked to 15-wide, 545-tall blocks per row once for the range and
+    # shared with the other L2 plots, so switching between them does not decode them again
+    aerosol_subtype = DecodedVFM.from_granule(granule, first_lat, last_lat).get_aerosol_subtype()
+
+    max_alt = 20
+    # Nearest neighbour keeps the class values exact instead of blending neighbouring classes
+    regrid_aerosol_subtype = regrid_uniform(height, aerosol_subtype, max_alt, method='nearest')
+
+    # Covers only the records the granule has when the range runs past its end
+    return PreparedPlot(regrid_aerosol_subtype, latitude, time,
+                        (first_lat * prof_per_row, first_lat * prof_per_row + regrid_aerosol_subtype.shape[1]))
+
+def draw_aerosol_subtype(prepared, y_range, fig, pfig):
+    """
+    Draws the Aerosol Subtype returned by :py:func:`prepare_aerosol_subtype`, must be called
+    on the Tk thread
+
+    :param prepared: :py:class:`plot.prepared_plot.PreparedPlot` of the range
+    :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+    :param fig: Matplotlib backend object
+    :param pfig: Matplotlib backend object
+    """
+    # At most one sample per pixel of the canvas, more would only be resampled away
+    prepared = prepared.downsample(*figure_pixels(pfig))
+    regrid_aerosol_subtype = prepared.get_data()
+    latitude = prepared.get_latitude()
+    time = prepared.get_time()
+    first_alt = y_range[0]
+    last_alt = y_range[1]
+
+    # Shared color map, the .cmap file is only parsed by the first render
+    with timed('colormap'):
+        colormap = get_colormap('aerosol_subtype')
+        cm = colormap.get_cmap()
+        norm = colormap.get_norm()
+
+    with timed('imshow'):
         im = fig.imshow(
             regrid_aerosol_subtype,
             extent=(latitude[0], latitude[-1], first_alt, last_alt),
@@ -94,26 +88,42 @@ def render_aerosol_subtype(filename, x_range, y_range, fig, pfig):
             interpolation='nearest',
         )
 
-        fig.set_ylabel('Altitude (km)')
-        fig.set_xlabel('Latitude')
-        fig.set_title('Aerosol Subtype')
+    fig.set_ylabel('Altitude (km)')
+    fig.set_xlabel('Latitude')
+    fig.set_title('Aerosol Subtype')
+
+    cbar_label = 'Aerosol Subtype Flags'
+    cbar = pfig.colorbar(im)
+    cbar.set_label(cbar_label)
+    cbar.ax.set_yticklabels(['N/a','Clean Marine','Dust','Polluted\nContinental','Clean\nContinental',
+                         'Polluted\nDust','Smoke','Other'])
 
-        cbar_label = 'Aerosol Subtype Flags'
-        cbar = pfig.colorbar(im)
-        cbar.set_label(cbar_label)
-        cbar.ax.set_yticklabels(['N/a','Clean Marine','Dust','Polluted\nContinental','Clean\nContinental',
-                             'Polluted\nDust','Smoke','Other'])
+    ax = fig.twiny()
+    ax.xaxis_date()
+    ax.set_xlabel('Time')
+    ax.set_xlim(time[0], time[-1])
+    ax.get_xaxis().set_major_formatter(mpl.dates.DateFormatter('%H:%M:%S'))
 
-        ax = fig.twiny()
-        ax.set_xlabel('Time')
-        ax.set_xlim(time[0], time[-1])
-        ax.get_xaxis().set_major_formatter(mpl.dates.DateFormatter('%H:%M:%S'))
+    fig.set_zorder(0)
+    ax.set_zorder(1)
 
-        fig.set_zorder(0)
-        ax.set_zorder(1)
+    title = fig.set_title('Aerosol Subtype')
+    title_xy = title.get_position()
+    title.set_position([title_xy[0], title_xy[1] * 1.07])
 
-        title = fig.set_title('Aerosol Subtype')
-        title_xy = title.get_position()
-        title.set_position([title_xy[0], title_xy[1] * 1.07])
+    return ax
 
-        return ax
\ No newline at end of file
+def render_aerosol_subtype(granule, x_range, y_range, fig, pfig):
+    """
+    Renders the Vertical Feature Mask on the current plot. Note that L2 data is organized
+    differently than L1. See comments below and the CALIPSO data product catalogue for more
+    information before editing
+
+    :param granule: L2 granule from tools.granulecache
+    :param x_range: Tuple of first and last profile index to load from ToolsWindow
+    :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+    :param fig: Matplotlib backend object
+    :param pfig: Matplotlib backend object
+    """
+    prepared = prepare_aerosol_subtype(granule, x_range, y_range)
+    return draw_aerosol_subtype(prepared, y_range, fig, pfig)
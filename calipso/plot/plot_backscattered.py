@@ -7,74 +7,99 @@
 # 8/11/2014
 #
 
-from ccplot.hdf import HDF
-import ccplot.utils
-
 import matplotlib as mpl
 import numpy as np
 
-from plot.avg_lidar_data import avg_horz_data
-from plot.uniform_alt_2 import uniform_alt_2
-from plot.regrid_lidar import regrid_lidar
+from plot.averaged_backscatter import AveragedBackscatter
+from plot.altitude_grid import regrid_uniform
+from plot.PCF_genTimeUtils import calipso_time2num
+from plot.prepared_plot import PreparedPlot
+from plot.colormaps import get_colormap
+from plot.downsample import figure_pixels
+from log.log import timed
 
 # from gui.CALIPSO_Visualization_Tool import filename
-# noinspection PyUnresolvedReferences
-def render_backscattered(filename, x_range, y_range, fig, pfig):
-    x1 = x_range[0]
-    x2 = x_range[1]
-    h1 = y_range[0]
-    h2 = y_range[1]
-    # averaging_width = 15
+def get_averaging_width(x_range):
+    """
+    Number of profiles averaged into each column of the backscatter of *x_range*, one per
+    thousand profiles in the range, kept between 5 and 15
+
+    :param x_range: Tuple of first and last profile index
+    """
     # Adjust the averaging with so its uniform per range
-    averaging_width = int((x2-x1)/1000)
+    averaging_width = int((x_range[1] - x_range[0]) / 1000)
     if averaging_width < 5:
         averaging_width = 5
     if averaging_width > 15:
         averaging_width = 15
+    return averaging_width
 
-    colormap = 'dat/calipso-backscatter.cmap'
-
-    print('xrange: ' + str(x_range) + ', yrange: ' + str(y_range))
-
-    with HDF(filename) as product:
-        time = product['Profile_UTC_Time'][x1:x2, 0]
-        minimum = min(product['Profile_UTC_Time'][::])[0]
-        maximum = max(product['Profile_UTC_Time'][::])[0]
-        
-        # length of time determines how far the file can be viewed
-        if time[-1] >= maximum and len(time) < 950:
-            raise IndexError
-        if time[0] < minimum:
-            raise IndexError
-
-        alt = product['metadata']['Lidar_Data_Altitudes']
-        dataset = product['Total_Attenuated_Backscatter_532'][x1:x2].T
-        latitude = product['Latitude'][x1:x2, 0]
-        latitude = latitude[::averaging_width]
-
-
-        print(np.shape(time))
-
-        time = np.array([ccplot.utils.calipso_time2dt(t) for t in time])
-        dataset = np.ma.masked_equal(dataset, -9999)
-
-        # The following method has been translated from MatLab code written by R. Kuehn 7/10/07
-        # Translated by Collin Pampalone 7/19/17
-        avg_dataset = avg_horz_data(dataset, averaging_width)
-        # Put altitudes above 8.2 km on same spacing as lower ones
-        MAX_ALT = 20
-        unif_alt = uniform_alt_2(MAX_ALT, alt)
-        regrid_dataset = regrid_lidar(alt, avg_dataset, unif_alt)
-        data = regrid_dataset
-        # End method
-        
-        cmap = ccplot.utils.cmap(colormap)
-        cm = mpl.colors.ListedColormap(cmap['colors']/255.0)
-        cm.set_under(cmap['under']/255.0)
-        cm.set_over(cmap['over']/255.0)
-        cm.set_bad(cmap['bad']/255.0)
-        norm = mpl.colors.BoundaryNorm(cmap['bounds'], cm.N)
-        
+# noinspection PyUnresolvedReferences
+def prepare_backscattered(granule, x_range, y_range):
+    """
+    Reads the 532 nm total attenuated backscatter of the range from the granule, averages it
+    horizontally and regrids it onto the uniform altitude grid. Does not touch matplotlib, so
+    it can run off the Tk thread
+
+    :param granule: L1 granule from tools.granulecache
+    :param x_range: Tuple of first and last profile index to load from ToolsWindow
+    :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+    :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
+    """
+    x1 = x_range[0]
+    x2 = x_range[1]
+    averaging_width = get_averaging_width(x_range)
+
+    # Determine how far the file can be viewed from the granule metadata
+    granule.check_range(x1, x2)
+
+    time = granule.get_time()[x1:x2]
+
+    alt = granule.get_altitude()
+    latitude = granule.get_latitude()[x1:x2]
+    latitude = latitude[::averaging_width]
+
+    time = calipso_time2num(time)
+
+    # The following method has been translated from MatLab code written by R. Kuehn 7/10/07
+    # Translated by Collin Pampalone 7/19/17
+    # -9999 fill values are left out of the average, which the depolarization ratio of the
+    # same range and width shares
+    avg_dataset = AveragedBackscatter.from_granule(granule, x1, x2, averaging_width).get_total()
+    # Put altitudes above 8.2 km on same spacing as lower ones
+    MAX_ALT = 20
+    regrid_dataset = regrid_uniform(alt, avg_dataset, MAX_ALT)
+    # End method
+
+    # Trailing profiles that do not fill a whole average are dropped
+    covered = (x1, x1 + regrid_dataset.shape[1] * averaging_width)
+    return PreparedPlot(regrid_dataset, latitude, time, covered)
+
+def draw_backscattered(prepared, y_range, fig, pfig):
+    """
+    Draws the backscatter returned by :py:func:`prepare_backscattered`, must be called on the
+    Tk thread
+
+    :param prepared: :py:class:`plot.prepared_plot.PreparedPlot` of the range
+    :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+    :param fig: Matplotlib backend object
+    :param pfig: Matplotlib backend object
+    """
+    # At most one sample per pixel of the canvas, more would only be resampled away
+    prepared = prepared.downsample(*figure_pixels(pfig))
+    data = prepared.get_data()
+    latitude = prepared.get_latitude()
+    time = prepared.get_time()
+    h1 = y_range[0]
+    h2 = y_range[1]
+
+    # Shared color map, the .cmap file is only parsed by the first render
+    with timed('colormap'):
+        colormap = get_colormap('backscatter')
+        cm = colormap.get_cmap()
+        norm = colormap.get_norm()
+    
+    with timed('imshow'):
         im = fig.imshow(
             #data.T,
             data,
@@ -85,24 +110,28 @@ def render_backscattered(filename, x_range, y_range, fig, pfig):
             interpolation='nearest',
         )
 
-        fig.set_ylabel('Altitude (km)')
-        fig.set_xlabel('Latitude')
-        fig.set_title("Averaged 532 nm Total Attenuated Backscatter")
-       
-        cbar_label = 'Total Attenuated Backscatter 532nm (km$^{-1}$ sr$^{-1}$)'
-        cbar = pfig.colorbar(im)
-        cbar.set_label(cbar_label)
-
-        ax = fig.twiny()
-        ax.set_xlabel('Time')
-        ax.set_xlim(time[0], time[-1])
-        ax.get_xaxis().set_major_formatter(mpl.dates.DateFormatter('%H:%M:%S'))
+    fig.set_ylabel('Altitude (km)')
+    fig.set_xlabel('Latitude')
+    fig.set_title("Averaged 532 nm Total Attenuated Backscatter")
+   
+    cbar_label = 'Total Attenuated Backscatter 532nm (km$^{-1}$ sr$^{-1}$)'
+    cbar = pfig.colorbar(im)
+    cbar.set_label(cbar_label)
+
+    ax = fig.twiny()
+    ax.xaxis_date()
+    ax.set_xlabel('Time')
+    ax.set_xlim(time[0], time[-1])
+    ax.get_xaxis().set_major_formatter(mpl.dates.DateFormatter('%H:%M:%S'))
  
-        fig.set_zorder(0)
-        ax.set_zorder(1)
+    fig.set_zorder(0)
+    ax.set_zorder(1)
+
+    title = fig.set_title('Averaged 532 nm Total Attenuated Backscatter')
+    title_xy = title.get_position()
+    title.set_position([title_xy[0], title_xy[1]*1.07])
 
-        title = fig.set_title('Averaged 532 nm Total Attenuated Backscatter')
-        title_xy = title.get_position()
-        title.set_position([title_xy[0], title_xy[1]*1.07])
+    return ax
 
-        return ax
+def render_backscattered(granule, x_range, y_range, fig, pfig):
+    return draw_backscattered(prepare_backscattered(granule, x_range, y_range), y_range, fig, pfig)
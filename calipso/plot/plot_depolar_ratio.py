@@ -5,61 +5,89 @@
 # 8/11/2014
 #
 
-from ccplot.hdf import HDF
-import ccplot.utils
-
 import matplotlib as mpl
 import numpy as np
-from plot.avg_lidar_data import avg_horz_data
-from plot.uniform_alt_2 import uniform_alt_2
-from plot.regrid_lidar import regrid_lidar
-
-def render_depolarized(filename, x_range, y_range, fig, pfig):
+from plot.averaged_backscatter import AveragedBackscatter
+from plot.altitude_grid import regrid_uniform
+from plot.PCF_genTimeUtils import calipso_time2num
+from plot.prepared_plot import PreparedPlot
+from plot.colormaps import get_colormap
+from plot.downsample import figure_pixels
+from log.log import timed
+
+def get_averaging_width(x_range):
+    """
+    Number of profiles averaged into each column of the depolarization ratio of *x_range*,
+    always 5. The backscatter plot of a range shares its
+    :py:class:`plot.averaged_backscatter.AveragedBackscatter` when it averages 5 profiles too
+
+    :param x_range: Tuple of first and last profile index
+    """
+    return 5
+
+def prepare_depolarized(granule, x_range, y_range):
+    """
+    Reads the total and perpendicular 532 nm backscatter of the range from the granule, averages
+    them horizontally and regrids their depolarization ratio onto the uniform altitude grid.
+    Does not touch matplotlib, so it can run off the Tk thread
+
+    :param granule: L1 granule from tools.granulecache
+    :param x_range: Tuple of first and last profile index to load from ToolsWindow
+    :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+    :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
+    """
     x1 = x_range[0]
     x2 = x_range[1]
+    averaging_width = get_averaging_width(x_range)
+
+    # Determine how far the file can be viewed from the granule metadata
+    granule.check_range(x1, x2)
+
+    time = granule.get_time()[x1:x2]
+    alt = granule.get_altitude()
+    latitude = granule.get_latitude()[x1:x2]
+
+    time = calipso_time2num(time)
+    latitude = latitude[::averaging_width]
+
+    # Both backscatters are averaged and divided in one pass over the two datasets, or only
+    # the perpendicular one when the backscatter plot already averaged the total
+    depolar_ratio = AveragedBackscatter.from_granule(
+        granule, x1, x2, averaging_width).get_depolarization_ratio()
+
+    # Put altitudes above 8.2 km on same spacing as lower ones
+    MAX_ALT = 20
+    regrid_depolar_ratio = regrid_uniform(alt, depolar_ratio, MAX_ALT)
+
+    # Trailing profiles that do not fill a whole average are dropped
+    covered = (x1, x1 + regrid_depolar_ratio.shape[1] * averaging_width)
+    return PreparedPlot(regrid_depolar_ratio, latitude, time, covered)
+
+def draw_depolarized(prepared, y_range, fig, pfig):
+    """
+    Draws the depolarization ratio returned by :py:func:`prepare_depolarized`, must be called
+    on the Tk thread
+
+    :param prepared: :py:class:`plot.prepared_plot.PreparedPlot` of the range
+    :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+    :param fig: Matplotlib backend object
+    :param pfig: Matplotlib backend object
+    """
+    # At most one sample per pixel of the canvas, more would only be resampled away
+    prepared = prepared.downsample(*figure_pixels(pfig))
+    regrid_depolar_ratio = prepared.get_data()
+    latitude = prepared.get_latitude()
+    time = prepared.get_time()
     h1 = y_range[0]
     h2 = y_range[1]
-    colormap = 'dat/calipso-depolar.cmap'
-    averaging_width = 5
-
-    print('xrange: ' + str(x_range) + ', yrange: ' + str(y_range))
-
-    with HDF(filename) as product:
-        time = product['Profile_UTC_Time'][x1:x2, 0]
-        alt = product['metadata']['Lidar_Data_Altitudes']
-        minimum = min(product['Profile_UTC_Time'][::])[0]
-        maximum = max(product['Profile_UTC_Time'][::])[0]
-        latitude = product['Latitude'][x1:x2, 0]
-
-        # length of time determines how far the file can be viewed
-        if time[-1] >= maximum and len(time) < 950:
-            raise IndexError
-        if time[0] < minimum:
-            raise IndexError
-
-        time = np.array([ccplot.utils.calipso_time2dt(t) for t in time])
-        latitude = latitude[::averaging_width]
-
-        tot_532 = product['Total_Attenuated_Backscatter_532'][x1:x2].T
-        perp_532 = product['Perpendicular_Attenuated_Backscatter_532'][x1:x2].T
-        avg_tot_532 = avg_horz_data(tot_532, averaging_width)
-        avg_perp_532 = avg_horz_data(perp_532, averaging_width)
-
-        avg_parallel_AB = avg_tot_532 - avg_perp_532
-        depolar_ratio = avg_perp_532/avg_parallel_AB
-
-        # Put altitudes above 8.2 km on same spacing as lower ones
-        MAX_ALT = 20
-        unif_alt = uniform_alt_2(MAX_ALT, alt)
-        regrid_depolar_ratio = regrid_lidar(alt, depolar_ratio, unif_alt)
-
-        cmap = ccplot.utils.cmap(colormap)
-        cm = mpl.colors.ListedColormap(cmap['colors']/255.0)
-        cm.set_under(cmap['under']/255.0)
-        cm.set_over(cmap['over']/255.0)
-        cm.set_bad(cmap['bad']/255.0)
-        norm = mpl.colors.BoundaryNorm(cmap['bounds'], cm.N)
 
+    # Shared color map, the .cmap file is only parsed by the first render
+    with timed('colormap'):
+        colormap = get_colormap('depolar')
+        cm = colormap.get_cmap()
+        norm = colormap.get_norm()
+
+    with timed('imshow'):
         im = fig.imshow(
             regrid_depolar_ratio,
             extent=(latitude[0], latitude[-1], h1, h2),
@@ -69,24 +97,28 @@ def render_depolarized(filename, x_range, y_range, fig, pfig):
             interpolation='nearest',
         )
 
-        fig.set_ylabel('Altitude (km)')
-        fig.set_xlabel('Latitude')
-        fig.set_title("532 nm Depolarization Ratio")
-       
-        cbar_label = 'Depolarization Ratio'
-        cbar = pfig.colorbar(im)
-        cbar.set_label(cbar_label)
-
-        ax = fig.twiny()
-        ax.set_xlabel('Time')
-        ax.set_xlim(time[0], time[-1])
-        ax.get_xaxis().set_major_formatter(mpl.dates.DateFormatter('%H:%M:%S'))
+    fig.set_ylabel('Altitude (km)')
+    fig.set_xlabel('Latitude')
+    fig.set_title("532 nm Depolarization Ratio")
+   
+    cbar_label = 'Depolarization Ratio'
+    cbar = pfig.colorbar(im)
+    cbar.set_label(cbar_label)
+
+    ax = fig.twiny()
+    ax.xaxis_date()
+    ax.set_xlabel('Time')
+    ax.set_xlim(time[0], time[-1])
+    ax.get_xaxis().set_major_formatter(mpl.dates.DateFormatter('%H:%M:%S'))
  
-        fig.set_zorder(0)
-        ax.set_zorder(1)
+    fig.set_zorder(0)
+    ax.set_zorder(1)
+
+    title = fig.set_title('532 nm Depolarized Ratio')
+    title_xy = title.get_position()
+    title.set_position([title_xy[0], title_xy[1]*1.07])
 
-        title = fig.set_title('532 nm Depolarized Ratio')
-        title_xy = title.get_position()
-        title.set_position([title_xy[0], title_xy[1]*1.07])
+    return ax
 
-        return ax
+def render_depolarized(granule, x_range, y_range, fig, pfig):
+    return draw_depolarized(prepare_depolarized(granule, x_range, y_range), y_range, fig, pfig)
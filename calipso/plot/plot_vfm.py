@@ -2,26 +2,26 @@
 # Brian Magill
 # 8/11/2014
 #
-import ccplot.utils
 import numpy as np
 import matplotlib as mpl
-from ccplot.hdf import HDF
-from vfm_row2block import vfm_row2block
-from uniform_alt_2 import uniform_alt_2
-from regrid_lidar import regrid_lidar
-from interpret_vfm_type import extract_type, Feature_Type
-
-def render_vfm(filename, x_range, y_range, fig, pfig):
+from decoded_vfm import DecodedVFM
+from altitude_grid import regrid_uniform
+from PCF_genTimeUtils import calipso_time2num
+from prepared_plot import PreparedPlot
+from colormaps import get_colormap
+from downsample import figure_pixels
+from log.log import timed
+from interpret_vfm_type import Feature_Type
+
+def prepare_vfm(granule, x_range, y_range):
     """
-    Renders the Vertical Feature Mask on the current plot. Note that L2 data is organized
-    differently than L1. See comments below and the CALIPSO data product catalogue for more
-    information before editing
+    Reads the Vertical Feature Mask of the range from the granule and regrids it onto the uniform
+    altitude grid. Does not touch matplotlib, so it can run off the Tk thread
 
-    :param filename: L2 HDF file
+    :param granule: L2 granule from tools.granulecache
     :param x_range: Tuple of first and last profile index to load from ToolsWindow
     :param y_range: Tuple of first and last altitude index to load from ToolsWindow
-    :param fig: Matplotlib backend object
-    :param pfig: Matplotlib backend object
+    :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
     """
 
     # 15 profiles are in 1 record of VFM data. At the highest altitudes 5 profiles are averaged
@@ -30,60 +30,56 @@ def render_vfm(filename, x_range, y_range, fig, pfig):
     prof_per_row = 15
 
     # constant variables
-    alt_len = 545
-    first_alt = y_range[0]
-    last_alt = y_range[1]
     first_lat = int(x_range[0]/prof_per_row)
     last_lat = int(x_range[1]/prof_per_row)
-    colormap = 'dat/calipso-vfm.cmap'
-
-    # naming products within the HDF file
-    with HDF(filename) as product:
-        time = product['Profile_UTC_Time'][first_lat:last_lat, 0]
-        minimum = min(product['Profile_UTC_Time'][::])[0]
-        maximum = max(product['Profile_UTC_Time'][::])[0]
-
-        # Determine how far the file can be viewed
-        if time[-1] >= maximum and len(time) < 950:
-            raise IndexError
-        if time[0] < minimum:
-            raise IndexError
-
-        height = product['metadata']['Lidar_Data_Altitudes'][33:-5:]
-        dataset = product['Feature_Classification_Flags'][first_lat:last_lat]
-        latitude = product['Latitude'][first_lat:last_lat, 0]
-        latitude = latitude[::prof_per_row]
-        time = np.array([ccplot.utils.calipso_time2dt(t) for t in time])
-
-        # Mask all unknown values
-        dataset = np.ma.masked_equal(dataset, -999)
-
-        # Give the number of rows in the dataset
-        num_rows = dataset.shape[0]
-
-        # Create an empty array the size of of L1 array so they match on the plot
-        unpacked_vfm = np.zeros((alt_len, prof_per_row * num_rows), np.uint8)
-
-        # Assign the values from 0-7 to subtype
-        vfm = extract_type(dataset)
-
-        # Place 15-wide, alt_len-tall blocks of data into the
-        for i in range(num_rows):
-            unpacked_vfm[:, prof_per_row * i:prof_per_row * (i + 1)] = vfm_row2block(vfm[i, :])
-        vfm = unpacked_vfm
-
-        max_alt = 20
-        unif_alt = uniform_alt_2(max_alt, height)
-        regrid_vfm = regrid_lidar(height, vfm, unif_alt)
-
-        # Format color map
-        cmap = ccplot.utils.cmap(colormap)
-        cm = mpl.colors.ListedColormap(cmap['colors'] / 255.0)
-        cm.set_under(cmap['under'] / 255.0)
-        cm.set_over(cmap['over'] / 255.0)
-        cm.set_bad(cmap['bad'] / 255.0)
-        norm = mpl.colors.BoundaryNorm(cmap['bounds'], cm.N)
 
+    # Determine how far the file can be viewed from the granule metadata
+    granule.check_range(first_lat, last_lat)
+
+    time = granule.get_time()[first_lat:last_lat]
+
+    height = granule.get_altitude()[33:-5:]
+    latitude = granule.get_latitude()[first_lat:last_lat]
+    latitude = latitude[::prof_per_row]
+    time = calipso_time2num(time)
+
+    # The flags are read and unpacked to 15-wide, 545-tall blocks per row once for the range and
+    # shared with the other L2 plots, so switching between them does not decode them again
+    vfm = DecodedVFM.from_granule(granule, first_lat, last_lat).get_type()
+
+    max_alt = 20
+    # Nearest neighbour keeps the class values exact instead of blending neighbouring classes
+    regrid_vfm = regrid_uniform(height, vfm, max_alt, method='nearest')
+
+    # Covers only the records the granule has when the range runs past its end
+    return PreparedPlot(regrid_vfm, latitude, time,
+                        (first_lat * prof_per_row, first_lat * prof_per_row + regrid_vfm.shape[1]))
+
+def draw_vfm(prepared, y_range, fig, pfig):
+    """
+    Draws the Vertical Feature Mask returned by :py:func:`prepare_vfm`, must be called
+    on the Tk thread
+
+    :param prepared: :py:class:`plot.prepared_plot.PreparedPlot` of the range
+    :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+    :param fig: Matplotlib backend object
+    :param pfig: Matplotlib backend object
+    """
+    # At most one sample per pixel of the canvas, more would only be resampled away
+    prepared = prepared.downsample(*figure_pixels(pfig))
+    regrid_vfm = prepared.get_data()
+    latitude = prepared.get_latitude()
+    time = prepared.get_time()
+    first_alt = y_range[0]
+    last_alt = y_range[1]
+
+    # Shared color map, the .cmap file is only parsed by the first render
+    with timed('colormap'):
+        colormap = get_colormap('vfm')
+        cm = colormap.get_cmap()
+        norm = colormap.get_norm()
+
+    with timed('imshow'):
         im = fig.imshow(
             regrid_vfm,
             extent=(latitude[0], latitude[-1], first_alt, last_alt),
@@ -93,27 +89,42 @@ def render_vfm(filename, x_range, y_range, fig, pfig):
             interpolation='nearest',
         )
 
-        fig.set_ylabel('Altitude (km)')
-        fig.set_xlabel('Latitude')
-        fig.set_title("Vertical Feature Mask")
+    fig.set_ylabel('Altitude (km)')
+    fig.set_xlabel('Latitude')
+    fig.set_title("Vertical Feature Mask")
+
+    cbar_label = 'Vertical Feature Mask Flags'
+    cbar = pfig.colorbar(im)
+    cbar.set_label(cbar_label)
+    # Set labels using dict in interpret_vfm_type
+    cbar.ax.set_yticklabels(['Clear\nAir','Cloud','Aerosol','Stratospheric\nAerosol',
+                    'Surface','Subsurface','Totally\nAttenuated'])
 
-        cbar_label = 'Vertical Feature Mask Flags'
-        cbar = pfig.colorbar(im)
-        cbar.set_label(cbar_label)
-        # Set labels using dict in interpret_vfm_type
-        cbar.ax.set_yticklabels(['Clear\nAir','Cloud','Aerosol','Stratospheric\nAerosol',
-                        'Surface','Subsurface','Totally\nAttenuated'])
+    ax = fig.twiny()
+    ax.xaxis_date()
+    ax.set_xlabel('Time')
+    ax.set_xlim(time[0], time[-1])
+    ax.get_xaxis().set_major_formatter(mpl.dates.DateFormatter('%H:%M:%S'))
 
-        ax = fig.twiny()
-        ax.set_xlabel('Time')
-        ax.set_xlim(time[0], time[-1])
-        ax.get_xaxis().set_major_formatter(mpl.dates.DateFormatter('%H:%M:%S'))
+    fig.set_zorder(0)
+    ax.set_zorder(1)
 
-        fig.set_zorder(0)
-        ax.set_zorder(1)
+    title = fig.set_title('Vertical Feature Mask')
+    title_xy = title.get_position()
+    title.set_position([title_xy[0], title_xy[1] * 1.07])
 
-        title = fig.set_title('Vertical Feature Mask')
-        title_xy = title.get_position()
-        title.set_position([title_xy[0], title_xy[1] * 1.07])
+    return ax
 
-        return ax
\ No newline at end of file
+def render_vfm(granule, x_range, y_range, fig, pfig):
+    """
+    Renders the Vertical Feature Mask on the current plot. Note that L2 data is organized
+    differently than L1. See comments below and the CALIPSO data product catalogue for more
+    information before editing
+
+    :param granule: L2 granule from tools.granulecache
+    :param x_range: Tuple of first and last profile index to load from ToolsWindow
+    :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+    :param fig: Matplotlib backend object
+    :param pfig: Matplotlib backend object
+    """
+    return draw_vfm(prepare_vfm(granule, x_range, y_range), y_range, fig, pfig)
@@ -0,0 +1,120 @@
+#
+# plot_view.py
+#
+# The matplotlib objects of the plot on screen. The first render of a plot type
+# builds its axes, image, colorbar and time axis with the draw_* function,
+# every pan after that only swaps the data of the image and moves the limits
+#
+from matplotlib.image import AxesImage
+
+from colormaps import find_colormap
+from downsample import figure_pixels
+from log.log import timed
+
+
+class ColoredImage(AxesImage):
+    """
+    Image holding its raster already colored, the cursor readout reads the value under the
+    cursor from the raster instead of the RGBA pixels of ``get_array``
+
+    :param image: ``AxesImage`` drawn by a draw_* function, whose place and colormap it takes
+    """
+
+    def __init__(self, image):
+        AxesImage.__init__(self, image.axes, cmap=image.get_cmap(), norm=image.norm,
+                           interpolation=image.get_interpolation(), origin=image.origin,
+                           extent=image.get_extent())
+        self.update_from(image)
+        self.__raster = image.get_array()
+
+    def get_raster(self):
+        """ The raster shown, before it is colored """
+        return self.__raster
+
+    def set_raster(self, raster, colored):
+        """
+        Show *raster* as the *colored* pixels, or as itself if they are ``None``
+        """
+        self.__raster = raster
+        self.set_data(raster if colored is None else colored)
+
+    def get_cursor_data(self, event):
+        xmin, xmax, ymin, ymax = self.get_extent()
+        if self.origin == 'upper':
+            ymin, ymax = ymax, ymin
+        rows, columns = self.__raster.shape[:2]
+        if event.xdata is None or event.ydata is None or xmin == xmax or ymin == ymax:
+            return None
+        row = int((event.ydata - ymin) / (ymax - ymin) * rows)
+        column = int((event.xdata - xmin) / (xmax - xmin) * columns)
+        if not (0 <= row < rows and 0 <= column < columns):
+            return None
+        return self.__raster[row, column]
+
+
+class PlotView(object):
+    """
+    The axes drawn by a draw_* function, kept alive across pans of the same plot type. The
+    colormap, norm, colorbar, labels and title do not depend on the range shown, so a pan only
+    has to replace the raster of the image, its extent and the limits of both x axes
+
+    Float rasters are held by the image already colored through the lookup table of their
+    shared :py:class:`plot.colormaps.Colormap`, so redrawing the canvas, e.g. while a shape is
+    sketched, resamples RGBA pixels instead of running the norm over the raster each time. The
+    image drawn is replaced by a :py:class:`ColoredImage` for this, which keeps the raster for
+    the cursor readout
+
+    :param int plot_type: plot type from ``constants.Plot`` drawn to the axes
+    :param axes: latitude axes the image was drawn to
+    :param twin: time axes returned by the draw_* function
+    """
+
+    def __init__(self, plot_type, axes, twin):
+        self.__plot_type = plot_type
+        self.__axes = axes
+        self.__twin = twin
+        drawn = axes.images[-1]
+        self.__image = ColoredImage(drawn)
+        drawn.remove()
+        axes.add_image(self.__image)
+        self.__colormap = find_colormap(self.__image.get_cmap())
+        self.__set_data(self.__image.get_raster())
+
+    def get_plot_type(self):
+        return self.__plot_type
+
+    def get_twin(self):
+        return self.__twin
+
+    def get_data(self):
+        """ The raster shown, before it is colored """
+        return self.__image.get_raster()
+
+    def __set_data(self, data):
+        colored = None
+        # Class rasters are small integers the norm bins quickly, coloring them up front would
+        # only make matplotlib check four times the bytes for NaN
+        if self.__colormap is not None and data.dtype.kind == 'f':
+            with timed('colorize'):
+                colored = self.__colormap.colorize(data)
+        self.__image.set_raster(data, colored)
+
+    def update(self, prepared, y_range):
+        """
+        Show *prepared* in place of the current range, nothing is drawn until the canvas is
+
+        :param prepared: :py:class:`plot.prepared_plot.PreparedPlot` of the new range
+        :param y_range: Tuple of first and last altitude index to load from ToolsWindow
+        :returns: the time axes, as the draw_* functions return it
+        """
+        prepared = prepared.downsample(*figure_pixels(self.__axes.figure))
+        latitude = prepared.get_latitude()
+        time = prepared.get_time()
+        self.__set_data(prepared.get_data())
+        with timed('set limits'):
+            self.__image.set_extent((latitude[0], latitude[-1], y_range[0], y_range[1]))
+            # The extent only moves the limits while autoscaling, which a zoom turns off
+            self.__axes.set_xlim(latitude[0], latitude[-1])
+            self.__axes.set_ylim(y_range[0], y_range[1])
+            self.__twin.set_xlim(time[0], time[-1])
+        return self.__twin
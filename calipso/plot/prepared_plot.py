@@ -0,0 +1,117 @@
+#
+# prepared_plot.py
+#
+# Result of the data preparation half of a renderer. The prepare_* functions
+# read, decode, average and regrid off the Tk thread and hand one of these to
+# the matching draw_* function, which only draws it
+#
+import numpy as np
+
+from plot.downsample import downsample
+
+
+class PreparedPlot(object):
+    """
+    The raster of a plot regridded onto the uniform altitude grid, with the latitude and time
+    of its columns and the range of profiles the columns cover
+
+    The latitude and time arrays are only assumed to be evenly spread over the profiles of the
+    range, the drawing functions use their end points for the axes
+
+    :param data: altitude x column raster passed to ``imshow``
+    :param latitude: latitude of the columns of *data*
+    :param time: matplotlib date numbers of the profiles in the range
+    :param x_range: Tuple of the first and last profile index covered by the columns, exclusive
+    """
+
+    def __init__(self, data, latitude, time, x_range):
+        self.__data = data
+        self.__latitude = latitude
+        self.__time = time
+        self.__x_range = tuple(x_range)
+
+    def get_data(self):
+        return self.__data
+
+    def get_latitude(self):
+        return self.__latitude
+
+    def get_time(self):
+        return self.__time
+
+    def get_x_range(self):
+        return self.__x_range
+
+    def get_profiles_per_column(self):
+        return float(self.__x_range[1] - self.__x_range[0]) / self.__data.shape[1]
+
+    def covers(self, x_range):
+        """ Return ``True`` if the profiles of *x_range* all lie inside this plot """
+        return self.__x_range[0] <= x_range[0] and x_range[1] <= self.__x_range[1]
+
+    def crop(self, x_range):
+        """
+        Return the columns of this plot covering the profiles *x_range*, which must lie inside
+        :py:meth:`get_x_range`. The range is snapped to whole columns the same way a fresh
+        render drops a trailing partial average, so the returned x range may start up to one
+        column before the one asked for. The raster is a view, not a copy
+
+        :param x_range: Tuple of the first and last profile index, exclusive
+        :rtype: :py:class:`PreparedPlot`
+        """
+        first, last = self.__x_range
+        per_column = self.get_profiles_per_column()
+        first_col = int((x_range[0] - first) // per_column)
+        last_col = min(first_col + int((x_range[1] - x_range[0]) // per_column),
+                       self.__data.shape[1])
+        if last_col <= first_col:
+            raise IndexError('Empty crop ' + str(x_range))
+
+        def cut(array):
+            # Spread the per column arrays evenly over the columns
+            scale = float(len(array)) / self.__data.shape[1]
+            start = int(first_col * scale)
+            return array[start:max(int(last_col * scale), start + 1)]
+
+        return PreparedPlot(self.__data[:, first_col:last_col], cut(self.__latitude),
+                            cut(self.__time),
+                            (first + int(round(first_col * per_column)),
+                             first + int(round(last_col * per_column))))
+
+    def downsample(self, columns, rows):
+        """
+        Return this plot reduced to at most *columns* x *rows* samples by
+        :py:func:`plot.downsample.downsample`, e.g. to the pixels of the canvas it is drawn on.
+        The plot is returned as is when it already fits
+
+        :param int columns: most columns to keep
+        :param int rows: most rows to keep
+        :rtype: :py:class:`PreparedPlot`
+        """
+        data = downsample(self.__data, columns, rows)
+        if data is self.__data:
+            return self
+        return PreparedPlot(data, self.__latitude, self.__time, self.__x_range)
+
+    def nbytes(self):
+        return self.__data.nbytes + self.__latitude.nbytes + self.__time.nbytes
+
+    @staticmethod
+    def join(plots):
+        """
+        Join plots of neighbouring ranges side by side. Each plot must start at the profile the
+        previous one stops at, and all must have the same number of profiles per column
+
+        :param plots: list of :py:class:`PreparedPlot` ordered by x range
+        :rtype: :py:class:`PreparedPlot`
+        """
+        if len(plots) == 1:
+            return plots[0]
+        for left, right in zip(plots[:-1], plots[1:]):
+            if left.get_x_range()[1] != right.get_x_range()[0] or \
+                    left.get_profiles_per_column() != right.get_profiles_per_column():
+                raise ValueError('Plots do not line up')
+        return PreparedPlot(np.hstack([plot.get_data() for plot in plots]),
+                            np.concatenate([plot.get_latitude() for plot in plots]),
+                            np.concatenate([plot.get_time() for plot in plots]),
+                            (plots[0].get_x_range()[0], plots[-1].get_x_range()[1]))
@@ -3,7 +3,90 @@
 # 12/31/2013
 #
 import numpy as np
-from scipy import interpolate
+
+# Columns interpolated at a time by Regridder with method 'linear'
+CHUNK_COLUMNS = 1024
+
+#
+# The interpolation from the lidar altitudes onto the uniform grid only depends on the two
+# altitude arrays, which are the same for every render. Regridder works out the rows and
+# weights to use once, so regridding a matrix is only a gather and a weighted sum. The
+# renderers share their regridders through plot.altitude_grid
+#
+
+class Regridder(object):
+    """
+    Regrids matrices defined on the (Nx1) altitudes 'alt' onto the (Jx1) grid 'new_alt'.
+    Altitude is stored row by row and the horizontal dimension changes column by column.
+    The altitudes may be in any order, so no reversed copies of the data are made.
+
+    method 'linear' interpolates between the two nearest altitudes and returns NaN outside of
+    'alt', the same as ``scipy.interpolate.interp1d``. Floating point matrices keep their dtype,
+    integer ones are interpolated in float64. method 'nearest' copies the row of the
+    nearest altitude, which keeps categorical data such as VFM classes exact and keeps the
+    dtype of the matrix.
+
+    :param alt: altitudes of the rows of the matrices to regrid
+    :param new_alt: altitudes to regrid onto
+    :param str method: 'linear' or 'nearest'
+    """
+
+    def __init__(self, alt, new_alt, method='linear'):
+        if method not in ('linear', 'nearest'):
+            raise ValueError('Unknown regrid method ' + str(method))
+        alt = np.asarray(alt, dtype=np.float64)
+        new_alt = np.asarray(new_alt, dtype=np.float64)
+
+        # Search in ascending order, then map back to the rows of the original order
+        order = np.argsort(alt)
+        sorted_alt = alt[order]
+        upper = np.clip(np.searchsorted(sorted_alt, new_alt), 1, len(alt) - 1)
+        lower = upper - 1
+        weight = (new_alt - sorted_alt[lower]) / (sorted_alt[upper] - sorted_alt[lower])
+
+        self.__method = method
+        self.__shape = (len(new_alt), len(alt))
+        self.__outside = (new_alt < sorted_alt[0]) | (new_alt > sorted_alt[-1])
+        if method == 'nearest':
+            # Ties go to the lower altitude, as with interp1d
+            self.__index = order[np.where(weight > 0.5, upper, lower)]
+        else:
+            self.__lower = order[lower]
+            self.__upper = order[upper]
+            self.__weight = weight[:, np.newaxis]
+
+    def __call__(self, matrix, fill_value=None):
+        """
+        Regrid *matrix*, which must have one row per altitude of 'alt'
+
+        :param matrix: alt x columns array
+        :param fill_value: value for rows outside of 'alt', defaults to NaN for floating point
+                           results and 0 for integer results of the 'nearest' method
+        """
+        if matrix.shape[0] != self.__shape[1]:
+            raise ValueError('matrix must have %d rows' % self.__shape[1])
+
+        if self.__method == 'nearest':
+            out = np.take(matrix, self.__index, axis=0)
+        else:
+            # Accumulate in place a chunk of columns at a time, so besides the result only the
+            # gathered rows of one chunk are ever allocated, however wide the matrix is
+            dtype = matrix.dtype if matrix.dtype.kind == 'f' else np.float64
+            weight = self.__weight.astype(dtype, copy=False)
+            out = np.empty((self.__shape[0], matrix.shape[1]), dtype=dtype)
+            for first in range(0, matrix.shape[1], CHUNK_COLUMNS):
+                columns = matrix[:, first:first + CHUNK_COLUMNS]
+                part = out[:, first:first + CHUNK_COLUMNS]
+                part[...] = np.take(columns, self.__lower, axis=0)
+                part *= 1 - weight
+                upper = np.take(columns, self.__upper, axis=0).astype(dtype, copy=False)
+                upper *= weight
+                part += upper
+
+        if fill_value is None:
+            fill_value = np.nan if np.issubdtype(out.dtype, np.floating) else 0
+        out[self.__outside] = fill_value
+        return out
 
 def regrid_lidar(alt, inMatrix, new_alt, method = 'linear'):
 #
@@ -13,16 +96,12 @@ def regrid_lidar(alt, inMatrix, new_alt, method = 'linear'):
 # column, and altitude is stored row by row (e.g. row x col == alt x (dist
 # or time).
 #
-# Note that all values outside of bounds are returned as NaN's
-# For interp1d to work, the ordinate array has to be monotonically increasing
-# This is why the altitude and inMatrix arrays have been reversed in their
-# common dimension.  
+# Note that all values outside of bounds are returned as NaN's, or 0 for
+# integer data regridded with method = 'nearest'. Use 'nearest' for
+# categorical data so classes are not blended together.
 #
 
-    interpFunc = interpolate.interp1d(alt[::-1], inMatrix[::-1,:], kind=method, 
-                                      axis=0, bounds_error=False)
-
-    return interpFunc(new_alt)
+    return Regridder(alt, new_alt, method)(inMatrix)
 
 #
 # Quick 'n dirty test to see if it works
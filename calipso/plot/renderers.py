@@ -0,0 +1,59 @@
+#
+# renderers.py
+#
+# The renderer of every plot type, shared by the Tk application and the
+# headless batch renderer
+#
+from constants import Plot
+from plot.plot_depolar_ratio import prepare_depolarized, draw_depolarized, \
+    get_averaging_width as depolarized_width
+from plot.plot_backscattered import prepare_backscattered, draw_backscattered, \
+    get_averaging_width as backscattered_width
+from plot.plot_vfm import prepare_vfm, draw_vfm
+from plot.plot_iwp import prepare_iwp, draw_iwp
+from plot.plot_horiz_avg import prepare_horiz_avg, draw_horiz_avg
+from plot.plot_aerosol_subtype import prepare_aerosol_subtype, draw_aerosol_subtype
+
+# For each plot type: the level of the file it is read from, its name in the log, its title in
+# error messages, the function preparing its data, which does not touch matplotlib, and the
+# function drawing the prepared data
+RENDERERS = {
+    Plot.backscattered: (1, 'backscattered', 'Backscattered',
+                         prepare_backscattered, draw_backscattered),
+    Plot.depolarized: (1, 'depolarized', 'Depolarized', prepare_depolarized, draw_depolarized),
+    Plot.vfm: (2, 'vfm', 'VFM', prepare_vfm, draw_vfm),
+    Plot.iwp: (2, 'iwp', 'IWP', prepare_iwp, draw_iwp),
+    Plot.horiz_avg: (2, 'horiz_avg', 'Horizontal Averaging', prepare_horiz_avg, draw_horiz_avg),
+    Plot.aerosol_subtype: (2, 'aerosol_subtype', 'Aerosol Subtype',
+                           prepare_aerosol_subtype, draw_aerosol_subtype),
+}
+
+# Profiles averaged into each column by the plots that average horizontally, by name. Every
+# other plot has one column per profile, the 15 profiles of an L2 record are 15 columns
+AVERAGING_WIDTHS = {
+    'backscattered': backscattered_width,
+    'depolarized': depolarized_width,
+}
+
+
+def profiles_per_column(name, x_range):
+    """
+    Return the number of profiles in each column of the plot called *name* when
+    *x_range* is prepared, without preparing it
+
+    :param str name: name of the plot type, e.g. ``'backscattered'``
+    :param x_range: Tuple of the first and last profile index
+    """
+    width = AVERAGING_WIDTHS.get(name)
+    return 1 if width is None else width(x_range)
+
+
+def find_renderer(name):
+    """
+    Return the plot type and ``RENDERERS`` entry of the plot type called *name* in the log,
+    e.g. ``'backscattered'`` or ``'vfm'``
+    """
+    for plot_type, renderer in RENDERERS.items():
+        if renderer[1] == name:
+            return plot_type, renderer
+    raise KeyError(name)
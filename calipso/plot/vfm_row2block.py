@@ -1,5 +1,122 @@
 import numpy as np
 
+from log.log import timed_stage
+
+# Resolutions defined here are defined in terms of lengths of index numbers, see vfm_row2block
+HIGH_ALT_RES = 55
+MID_ALT_RES = 200
+LOW_ALT_RES = 290
+ALT_DIM = HIGH_ALT_RES + MID_ALT_RES + LOW_ALT_RES
+PROFILES_PER_ROW = 15
+ROW_LEN = 3 * HIGH_ALT_RES + 5 * MID_ALT_RES + 15 * LOW_ALT_RES
+
+# Rows unpacked at a time by vfm_rows2block, small enough that the transposed copy stays in cache
+CHUNK_ROWS = 64
+
+
+@timed_stage('vfm unpack')
+def vfm_rows2block(vfm_rows, out=None):
+    """
+    Description: Bulk version of vfm_row2block. Rearranges every row of a VFM array into one 2d
+    grid in a single call, so the caller does not have to loop over the records
+
+    Inputs: vfm_rows - an array num_rows x 5515, e.g. the whole Feature_Classification_Flags
+            slice or a bitfield extracted from it
+            out - optional ALT_DIM x 15*num_rows C-contiguous array to write into, lets panning
+            reuse the same buffer. Its dtype is kept, by default the dtype of vfm_rows is used
+
+    Outputs: block - 2d array ALT_DIM x 15*num_rows, columns 15*i to 15*(i+1) hold the block of
+             row i exactly as vfm_row2block would return it
+    """
+    vfm_rows = np.asarray(vfm_rows)
+    num_rows = vfm_rows.shape[0]
+    shape = (ALT_DIM, PROFILES_PER_ROW * num_rows)
+    if out is None:
+        out = np.empty(shape, dtype=vfm_rows.dtype)
+    elif out.shape != shape or not out.flags['C_CONTIGUOUS']:
+        raise ValueError('out must be a C-contiguous array of shape ' + str(shape))
+
+    # View the output as (altitude, row, profile within row)
+    blocks = out.reshape(ALT_DIM, num_rows, PROFILES_PER_ROW)
+    for first in range(0, num_rows, CHUNK_ROWS):
+        rows = vfm_rows[first:first + CHUNK_ROWS]
+        _unpack_rows(rows, blocks[:, first:first + rows.shape[0]])
+
+    return out
+
+
+@timed_stage('vfm unpack')
+def vfm_chunks2block(chunks, num_rows):
+    """
+    Description: vfm_rows2block of VFM rows read a chunk at a time, so the rows of the whole
+    range are never in memory at once, only the unpacked grid and the chunk being unpacked
+
+    Inputs: chunks - tuples of the row offset of each chunk and the chunk, rows x 5515, as
+            yielded by tools.granulecache.Granule.iter_blocks
+            num_rows - number of rows in all the chunks
+
+    Outputs: block - 2d array ALT_DIM x 15*num_rows in the dtype of the rows, the same as
+             vfm_rows2block of all the rows
+    """
+    out = blocks = None
+    for offset, chunk in chunks:
+        chunk = np.asarray(chunk)
+        if out is None:
+            out = np.empty((ALT_DIM, PROFILES_PER_ROW * num_rows), dtype=chunk.dtype)
+            blocks = out.reshape(ALT_DIM, num_rows, PROFILES_PER_ROW)
+        for first in range(0, chunk.shape[0], CHUNK_ROWS):
+            rows = chunk[first:first + CHUNK_ROWS]
+            _unpack_rows(rows, blocks[:, offset + first:offset + first + rows.shape[0]])
+    return out
+
+
+def _unpack_rows(rows, block):
+    """
+    Unpack *rows* into *block*, an (altitude, row, profile within row) view of the output.
+    Within each altitude region a row holds 3, 5 or 15 runs of bins which are broadcast across
+    5, 3 or 1 profiles
+    """
+    n = rows.shape[0]
+    high_end = 3 * HIGH_ALT_RES
+    mid_end = high_end + 5 * MID_ALT_RES
+
+    high = rows[:, :high_end].reshape(n, 3, HIGH_ALT_RES).transpose(2, 0, 1)
+    block[:HIGH_ALT_RES].reshape(HIGH_ALT_RES, n, 3, 5)[...] = high[..., np.newaxis]
+
+    mid = rows[:, high_end:mid_end].reshape(n, 5, MID_ALT_RES).transpose(2, 0, 1)
+    block[HIGH_ALT_RES:HIGH_ALT_RES + MID_ALT_RES].reshape(MID_ALT_RES, n, 5, 3)[...] = \
+        mid[..., np.newaxis]
+
+    low = rows[:, mid_end:].reshape(n, 15, LOW_ALT_RES).transpose(2, 0, 1)
+    block[HIGH_ALT_RES + MID_ALT_RES:] = low
+
+
+def vfm_block2rows(block):
+    """
+    Description: Inverse of vfm_rows2block. Packs a 2d grid back into rows of VFM data, where
+    profiles are averaged the first profile of each group of 5 or 3 is kept
+
+    Inputs: block - an array ALT_DIM x 15*num_rows
+
+    Outputs: rows - an array num_rows x 5515, vfm_rows2block(rows) returns block where it is
+             constant across each group of averaged profiles
+    """
+    block = np.asarray(block)
+    num_rows = block.shape[1] // PROFILES_PER_ROW
+    blocks = block[:, :PROFILES_PER_ROW * num_rows].reshape(ALT_DIM, num_rows, PROFILES_PER_ROW)
+    rows = np.empty((num_rows, ROW_LEN), dtype=block.dtype)
+
+    # Fill each altitude region of the rows through a (row, run, bin) view of it
+    high_end = 3 * HIGH_ALT_RES
+    mid_end = high_end + 5 * MID_ALT_RES
+    rows[:, :high_end].reshape(num_rows, 3, HIGH_ALT_RES)[...] = \
+        blocks[:HIGH_ALT_RES, :, ::5].transpose(1, 2, 0)
+    rows[:, high_end:mid_end].reshape(num_rows, 5, MID_ALT_RES)[...] = \
+        blocks[HIGH_ALT_RES:HIGH_ALT_RES + MID_ALT_RES, :, ::3].transpose(1, 2, 0)
+    rows[:, mid_end:].reshape(num_rows, 15, LOW_ALT_RES)[...] = \
+        blocks[HIGH_ALT_RES + MID_ALT_RES:].transpose(1, 2, 0)
+    return rows
+
 
 def vfm_row2block(vfm_row):
     """
@@ -79,3 +196,25 @@ def vfm_row2block(vfm_row):
         block[indA:indB, i] = vfm_row[iLow:iHi]
 
     return block
+
+
+#
+# Check and benchmark the bulk unpacker against the row at a time loop on a full L2 granule
+
+if __name__ == '__main__':
+    import timeit
+
+    num_rows = 3744
+    vfm = np.random.randint(0, 8, (num_rows, ROW_LEN)).astype(np.uint8)
+
+    def row_loop():
+        unpacked = np.zeros((ALT_DIM, PROFILES_PER_ROW * num_rows), np.uint8)
+        for i in range(num_rows):
+            unpacked[:, PROFILES_PER_ROW * i:PROFILES_PER_ROW * (i + 1)] = vfm_row2block(vfm[i, :])
+        return unpacked
+
+    buf = np.empty((ALT_DIM, PROFILES_PER_ROW * num_rows), np.uint8)
+    print("identical: " + str(np.array_equal(row_loop(), vfm_rows2block(vfm))))
+    slow = min(timeit.repeat(row_loop, number=1, repeat=3))
+    fast = min(timeit.repeat(lambda: vfm_rows2block(vfm, out=buf), number=1, repeat=3))
+    print("row loop %.4f s, bulk %.4f s, speedup %.1fx" % (slow, fast, slow / fast))
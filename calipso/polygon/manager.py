@@ -50,6 +50,7 @@ class ShapeManager(object):
         logger.info("Querying database for unique tag")
         self.__selected_shapes = []         # shapes that are currently selected
         self.__drawing = False              # is a free draw shape being drawn now?
+        self.__stitched = False             # are granules of the day stitched into the plot?
 
     def anchor_rectangle(self, event):
         """
@@ -59,6 +60,9 @@ class ShapeManager(object):
         if self.__current_plot == Plot.baseplot:
             logger.warning("Cannot draw to BASE_PLOT")
             return
+        if self.__stitched:
+            logger.warning('Cannot draw shapes while granules are stitched')
+            return
         if event.xdata and event.ydata:
             logger.info('Anchoring %d, %d' % (event.xdata, event.ydata))
             self.__current_list[-1].anchor_rectangle(event)
@@ -267,6 +271,9 @@ class ShapeManager(object):
         if self.__current_plot == Plot.baseplot:
             logger.warning('Cannot draw to the base plot')
             return
+        if self.__stitched:
+            logger.warning('Cannot draw shapes while granules are stitched')
+            return
         if event.xdata and event.ydata:
             logger.info('Plotting point at %.5f, %.5f' % (event.xdata, event.ydata))
             check = self.__current_list[-1].plot_point(event, self.__current_plot, self.__hdf,
@@ -570,7 +577,8 @@ class ShapeManager(object):
             for shape in self.__current_list[:-1]:
                 if not shape.is_empty():
                     shape.loaded_draw(self.__figure, ShapeManager.outline_toggle)
-            self.__canvas.show()
+            # Drawn with the plot by the same idle redraw
+            self.__canvas.draw_idle()
 
     def set_hdf(self, hdf_filename):
         """
@@ -580,6 +588,18 @@ class ShapeManager(object):
         """
         self.__hdf = hdf_filename
 
+    def set_stitched(self, stitched):
+        """
+        Shapes are saved against the HDF file they are drawn on, which a plot of stitched
+        granules has no single one of, so no shapes are drawn while stitched
+
+        :param bool stitched: ``True`` if the plot spans several granules
+        """
+        self.__stitched = stitched
+
+    def is_stitched(self):
+        return self.__stitched
+
     def set_plot(self, plot):
         """
         Determine which list current_list should alias, also set internal plot
@@ -8,12 +8,12 @@
 import tkMessageBox
 import tkFileDialog
 from Tkinter import Toplevel, Entry, Button, BOTH, Frame, SUNKEN, Label, LEFT, BOTTOM, TOP, X, \
-    Checkbutton, StringVar, BooleanVar, W, Grid, NORMAL
+    Checkbutton, StringVar, BooleanVar, W, Grid, NORMAL, Text, DISABLED
 
 from bokeh.colors import white
 from Tkconstants import END
 from constants import CONF
-from log.log import logger
+from log.log import logger, render_timings
 from os.path import dirname
 
 
@@ -140,11 +140,48 @@ class SettingsDialog(Toplevel):
         # Create a revert button to scrap the changes and go back to the initial settings
         revert_button = Button(self.__bottom_frame, text='Revert Settings',
                                command=lambda: self.revert())
+        # Show how long each stage of the recent renders took
+        timings_button = Button(self.__bottom_frame, text='Render Timings',
+                                command=lambda: self.show_timings())
         # Place all of the buttons and ability to move
         save_button.grid(row=0, column=0, pady=5)
         revert_button.grid(row=0, column=1, pady=5)
+        timings_button.grid(row=0, column=2, pady=5)
         Grid.columnconfigure(self.__bottom_frame, 0, weight=1)
         Grid.columnconfigure(self.__bottom_frame, 1, weight=1)
+        Grid.columnconfigure(self.__bottom_frame, 2, weight=1)
+
+    def show_timings(self):
+        """ Open a window summarizing the stage timings of the recent renders """
+        window = Toplevel(self)
+        window.title('Render Timings')
+        text = Text(window, width=80, height=20, font='TkFixedFont')
+        text.pack(side=TOP, fill=BOTH, expand=True)
+
+        summary = render_timings.summary()
+        text.insert(END, '%-16s %6s %10s %10s %10s %10s\n' %
+                    ('Stage', 'Count', 'Mean ms', 'Median ms', '90% ms', 'Max ms'))
+        for stage, entry in summary.items():
+            text.insert(END, '%-16s %6d %10.1f %10.1f %10.1f %10.1f\n' % (
+                stage, entry['count'], 1000 * entry['mean'], 1000 * entry['median'],
+                1000 * entry['p90'], 1000 * entry['max']))
+        if not summary:
+            text.insert(END, 'Nothing has been rendered yet\n')
+        text.config(state=DISABLED)
+
+        buttons = Frame(window)
+        buttons.pack(side=BOTTOM, fill=X)
+        Button(buttons, text='Save as JSON', command=self.save_timings).pack(side=LEFT, pady=5)
+        Button(buttons, text='Close', command=window.destroy).pack(side=LEFT, pady=5)
+
+    @staticmethod
+    def save_timings():
+        """ Dump the summary and records of the recent renders to a JSON file """
+        path = tkFileDialog.asksaveasfilename(defaultextension='.json',
+                                              filetypes=[('JSON', '*.json'), ('All files', '*')])
+        if path:
+            render_timings.dump(path)
+            logger.info('Render timings saved to ' + path)
 
     def change_lock_setting(self, key, new_val):
         """ Change the manual/auto lock setting """
@@ -0,0 +1,66 @@
+#
+# test_avg_lidar_data.py
+#
+# Checks the block averages against a masked mean of each block in turn
+#
+import unittest
+
+import numpy as np
+from numpy import ma
+
+from plot.avg_lidar_data import avg_horz_data, avg_horz_chunks, FILL_VALUE
+
+
+def loop_mean(data, N):
+    """ Masked mean of each block of N profiles, leaving out fill values and NaN """
+    data = ma.masked_invalid(ma.masked_equal(data, FILL_VALUE))
+    columns = [ma.mean(data[:, i * N:(i + 1) * N], axis=1).filled(np.nan)
+               for i in range(data.shape[1] // N)]
+    return np.array(columns).T
+
+
+class AvgHorzDataTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        # Laid out like the transposed HDF slices the renderers pass in
+        self.data = random.rand(1000, 40).astype(np.float32).T
+        self.data[random.rand(*self.data.shape) < 0.2] = FILL_VALUE
+        self.data[random.rand(*self.data.shape) < 0.05] = np.nan
+        self.data[:, 15:30] = FILL_VALUE
+
+    def test_mean_leaves_out_fill_and_nan(self):
+        for N in (1, 5, 15, 300):
+            out = avg_horz_data(self.data, N)
+            self.assertEqual(out.dtype, np.float32)
+            np.testing.assert_allclose(out, loop_mean(self.data, N), rtol=1e-6)
+
+    def test_block_of_fill_is_nan(self):
+        self.assertTrue(np.isnan(avg_horz_data(self.data, 15)[:, 1]).all())
+
+    def test_trailing_profiles_dropped(self):
+        self.assertEqual(avg_horz_data(self.data[:, :998], 5).shape, (40, 199))
+
+    def test_integer_data(self):
+        data = np.arange(20).reshape(2, 10)
+        np.testing.assert_array_equal(avg_horz_data(data, 5), [[2, 7], [12, 17]])
+
+    def test_masked_weighted_and_median(self):
+        data = ma.masked_greater(self.data, 0.9)
+        np.testing.assert_allclose(avg_horz_data(data, 5), loop_mean(data.filled(np.nan), 5),
+                                   rtol=1e-6)
+        weights = np.arange(1, 6)
+        block = np.array([[1., 2., 3., 4., FILL_VALUE]])
+        self.assertAlmostEqual(avg_horz_data(block, 5, weights=weights)[0, 0], 30. / 10)
+        self.assertEqual(avg_horz_data(block, 5, method='median')[0, 0], 2.5)
+        self.assertRaises(ValueError, avg_horz_data, block, 5, method='mode')
+
+    def test_chunks_match_whole(self):
+        profiles = self.data.T
+        chunks = [(offset, profiles[offset:offset + 150]) for offset in range(0, 1000, 150)]
+        np.testing.assert_array_equal(avg_horz_chunks(chunks, 15, 1000),
+                                      avg_horz_data(self.data, 15))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#
+# test_colormaps.py
+#
+# Checks Colormap.colorize against coloring through the matplotlib norm and colormap
+#
+import unittest
+
+import numpy as np
+
+from plot.colormaps import Colormap
+
+
+def make_cmap(colors, bounds):
+    """ A colormap dictionary laid out like the one ccplot.utils.cmap returns """
+    random = np.random.RandomState(0)
+    return {'colors': random.randint(0, 256, size=(colors, 3)).astype(np.float64),
+            'under': np.array([0., 0., 255.]), 'over': np.array([255., 0., 0.]),
+            'bad': np.array([128., 128., 128.]), 'bounds': bounds}
+
+
+class ColorizeTest(unittest.TestCase):
+
+    def assertColorsLikeMatplotlib(self, colormap, data):
+        # imshow masks NaN before the norm sees it
+        masked = np.ma.masked_invalid(data)
+        expected = colormap.get_cmap()(colormap.get_norm()(masked), bytes=True)
+        np.testing.assert_array_equal(colormap.colorize(data), expected)
+
+    def test_float_raster(self):
+        colormap = Colormap(make_cmap(10, np.linspace(1e-4, 0.1, 11)))
+        data = np.random.RandomState(1).uniform(-0.01, 0.12, size=(40, 60)).astype(np.float32)
+        data[0, :5] = np.nan
+        data[1, :5] = colormap.get_norm().boundaries[3]
+        self.assertColorsLikeMatplotlib(colormap, data)
+        self.assertEqual(colormap.colorize(data).shape, (40, 60, 4))
+
+    def test_masked_raster(self):
+        colormap = Colormap(make_cmap(10, np.linspace(0., 1., 11)))
+        data = np.ma.masked_greater(np.random.RandomState(2).rand(20, 30), 0.8)
+        self.assertColorsLikeMatplotlib(colormap, data)
+
+    def test_colors_spread_over_bins(self):
+        colormap = Colormap(make_cmap(12, np.linspace(0., 1., 7)))
+        self.assertColorsLikeMatplotlib(colormap, np.random.RandomState(3).rand(20, 30))
+
+    def test_class_raster(self):
+        colormap = Colormap(make_cmap(8, np.arange(9) - 0.5))
+        classes = np.random.RandomState(4).randint(0, 10, size=(20, 30)).astype(np.uint8)
+        self.assertColorsLikeMatplotlib(colormap, classes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#
+# test_downsample.py
+#
+# Checks the reduction of rasters to the pixels of the canvas
+#
+import unittest
+
+import numpy as np
+
+from plot.downsample import downsample
+
+
+class DownsampleTest(unittest.TestCase):
+
+    def test_fitting_raster_kept(self):
+        data = np.random.RandomState(0).rand(10, 20)
+        self.assertIs(downsample(data, 20, 10), data)
+
+    def test_mean_leaves_out_nan(self):
+        data = np.array([[1., 3., np.nan, np.nan, 5., np.nan]], dtype=np.float32)
+        out = downsample(data, 3, 1)
+        self.assertEqual(out.dtype, np.float32)
+        np.testing.assert_array_equal(out, [[2., np.nan, 5.]])
+
+    def test_uneven_runs(self):
+        data = np.arange(10, dtype=np.float64)[np.newaxis].repeat(4, axis=0)
+        out = downsample(data, 3, 2)
+        self.assertEqual(out.shape, (2, 3))
+        np.testing.assert_allclose(out[0], [1., 4., 7.5])
+
+    def test_masked_float(self):
+        data = np.ma.masked_array([[1., 100., 3., 5.]], mask=[[0, 1, 0, 0]])
+        np.testing.assert_array_equal(downsample(data, 2, 1), [[1., 4.]])
+
+    def test_mode_of_classes(self):
+        data = np.array([[1, 1, 2, 3, 2, 5, 0, 0, 7]], dtype=np.uint8)
+        out = downsample(data, 3, 1)
+        self.assertEqual(out.dtype, np.uint8)
+        # A tie goes to the lowest class
+        np.testing.assert_array_equal(out, [[1, 2, 0]])
+        rows = np.array([[4], [4], [6], [5]], dtype=np.int16)
+        np.testing.assert_array_equal(downsample(rows, 1, 2), [[4], [5]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#
+# test_granulecache.py
+#
+# Checks the closing and product budget of granules held by a GranuleCache
+#
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import constants
+from tools.granulecache import Granule, GranuleCache
+from tools.granulestore import write_granule
+from tools.syntheticgranule import synthetic_pair
+
+
+class GranuleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for index in range(2):
+            datasets, metadata = synthetic_pair(datetime(2017, 7, 1), l1_profiles=100,
+                                                l2_records=1, seed=index)[0]
+            self.paths.append(write_granule(os.path.join(self.directory, 'granule%d' % index),
+                                            datasets, metadata))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_evicted_granule_closed_once_released(self):
+        cache = GranuleCache(1)
+        closed = []
+        with cache.use(lambda: cache.get(self.paths[0])) as granule:
+            granule._Granule__product.close = lambda: closed.append(granule)
+            granule.get_product('product', lambda: np.zeros(10))
+            cache.get(self.paths[1])
+            # Evicted, the products are gone but the file stays open while in use
+            self.assertEqual(granule.products_nbytes(), 0)
+            self.assertEqual(closed, [])
+        self.assertEqual(closed, [granule])
+
+    def test_products_kept_to_budget(self):
+        budget = constants.PRODUCT_BUDGET
+        constants.PRODUCT_BUDGET = 250
+        try:
+            granule = Granule(self.paths[0])
+            for key in range(4):
+                granule.get_product(key, lambda: np.zeros(10))
+            # Only the three products used last fit in the budget
+            self.assertEqual(granule.products_nbytes(), 240)
+            built = []
+            granule.get_product(0, lambda: built.append(0) or np.zeros(10))
+            self.assertEqual(built, [0])
+            # The product asked for is kept however big
+            big = granule.get_product('big', lambda: np.zeros(100))
+            self.assertIs(granule.get_product('big', None), big)
+            self.assertEqual(granule.products_nbytes(), 800)
+            granule.close()
+        finally:
+            constants.PRODUCT_BUDGET = budget
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#
+# test_granulesequence.py
+#
+# Checks GranuleSequence against the granules it joins
+#
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import constants
+from tools.granulecache import Granule, GranuleSequence
+from tools.granulestore import write_granule
+from tools.syntheticgranule import synthetic_pair
+
+BACKSCATTER = 'Total_Attenuated_Backscatter_532'
+PROFILES = (1200, 1000, 1300)
+
+
+class GranuleSequenceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.paths = []
+        start = datetime(2017, 7, 1)
+        for index, profiles in enumerate(PROFILES):
+            (datasets, metadata), _ = synthetic_pair(start, l1_profiles=profiles, l2_records=1,
+                                                     seed=index)
+            cls.paths.append(write_granule(os.path.join(cls.directory, 'granule%d' % index),
+                                           datasets, metadata))
+            start += timedelta(minutes=30)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.granules = [Granule(path) for path in self.paths]
+        self.sequence = GranuleSequence(self.paths)
+        self.whole = np.concatenate([granule.read(BACKSCATTER, 0, granule.get_num_records())
+                                     for granule in self.granules])
+
+    def tearDown(self):
+        self.sequence.close()
+
+    def test_joined_index(self):
+        self.assertEqual(self.sequence.get_num_profiles(), sum(PROFILES))
+        self.assertEqual(self.sequence.get_x_range(), (0, sum(PROFILES)))
+        np.testing.assert_array_equal(
+            self.sequence.get_time(),
+            np.concatenate([granule.get_time() for granule in self.granules]))
+
+    def test_locate(self):
+        for record, (index, local) in [(0, (0, 0)), (1199, (0, 1199)), (1200, (1, 0)),
+                                       (2250, (2, 50)), (3499, (2, 1299))]:
+            granule, found = self.sequence.locate(record)
+            self.assertEqual(granule.get_filename(), self.paths[index])
+            self.assertEqual(found, local)
+
+    def test_read(self):
+        for first, last in [(0, 10), (100, 1200), (1150, 1250), (1100, 2300), (3400, 3500)]:
+            np.testing.assert_array_equal(self.sequence.read(BACKSCATTER, first, last),
+                                          self.whole[first:last])
+
+    def test_iter_blocks_across_boundaries(self):
+        chunk_profiles = constants.STREAM_CHUNK_PROFILES
+        constants.STREAM_CHUNK_PROFILES = 300
+        try:
+            chunks = list(self.sequence.iter_blocks(BACKSCATTER, 1000, 3400, 15))
+        finally:
+            constants.STREAM_CHUNK_PROFILES = chunk_profiles
+        self.assertEqual([offset for offset, _ in chunks], range(0, 2400, 300))
+        np.testing.assert_array_equal(np.concatenate([chunk for _, chunk in chunks]),
+                                      self.whole[1000:3400])
+
+    def test_check_range(self):
+        self.sequence.check_range(0, 10)
+        self.sequence.check_range(1100, 1300)
+        self.assertRaises(IndexError, self.sequence.check_range, 3400, 3500)
+
+    def test_products_kept_to_budget(self):
+        budget = constants.PRODUCT_BUDGET
+        constants.PRODUCT_BUDGET = 250
+        try:
+            for key in range(4):
+                self.sequence.get_product(key, lambda: np.zeros(10))
+            # Only the three products used last fit in the budget, as for a granule
+            self.assertEqual(self.sequence.products_nbytes(), 240)
+        finally:
+            constants.PRODUCT_BUDGET = budget
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#
+# test_interpret_vfm_type.py
+#
+# Checks the conditional VFM extractors against the bitfields they are built
+# from, and decode_lut against the extractors
+#
+import threading
+import unittest
+
+import numpy as np
+
+from plot.interpret_vfm_type import extract_type, extract_sub_type, extract_aerosol_subtype, \
+    extract_cloud_subtype, extract_psc_subtype, extract_horiz_avg, decode_lut, lookup_table, \
+    NUM_FLAG_VALUES, AEROSOL, CLOUD, STRATOSPHERIC
+
+
+class InterpretVfmTypeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flags = np.random.RandomState(0).randint(
+            0, NUM_FLAG_VALUES, size=(50, 300)).astype(np.uint16)
+
+    def test_conditional_subtypes(self):
+        feature_type = extract_type(self.flags)
+        sub_type = extract_sub_type(self.flags)
+        for extract, wanted in ((extract_aerosol_subtype, AEROSOL), (extract_cloud_subtype, CLOUD),
+                                (extract_psc_subtype, STRATOSPHERIC)):
+            np.testing.assert_array_equal(extract(self.flags),
+                                          np.where(feature_type == wanted, sub_type, 0))
+
+    def test_decode_lut_matches_extract(self):
+        for extract in (extract_type, extract_horiz_avg, extract_aerosol_subtype,
+                        extract_cloud_subtype):
+            decoded = decode_lut(self.flags, extract)
+            self.assertEqual(decoded.dtype, np.uint8)
+            np.testing.assert_array_equal(decoded, extract(self.flags))
+
+    def test_lookup_table_built_once(self):
+        tables = []
+        threads = [threading.Thread(target=lambda: tables.append(lookup_table(extract_psc_subtype)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(tables), 4)
+        for table in tables:
+            self.assertIs(table, tables[0])
+        self.assertEqual(tables[0].shape, (NUM_FLAG_VALUES,))
+
+
+if __name__ == '__main__':
+    unittest.main()
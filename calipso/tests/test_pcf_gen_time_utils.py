@@ -0,0 +1,36 @@
+#
+# test_pcf_gen_time_utils.py
+#
+# Checks the vectorized Profile_UTC_Time conversion against datetime
+#
+from datetime import datetime, timedelta
+import unittest
+
+from matplotlib.dates import date2num
+import numpy as np
+
+from plot.PCF_genTimeUtils import calipso_time2num, calipso_time2dt64
+
+
+def calipso_time2dt(time):
+    """ Profile_UTC_Time yymmdd.ffffffff of one profile to a datetime """
+    whole = int(time)
+    return datetime(2000 + whole // 10000, whole // 100 % 100, whole % 100) + \
+        timedelta(days=time - whole)
+
+
+class CalipsoTime2NumTest(unittest.TestCase):
+
+    def test_matches_date2num(self):
+        times = np.array([170701.0, 170701.5, 171231.999988, 160229.25, 061003.123456])
+        expected = [date2num(calipso_time2dt(time)) for time in times]
+        np.testing.assert_allclose(calipso_time2num(times), expected, rtol=0, atol=1e-9)
+
+    def test_datetime64(self):
+        converted = calipso_time2dt64(np.array([[170701.75]]))
+        self.assertEqual(converted.shape, (1, 1))
+        self.assertEqual(converted[0, 0], np.datetime64('2017-07-01T18:00:00', 'us'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#
+# test_prepare.py
+#
+# Checks the prepare_* functions of ranges read from a granule a chunk at a
+# time, including ranges that run past the end of the granule
+#
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from plot.plot_backscattered import prepare_backscattered
+from plot.plot_depolar_ratio import prepare_depolarized
+from plot.plot_iwp import prepare_iwp
+from plot.plot_vfm import prepare_vfm
+from tools.granulecache import Granule
+from tools.granulestore import write_granule
+from tools.syntheticgranule import synthetic_pair
+
+L1_PROFILES = 6000
+L2_RECORDS = 1000
+
+
+class PrepareTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        (l1, l1_metadata), (l2, l2_metadata) = synthetic_pair(
+            datetime(2017, 7, 1), l1_profiles=L1_PROFILES, l2_records=L2_RECORDS)
+        cls.l1 = write_granule(os.path.join(cls.directory, 'l1'), l1, l1_metadata)
+        cls.l2 = write_granule(os.path.join(cls.directory, 'l2'), l2, l2_metadata)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_l1_range_past_end(self):
+        for prepare in (prepare_backscattered, prepare_depolarized):
+            past = prepare(Granule(self.l1), (4500, 6500), None)
+            inside = prepare(Granule(self.l1), (4500, 6000), None)
+            self.assertEqual(past.get_x_range(), (4500, 6000))
+            self.assertEqual(len(past.get_latitude()), past.get_data().shape[1])
+            np.testing.assert_array_equal(past.get_data(), inside.get_data())
+
+    def test_l2_range_past_end(self):
+        for prepare in (prepare_vfm, prepare_iwp):
+            past = prepare(Granule(self.l2, 15), (0, 16000), None)
+            inside = prepare(Granule(self.l2, 15), (0, L2_RECORDS * 15), None)
+            self.assertEqual(past.get_x_range(), (0, L2_RECORDS * 15))
+            np.testing.assert_array_equal(past.get_data(), inside.get_data())
+
+
+if __name__ == '__main__':
+    unittest.main()
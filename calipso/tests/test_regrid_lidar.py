@@ -0,0 +1,57 @@
+#
+# test_regrid_lidar.py
+#
+# Checks Regridder against NumPy interpolation of each column
+#
+import unittest
+
+import numpy as np
+
+from plot import regrid_lidar
+from plot.regrid_lidar import Regridder
+
+
+class RegridderTest(unittest.TestCase):
+
+    def setUp(self):
+        # Descending like Lidar_Data_Altitudes
+        self.alt = np.linspace(30., -0.5, 60)
+        self.new_alt = np.linspace(-2., 32., 100)
+        self.matrix = np.random.RandomState(0).rand(60, 50).astype(np.float32)
+
+    def test_linear(self):
+        out = Regridder(self.alt, self.new_alt)(self.matrix)
+        self.assertEqual(out.shape, (100, 50))
+        self.assertEqual(out.dtype, np.float32)
+        inside = (self.new_alt >= self.alt.min()) & (self.new_alt <= self.alt.max())
+        self.assertTrue(np.isnan(out[~inside]).all())
+        for column in (0, 49):
+            expected = np.interp(self.new_alt[inside], self.alt[::-1],
+                                 self.matrix[::-1, column])
+            np.testing.assert_allclose(out[inside, column], expected, rtol=1e-5)
+
+    def test_linear_in_chunks(self):
+        chunk_columns = regrid_lidar.CHUNK_COLUMNS
+        regrid_lidar.CHUNK_COLUMNS = 7
+        try:
+            chunked = Regridder(self.alt, self.new_alt)(self.matrix)
+        finally:
+            regrid_lidar.CHUNK_COLUMNS = chunk_columns
+        np.testing.assert_array_equal(chunked, Regridder(self.alt, self.new_alt)(self.matrix))
+
+    def test_nearest_keeps_classes(self):
+        classes = np.random.RandomState(1).randint(0, 8, size=(60, 50)).astype(np.uint8)
+        out = Regridder(self.alt, self.new_alt, 'nearest')(classes, fill_value=0)
+        self.assertEqual(out.dtype, np.uint8)
+        inside = (self.new_alt >= self.alt.min()) & (self.new_alt <= self.alt.max())
+        nearest = np.abs(self.new_alt[inside, np.newaxis] - self.alt).argmin(axis=1)
+        np.testing.assert_array_equal(out[inside], classes[nearest])
+        self.assertFalse(out[~inside].any())
+
+    def test_rejects_bad_input(self):
+        self.assertRaises(ValueError, Regridder, self.alt, self.new_alt, 'cubic')
+        self.assertRaises(ValueError, Regridder(self.alt, self.new_alt), self.matrix[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#
+# test_renderworker.py
+#
+# Checks that a render submitted to the RenderWorker stops the background job
+# running before it
+#
+import threading
+import time
+import unittest
+
+from tools.renderworker import RenderWorker, check_cancelled
+
+
+class _Root(object):
+    """ Stands in for the Tk root, results are never polled """
+
+    def after(self, ms, function):
+        pass
+
+
+class RenderWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = RenderWorker(_Root())
+
+    def tearDown(self):
+        self.worker.shutdown()
+
+    def test_render_stops_running_prefetch(self):
+        started = threading.Event()
+        steps = []
+
+        def prefetch():
+            started.set()
+            for _ in range(500):
+                check_cancelled()
+                steps.append(None)
+                time.sleep(0.01)
+
+        rendered = threading.Event()
+        self.worker.submit_background(prefetch)
+        self.assertTrue(started.wait(5))
+        self.worker.submit(rendered.set, None)
+        # The prefetch would run for five seconds to its end
+        self.assertTrue(rendered.wait(2))
+        self.assertLess(len(steps), 500)
+
+    def test_check_cancelled_outside_background_job(self):
+        check_cancelled()
+        done = threading.Event()
+        self.worker.submit(lambda: check_cancelled() or done.set(), None)
+        self.assertTrue(done.wait(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#
+# test_tilepyramid.py
+#
+# Checks composites of the tile pyramid against plots prepared directly,
+# including composites reaching the partial last tile of the granule
+#
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from plot.plot_backscattered import prepare_backscattered
+from plot.plot_depolar_ratio import prepare_depolarized
+from plot.plot_vfm import prepare_vfm
+from tools.granulecache import Granule
+from tools.granulestore import write_granule
+from tools.syntheticgranule import synthetic_pair
+import tools.tilepyramid
+from tools.tilepyramid import TilePyramid, prune_tiles
+
+# The last L1 tile holds 600 profiles and the last L2 tile 200 records, fewer than
+# Granule.MIN_END_RECORDS
+L1_PROFILES = 6600
+L1_TILE = 1500
+L2_RECORDS = 1100
+L2_TILE = 4500
+
+
+class TilePyramidTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        (l1, l1_metadata), (l2, l2_metadata) = synthetic_pair(
+            datetime(2017, 7, 1), l1_profiles=L1_PROFILES, l2_records=L2_RECORDS)
+        cls.l1 = write_granule(os.path.join(cls.directory, 'l1'), l1, l1_metadata)
+        cls.l2 = write_granule(os.path.join(cls.directory, 'l2'), l2, l2_metadata)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.tiles = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tiles)
+
+    def pyramid(self, name, prepare):
+        if name == 'vfm':
+            return TilePyramid(Granule(self.l2, 15), name, prepare, L2_TILE, self.tiles)
+        return TilePyramid(Granule(self.l1), name, prepare, L1_TILE, self.tiles)
+
+    def test_level_0_matches_prepared(self):
+        for name, prepare in (('backscattered', prepare_backscattered),
+                              ('depolarized', prepare_depolarized)):
+            pyramid = self.pyramid(name, prepare)
+            composite = pyramid.composite((1500, 4500), columns=600)
+            prepared = prepare(Granule(self.l1), (1500, 4500), None)
+            self.assertEqual(composite.get_x_range(), (1500, 4500))
+            np.testing.assert_array_equal(composite.get_data(), prepared.get_data())
+
+    def test_composites_reach_last_tile(self):
+        for name, prepare, profiles in (('backscattered', prepare_backscattered, L1_PROFILES),
+                                        ('depolarized', prepare_depolarized, L1_PROFILES),
+                                        ('vfm', prepare_vfm, L2_RECORDS * 15)):
+            pyramid = self.pyramid(name, prepare)
+            for x_range in ((0, profiles), (profiles // 2, profiles),
+                            (profiles - 1000, profiles)):
+                for columns in (100, 1000, 10000):
+                    composite = pyramid.composite(x_range, columns)
+                    first, last = composite.get_x_range()
+                    per_column = composite.get_profiles_per_column()
+                    self.assertEqual(composite.get_data().shape[1],
+                                     round((last - first) / per_column))
+                    # Cropped to the columns holding the ends of the range
+                    self.assertTrue(x_range[0] - per_column < first <= x_range[0])
+                    # Only trailing profiles that do not fill a column are left out
+                    self.assertTrue(x_range[1] - 2 * per_column < last <= x_range[1])
+
+    def test_last_tile_lines_up(self):
+        pyramid = self.pyramid('backscattered', prepare_backscattered)
+        last = pyramid.get_tile(0, pyramid.get_num_tiles(0) - 1)
+        self.assertEqual(last.get_profiles_per_column(),
+                         pyramid.get_tile(0, 0).get_profiles_per_column())
+        self.assertEqual(last.get_x_range()[0], 6000)
+
+    def test_tiles_saved_and_reused(self):
+        pyramid = self.pyramid('vfm', prepare_vfm)
+        composite = pyramid.composite((0, L2_RECORDS * 15), columns=500)
+        reloaded = self.pyramid('vfm', prepare_vfm).composite((0, L2_RECORDS * 15), columns=500)
+        np.testing.assert_array_equal(reloaded.get_data(), composite.get_data())
+
+    def test_tiles_of_other_versions_not_loaded(self):
+        self.pyramid('vfm', prepare_vfm).composite((0, L2_RECORDS * 15), columns=500)
+        version = tools.tilepyramid.TILE_VERSION
+        tools.tilepyramid.TILE_VERSION = version + 1
+        try:
+            self.pyramid('vfm', prepare_vfm).composite((0, L2_RECORDS * 15), columns=500)
+        finally:
+            tools.tilepyramid.TILE_VERSION = version
+        folders = sorted(os.listdir(self.tiles))
+        self.assertEqual(len(folders), 2)
+        self.assertEqual([folder.rpartition('_v')[2] for folder in folders],
+                         [str(version), str(version + 1)])
+
+    def test_pyramid_kept_by_granule(self):
+        granule = Granule(self.l1)
+        self.assertIs(TilePyramid.from_granule(granule, 'backscattered', prepare_backscattered),
+                      TilePyramid.from_granule(granule, 'backscattered', prepare_backscattered))
+
+
+class PruneTilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tiles = tempfile.mkdtemp()
+        for age, stamp in enumerate(['oldest', 'older', 'newest']):
+            folder = os.path.join(self.tiles, stamp, 'backscattered')
+            os.makedirs(folder)
+            with open(os.path.join(folder, '0_0.npz'), 'wb') as f:
+                f.write(b'\0' * 100)
+            os.utime(os.path.join(self.tiles, stamp), (age, age))
+
+    def tearDown(self):
+        shutil.rmtree(self.tiles)
+
+    def test_oldest_deleted_first(self):
+        prune_tiles(self.tiles, 250)
+        self.assertEqual(sorted(os.listdir(self.tiles)), ['newest', 'older'])
+
+    def test_kept_granule_not_deleted(self):
+        prune_tiles(self.tiles, 150, keep='oldest')
+        self.assertEqual(os.listdir(self.tiles), ['oldest'])
+
+
+if __name__ == '__main__':
+    unittest.main()
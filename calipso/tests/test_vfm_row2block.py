@@ -0,0 +1,44 @@
+#
+# test_vfm_row2block.py
+#
+# Checks the bulk VFM unpacking against the unpacking of one row at a time
+#
+import unittest
+
+import numpy as np
+
+from plot.vfm_row2block import vfm_rows2block, vfm_block2rows, vfm_chunks2block, \
+    vfm_row2block, ALT_DIM, ROW_LEN, PROFILES_PER_ROW
+
+
+class VfmRow2BlockTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.rows = random.randint(0, 65536, size=(70, ROW_LEN)).astype(np.uint16)
+
+    def test_rows_match_single_row(self):
+        self.assertEqual(vfm_rows2block(self.rows).shape, (ALT_DIM, PROFILES_PER_ROW * 70))
+        self.assertEqual(vfm_rows2block(self.rows).dtype, np.uint16)
+        # vfm_row2block unpacks extracted bitfields into uint8
+        types = self.rows & 7
+        block = vfm_rows2block(types)
+        for i in (0, 33, 69):
+            np.testing.assert_array_equal(block[:, 15 * i:15 * (i + 1)], vfm_row2block(types[i]))
+
+    def test_block2rows_inverts(self):
+        np.testing.assert_array_equal(vfm_block2rows(vfm_rows2block(self.rows)), self.rows)
+
+    def test_out_buffer(self):
+        out = np.empty((ALT_DIM, PROFILES_PER_ROW * 70), dtype=np.uint8)
+        self.assertIs(vfm_rows2block(self.rows & 7, out=out), out)
+        np.testing.assert_array_equal(out, vfm_rows2block(self.rows) & 7)
+        self.assertRaises(ValueError, vfm_rows2block, self.rows, out[:, 1:])
+
+    def test_chunks_match_rows(self):
+        chunks = [(offset, self.rows[offset:offset + 20]) for offset in range(0, 70, 20)]
+        np.testing.assert_array_equal(vfm_chunks2block(chunks, 70), vfm_rows2block(self.rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
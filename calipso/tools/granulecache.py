@@ -0,0 +1,456 @@
+###################################
+#   granulecache.py
+#
+#   Keeps CALIPSO granules open between renders so that panning and
+#   switching plot types does not reopen the HDF file
+###################################
+import abc
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import threading
+
+import numpy as np
+
+import constants
+from granulestore import open_granule
+from log.log import logger, timed
+from renderworker import check_cancelled
+
+
+def _iter_blocks(read, profiles_per_record, dataset, first, last, width):
+    """ Chunks of whole blocks read with *read*, see :py:meth:`Granule.iter_blocks` """
+    width = width or profiles_per_record
+    if width % profiles_per_record:
+        raise ValueError('Blocks of %d profiles do not hold whole records' % width)
+    records = width // profiles_per_record
+    step = max(records,
+               constants.STREAM_CHUNK_PROFILES // profiles_per_record // records * records)
+    end = first + (last - first) // records * records
+    for start in range(first, end, step):
+        # A prefetch reading this granule stops here once a render is submitted
+        check_cancelled()
+        yield start - first, read(dataset, start, min(start + step, end))
+
+
+def _nbytes(product):
+    """ Bytes held by a product, its ``nbytes`` attribute or method """
+    return product.nbytes() if callable(product.nbytes) else product.nbytes
+
+
+class _Resident(object):
+    """
+    Products and reference counting shared by :py:class:`Granule` and
+    :py:class:`GranuleSequence`. Products derived from the granule are kept up to
+    ``constants.PRODUCT_BUDGET`` bytes, those used longest ago are dropped first
+
+    A granule is in use from :py:meth:`acquire` until the matching :py:meth:`release`. Closing
+    a granule drops its products at once, but its files are only closed once the last user has
+    released it, so a :py:class:`GranuleCache` can evict a granule the render worker is still
+    reading from
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self):
+        # Products derived from ranges of this granule, most recently used last
+        self.__products = OrderedDict()
+        self.__users = 0
+        self.__closing = False
+        self._lock = threading.RLock()
+
+    def get_product(self, key, build):
+        """
+        Returns the product cached under *key*, calling *build* to create it on a miss. Products
+        are anything derived from a range of the granule, e.g. decoded VFM flags, that several
+        plots can share. They must have an ``nbytes`` attribute or method, and are kept until
+        they take more than ``constants.PRODUCT_BUDGET`` bytes. The product asked for is always
+        kept
+
+        :param key: hashable key, should include the range the product was built from
+        :param build: function taking no arguments that returns the product
+        """
+        with self._lock:
+            product = self.__products.pop(key, None)
+            if product is None:
+                product = build()
+            self.__products[key] = product
+            while len(self.__products) > 1 and \
+                    self.products_nbytes() > constants.PRODUCT_BUDGET:
+                self.__products.popitem(last=False)
+            return product
+
+    def clear_products(self):
+        with self._lock:
+            self.__products.clear()
+
+    def products_nbytes(self):
+        """ Number of bytes held by the cached products """
+        with self._lock:
+            return sum(_nbytes(product) for product in self.__products.values())
+
+    def acquire(self):
+        """ Mark the granule in use, so closing it waits for :py:meth:`release` """
+        with self._lock:
+            self.__users += 1
+            return self
+
+    def release(self):
+        """ End a use started by :py:meth:`acquire`, closing the files if a close is pending """
+        with self._lock:
+            self.__users -= 1
+            if self.__closing and self.__users == 0:
+                self._close_files()
+
+    def close(self):
+        """
+        Drop the products and close the files, or once the last user has released the granule
+        """
+        with self._lock:
+            self.__products.clear()
+            if self.__users:
+                self.__closing = True
+            else:
+                self._close_files()
+
+    @abc.abstractmethod
+    def _close_files(self):
+        """ Close the files of the granule, called once it is closed and no longer in use """
+
+
+class Granule(_Resident):
+    """
+    A single L1 or L2 granule that is opened once and kept open. The small per-profile
+    arrays (time, latitude) and the altitude metadata are read on construction and stay
+    resident, larger datasets are sliced from the open file on request through :py:meth:`read`
+
+    Granule metadata (time bounds, number of profiles and the viewable x range) is computed
+    once here so the renderers can bounds check a range without scanning the time column
+
+    Reads, products and closing are serialized by a lock, so a granule can be shared by the
+    Tk thread and the render worker. See :py:class:`_Resident` for the products and closing
+
+    :param str filename: path to the HDF file
+    :param int profiles_per_record: profiles stored in one record, 1 for L1 and 15 for L2 VFM
+    """
+
+    # A range that reaches the end of the granule must hold at least this many records
+    MIN_END_RECORDS = 950
+
+    def __init__(self, filename, profiles_per_record=1):
+        super(Granule, self).__init__()
+        logger.info('Opening granule ' + str(filename))
+        self.__filename = filename
+        # The converted copy written by tools.granulestore is used when there is one
+        with timed('open'):
+            self.__product = open_granule(filename)
+        self.__time = np.array(self.__product['Profile_UTC_Time'][:, 0])
+        self.__latitude = np.array(self.__product['Latitude'][:, 0])
+        self.__altitude = self.__product['metadata']['Lidar_Data_Altitudes']
+
+        self.__profiles_per_record = profiles_per_record
+        self.__num_records = len(self.__time)
+        self.__time_bounds = (np.min(self.__time), np.max(self.__time))
+        self.__x_range = (0, self.__num_records * profiles_per_record)
+
+    def get_filename(self):
+        return self.__filename
+
+    def get_stamp(self):
+        """ Name of the file and its modification time, changes when the file does """
+        return '%s_%d' % (os.path.basename(self.__filename),
+                          int(os.path.getmtime(self.__filename)))
+
+    def get_time(self):
+        """ Profile_UTC_Time for every profile of the granule """
+        return self.__time
+
+    def get_latitude(self):
+        """ Latitude for every profile of the granule """
+        return self.__latitude
+
+    def get_altitude(self):
+        """ Lidar_Data_Altitudes from the file metadata """
+        return self.__altitude
+
+    def get_time_bounds(self):
+        """ Tuple of the earliest and latest Profile_UTC_Time in the granule """
+        return self.__time_bounds
+
+    def get_num_records(self):
+        """ Number of records (rows) in the granule, equal to profiles for L1 """
+        return self.__num_records
+
+    def get_num_profiles(self):
+        return self.__num_records * self.__profiles_per_record
+
+    def get_x_range(self):
+        """ Tuple of the first and last profile index that can be viewed """
+        return self.__x_range
+
+    def check_range(self, first, last):
+        """
+        Raises ``IndexError`` if the records ``first:last`` can not be viewed, either because the
+        range is empty, starts before the granule or runs off the end with too few records.
+        Only the range end points are looked at, so this is constant time
+
+        :param int first: first record index
+        :param int last: last record index, exclusive
+        """
+        time = self.__time[first:last]
+        # length of time determines how far the file can be viewed
+        if time[-1] >= self.__time_bounds[1] and len(time) < Granule.MIN_END_RECORDS:
+            raise IndexError
+        if time[0] < self.__time_bounds[0]:
+            raise IndexError
+
+    def read(self, dataset, first, last):
+        """
+        Slice the profiles ``first:last`` of a dataset straight from the open file
+
+        :param str dataset: SDS name, e.g. ``Total_Attenuated_Backscatter_532``
+        :param int first: first profile (or record for L2) index
+        :param int last: last profile (or record for L2) index, exclusive
+        """
+        with self._lock, timed('read'):
+            return self.__product[dataset][first:last]
+
+    def iter_blocks(self, dataset, first, last, width=None):
+        """
+        Read the profiles ``first:last`` of a dataset a chunk at a time instead of in one slice,
+        so the stages consuming the chunks never hold more than one of them besides their output.
+        Every chunk holds a whole number of blocks of *width* profiles, about
+        ``constants.STREAM_CHUNK_PROFILES`` profiles in all, and trailing records that do not
+        fill a block are not read, as the averaging drops them anyway
+
+        :param str dataset: SDS name, e.g. ``Total_Attenuated_Backscatter_532``
+        :param int first: first profile (or record for L2) index
+        :param int last: last profile (or record for L2) index, exclusive
+        :param int width: profiles per block, e.g. the averaging width for L1, must be a multiple
+                          of the profiles per record. Defaults to one record, 15 profiles for L2
+        :returns: generator of tuples of the record offset of the chunk from *first* and the
+                  chunk, records x bins as :py:meth:`read` returns it
+        """
+        return _iter_blocks(self.read, self.__profiles_per_record, dataset, first, last, width)
+
+    def nbytes(self):
+        """ Number of bytes held resident by this granule and its products """
+        resident = self.__time.nbytes + self.__latitude.nbytes + self.__altitude.nbytes
+        return resident + self.products_nbytes()
+
+    def _close_files(self):
+        logger.info('Closing granule ' + str(self.__filename))
+        self.__product.close()
+
+
+class GranuleSequence(_Resident):
+    """
+    Consecutive granules of one product, e.g. the L1 granules of a day, viewed as a single
+    granule whose profiles run on from one file into the next. It has the methods of
+    :py:class:`Granule`, so the renderers draw any range of the sequence, across granule
+    boundaries, without knowing it is more than one file
+
+    Only the per-profile time and latitude of the granules are joined, into the global index
+    of the sequence. Datasets are sliced from the granules a range overlaps when it is read, a
+    chunk of :py:meth:`iter_blocks` at a time, so no dataset is ever joined whole. Products are
+    kept, and closing waits for the users of the sequence, as for a granule
+
+    :param filenames: paths to the granules in time order
+    :param int profiles_per_record: profiles stored in one record, 1 for L1 and 15 for L2 VFM
+    """
+
+    def __init__(self, filenames, profiles_per_record=1):
+        super(GranuleSequence, self).__init__()
+        # Opened here rather than through a GranuleCache, so the cache can not close a granule
+        # the sequence still reads from
+        self.__granules = [Granule(filename, profiles_per_record) for filename in filenames]
+        self.__altitude = self.__granules[0].get_altitude()
+        for granule in self.__granules[1:]:
+            if not np.array_equal(granule.get_altitude(), self.__altitude):
+                raise ValueError('Lidar_Data_Altitudes of ' + granule.get_filename() +
+                                 ' differ from those of ' + self.__granules[0].get_filename())
+
+        # Record index the records of each granule start at, and the end of the last one
+        self.__offsets = np.cumsum([0] + [granule.get_num_records()
+                                          for granule in self.__granules])
+        self.__time = np.concatenate([granule.get_time() for granule in self.__granules])
+        self.__latitude = np.concatenate([granule.get_latitude() for granule in self.__granules])
+
+        self.__profiles_per_record = profiles_per_record
+        self.__num_records = int(self.__offsets[-1])
+        self.__time_bounds = (min(granule.get_time_bounds()[0] for granule in self.__granules),
+                              max(granule.get_time_bounds()[1] for granule in self.__granules))
+        self.__x_range = (0, self.__num_records * profiles_per_record)
+
+    def get_filename(self):
+        """ Path to the first granule of the sequence """
+        return self.__granules[0].get_filename()
+
+    def get_filenames(self):
+        return [granule.get_filename() for granule in self.__granules]
+
+    def get_stamp(self):
+        """ Stamp of the first granule and the number of granules, tiles of the sequence go here """
+        return '%s_%d_granules' % (self.__granules[0].get_stamp(), len(self.__granules))
+
+    def get_time(self):
+        """ Profile_UTC_Time for every profile of every granule """
+        return self.__time
+
+    def get_latitude(self):
+        """ Latitude for every profile of every granule """
+        return self.__latitude
+
+    def get_altitude(self):
+        """ Lidar_Data_Altitudes, the same for every granule """
+        return self.__altitude
+
+    def get_time_bounds(self):
+        return self.__time_bounds
+
+    def get_num_records(self):
+        return self.__num_records
+
+    def get_num_profiles(self):
+        return self.__num_records * self.__profiles_per_record
+
+    def get_x_range(self):
+        return self.__x_range
+
+    def locate(self, record):
+        """
+        Returns the granule holding *record* of the sequence and the index of the record in it
+
+        :param int record: record index in the sequence
+        :rtype: tuple of :py:class:`Granule` and int
+        """
+        index = int(np.searchsorted(self.__offsets, record, side='right')) - 1
+        index = min(max(index, 0), len(self.__granules) - 1)
+        return self.__granules[index], record - int(self.__offsets[index])
+
+    def check_range(self, first, last):
+        """ See :py:meth:`Granule.check_range`, the ends are those of the whole sequence """
+        time = self.__time[first:last]
+        if time[-1] >= self.__time_bounds[1] and len(time) < Granule.MIN_END_RECORDS:
+            raise IndexError
+        if time[0] < self.__time_bounds[0]:
+            raise IndexError
+
+    def read(self, dataset, first, last):
+        """
+        Slice the records ``first:last`` of a dataset from the granules they are in. Only a
+        range that crosses a granule boundary is joined, from the slices of each granule
+
+        :param str dataset: SDS name, e.g. ``Total_Attenuated_Backscatter_532``
+        :param int first: first profile (or record for L2) index
+        :param int last: last profile (or record for L2) index, exclusive
+        """
+        slices = []
+        for index, granule in enumerate(self.__granules):
+            start, stop = self.__offsets[index], self.__offsets[index + 1]
+            if first < stop and last > start:
+                slices.append(granule.read(dataset, max(first - start, 0),
+                                           min(last, stop) - start))
+        if len(slices) == 1:
+            return slices[0]
+        return np.concatenate(slices)
+
+    def iter_blocks(self, dataset, first, last, width=None):
+        """ See :py:meth:`Granule.iter_blocks`, a chunk may span two granules """
+        return _iter_blocks(self.read, self.__profiles_per_record, dataset, first, last, width)
+
+    def nbytes(self):
+        """ Number of bytes held resident by the sequence, its granules and its products """
+        resident = self.__time.nbytes + self.__latitude.nbytes
+        return resident + sum(granule.nbytes() for granule in self.__granules) + \
+            self.products_nbytes()
+
+    def _close_files(self):
+        for granule in self.__granules:
+            granule.close()
+
+
+class GranuleCache(object):
+    """
+    Least recently used cache of :py:class:`Granule` objects keyed by filename, and of
+    :py:class:`GranuleSequence` objects keyed by the tuple of their filenames. Granules are
+    evicted, and closed, once the resident memory of all granules exceeds the budget. The most
+    recently requested granule is never evicted, and the files of a granule held by
+    :py:meth:`use` are only closed once it is released. The cache is safe to use from the
+    render worker thread
+
+    :param int budget: memory budget in bytes, defaults to ``constants.GRANULE_CACHE_BUDGET``
+    """
+
+    def __init__(self, budget=constants.GRANULE_CACHE_BUDGET):
+        self.__budget = budget
+        self.__granules = OrderedDict()
+        self.__lock = threading.RLock()
+
+    def get(self, filename, profiles_per_record=1):
+        """
+        Return the granule for *filename*, opening the file only if it is not cached
+
+        :param str filename: path to an L1 or L2 HDF file
+        :param int profiles_per_record: 1 for L1 files, 15 for L2 VFM files
+        :rtype: :py:class:`Granule`
+        """
+        return self.__get(filename, lambda: Granule(filename, profiles_per_record))
+
+    def get_sequence(self, filenames, profiles_per_record=1):
+        """
+        Return the :py:class:`GranuleSequence` of *filenames*, opening the files only if it is
+        not cached. It is cached and evicted as one entry, apart from the granules of the files
+
+        :param filenames: paths to consecutive L1 or L2 HDF files in time order
+        :param int profiles_per_record: 1 for L1 files, 15 for L2 VFM files
+        :rtype: :py:class:`GranuleSequence`
+        """
+        filenames = tuple(filenames)
+        return self.__get(filenames, lambda: GranuleSequence(filenames, profiles_per_record))
+
+    @contextmanager
+    def use(self, get):
+        """
+        Hold a granule of the cache in use for the body of a ``with`` statement, so its files
+        stay open while it is read even if it is evicted meanwhile
+
+        :param get: function taking no arguments that returns the granule from this cache,
+                    e.g. ``lambda: cache.get(filename)``
+        """
+        # Under the cache lock, so the granule can not be evicted before it is in use
+        with self.__lock:
+            granule = get().acquire()
+        try:
+            yield granule
+        finally:
+            granule.release()
+
+    def set_budget(self, budget):
+        with self.__lock:
+            self.__budget = budget
+            self.__evict()
+
+    def nbytes(self):
+        with self.__lock:
+            return sum(granule.nbytes() for granule in self.__granules.values())
+
+    def clear(self):
+        with self.__lock:
+            while self.__granules:
+                self.__granules.popitem(last=False)[1].close()
+
+    def __get(self, key, open_):
+        with self.__lock:
+            granule = self.__granules.pop(key, None)
+            if granule is None:
+                granule = open_()
+            # Re-inserting moves the granule to the most recently used end
+            self.__granules[key] = granule
+            self.__evict()
+            return granule
+
+    def __evict(self):
+        while len(self.__granules) > 1 and self.nbytes() > self.__budget:
+            filename, granule = self.__granules.popitem(last=False)
+            logger.info('Evicting granule ' + str(filename))
+            granule.close()
@@ -0,0 +1,171 @@
+###################################
+#   granulestore.py
+#
+#   Converts the datasets VOCAL uses from a CALIPSO HDF4 granule into a
+#   folder of uncompressed .npy files, and reads them back memory mapped so
+#   a render only pages in the profiles it slices
+###################################
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from ccplot.hdf import HDF
+import numpy as np
+
+import constants
+from log.log import logger
+
+# Datasets copied from the HDF file when present, L1 files hold the backscatter and L2 VFM
+# files the feature classification flags
+DATASETS = ['Total_Attenuated_Backscatter_532', 'Perpendicular_Attenuated_Backscatter_532',
+            'Feature_Classification_Flags', 'Profile_UTC_Time', 'Latitude', 'Longitude']
+
+# Fields copied from the file metadata
+METADATA = ['Lidar_Data_Altitudes']
+
+MANIFEST = 'manifest.json'
+
+
+class NpyGranule(object):
+    """
+    A converted granule, indexed like ``ccplot.hdf.HDF``: ``granule['Latitude']`` returns the
+    dataset and ``granule['metadata']['Lidar_Data_Altitudes']`` the metadata. Datasets are
+    memory mapped read only, so slicing them only reads the pages of the rows sliced
+
+    :param str path: folder written by :py:func:`convert_granule`
+    """
+
+    def __init__(self, path):
+        self.__path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.__manifest = json.load(f)
+        self.__metadata = dict((name, np.load(os.path.join(path, 'metadata_' + name + '.npy')))
+                               for name in self.__manifest['metadata'])
+
+    def __getitem__(self, key):
+        if key == 'metadata':
+            return self.__metadata
+        if key not in self.__manifest['datasets']:
+            raise KeyError(key)
+        return np.load(os.path.join(self.__path, key + '.npy'), mmap_mode='r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def keys(self):
+        return list(self.__manifest['datasets'])
+
+    def get_source(self):
+        """ Path of the HDF file the granule was converted from """
+        return self.__manifest['source']
+
+    def close(self):
+        # Memory maps are released when the arrays sliced from them are
+        pass
+
+
+def store_path(filename, directory=constants.GRANULE_STORE_DIR):
+    """ Folder the converted copy of *filename* is written to """
+    return os.path.join(directory, os.path.splitext(os.path.basename(filename))[0])
+
+
+def is_converted(filename, directory=constants.GRANULE_STORE_DIR):
+    """
+    Return ``True`` if *filename* has a converted copy written from the file as it is now,
+    i.e. the size and modification time recorded when converting still match
+    """
+    manifest = os.path.join(store_path(filename, directory), MANIFEST)
+    if not os.path.exists(manifest):
+        return False
+    with open(manifest) as f:
+        source = json.load(f)
+    stat = os.stat(filename)
+    return source['size'] == stat.st_size and source['mtime'] == int(stat.st_mtime)
+
+
+def write_granule(path, datasets, metadata, source=None):
+    """
+    Write arrays to a folder readable by :py:class:`NpyGranule`. The folder is built under a
+    temporary name and renamed into place, so a reader never sees a partial granule
+
+    :param str path: folder to write, replaced if it exists
+    :param dict datasets: dataset name to array, shaped like the HDF datasets
+    :param dict metadata: metadata field name to array
+    :param dict source: ``source``, ``size`` and ``mtime`` of the file the arrays came from
+    :returns: *path*
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp = tempfile.mkdtemp(dir=directory)
+
+    manifest = dict(source or {'source': None, 'size': None, 'mtime': None})
+    manifest['datasets'] = {}
+    manifest['metadata'] = []
+    for name, data in datasets.items():
+        np.save(os.path.join(temp, name + '.npy'), data)
+        manifest['datasets'][name] = {'shape': data.shape, 'dtype': data.dtype.str}
+    for name, data in metadata.items():
+        np.save(os.path.join(temp, 'metadata_' + name + '.npy'), np.asarray(data))
+        manifest['metadata'].append(name)
+    with open(os.path.join(temp, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(temp, path)
+    return path
+
+
+def convert_granule(filename, directory=constants.GRANULE_STORE_DIR):
+    """
+    Write the datasets in ``DATASETS`` and the metadata in ``METADATA`` found in the HDF file
+    *filename* to a folder of ``.npy`` files with :py:func:`write_granule`
+
+    :param str filename: path to an L1 or L2 HDF file
+    :param str directory: root folder of converted granules
+    :returns: path of the converted granule
+    """
+    path = store_path(filename, directory)
+    logger.info('Converting ' + filename + ' to ' + path)
+
+    stat = os.stat(filename)
+    source = {'source': os.path.abspath(filename), 'size': stat.st_size,
+              'mtime': int(stat.st_mtime)}
+    with HDF(filename) as product:
+        datasets = dict((name, product[name][:]) for name in DATASETS if name in product.keys())
+        metadata = dict((name, product['metadata'][name]) for name in METADATA)
+    return write_granule(path, datasets, metadata, source)
+
+
+def open_granule(filename, directory=constants.GRANULE_STORE_DIR):
+    """
+    Open *filename*, preferring an up to date converted copy over the HDF file. *filename*
+    may also be a granule folder itself, such as a synthetic granule
+
+    :param str filename: path to an L1 or L2 HDF file, or to a granule folder
+    :param str directory: root folder of converted granules
+    :rtype: :py:class:`NpyGranule` or ``ccplot.hdf.HDF``
+    """
+    if os.path.isfile(os.path.join(filename, MANIFEST)):
+        return NpyGranule(filename)
+    if is_converted(filename, directory):
+        logger.info('Using converted copy of ' + filename)
+        return NpyGranule(store_path(filename, directory))
+    return HDF(filename)
+
+#
+# Convert the granules given on the command line, e.g.
+#   python -m tools.granulestore CAL_LID_L1-*.hdf CAL_LID_L2_VFM-*.hdf
+
+if __name__ == '__main__':
+    for hdf_file in sys.argv[1:]:
+        if is_converted(hdf_file):
+            print('Already converted ' + hdf_file)
+        else:
+            print('Converted ' + hdf_file + ' to ' + convert_granule(hdf_file))
@@ -13,6 +13,7 @@ import os
 
 import numpy as np
 from log.log import logger, error_check
+from granulecache import GranuleCache
 
 
 class LoadData:
@@ -26,7 +27,18 @@ class LoadData:
         # (0 = Backscatter,  1 = Depolarization, 2 = VFM, 3 = IWP, 4 = blend, 5 = Horz Avging). See 
         # DataSet Class for more information
         self.__data_sets = []
-        
+        self.__filenameL1 = ""
+        self.__filenameL2 = ""
+
+        # Granules opened through get_granule stay open here until evicted, so switching plot
+        # types or panning over the same file does not reopen it
+        self.__granule_cache = GranuleCache(constants.GRANULE_CACHE_BUDGET)
+
+        # When stitched, get_granule returns every granule of the day of the file as one
+        # sequence, the files stitched for each level are kept here
+        self.__stitched = False
+        self.__consecutive_files = dict()
+
         if filename == 'Empty' or filename == '':
             logger.error('File not found or not useful...')
             return
@@ -59,6 +71,114 @@ class LoadData:
             logger.error('Out of range, Suppports Level 1 and 2 data files.')
             return ""
 
+    def get_granule(self, levelToGet=1):
+        """
+        Returns the cached :py:class:`tools.granulecache.Granule` for the L1 or L2 file,
+        opening it on first use. A copy converted by :py:mod:`tools.granulestore` is read
+        instead of the HDF file when it is up to date
+
+        :param int levelToGet: 1 for the L1 file, 2 for the L2 VFM file
+        """
+        # Each L2 VFM record holds 15 profiles
+        profiles_per_record = 15 if levelToGet == 2 else 1
+        if self.__stitched:
+            filenames = self.__stitched_files(levelToGet)
+            if len(filenames) > 1:
+                return self.__granule_cache.get_sequence(filenames, profiles_per_record)
+        return self.__granule_cache.get(self.get_file_name(levelToGet), profiles_per_record)
+
+    def use_granule(self, levelToGet=1):
+        """
+        Context manager holding the granule returned by :py:meth:`get_granule` in use, so it is
+        not closed while read on the render worker even if the cache evicts it meanwhile, see
+        :py:meth:`tools.granulecache.GranuleCache.use`
+
+        :param int levelToGet: 1 for the L1 file, 2 for the L2 VFM file
+        """
+        return self.__granule_cache.use(lambda: self.get_granule(levelToGet))
+
+    def set_stitched(self, stitched):
+        """
+        Switch :py:meth:`get_granule` between the file alone and every granule of its day found
+        by :py:meth:`find_consecutive_files`, stitched into one
+        :py:class:`tools.granulecache.GranuleSequence`. Profile indices then count from the
+        first granule of the day, so any span across granule boundaries can be plotted
+
+        :param bool stitched: ``True`` to stitch the granules of the day
+        """
+        self.__stitched = stitched
+
+    def is_stitched(self):
+        """
+        Whether the plots span several granules, when stitching is set but no other granule of
+        the day is found for both levels the file is plotted alone
+
+        :returns: ``True`` if profile indices count from the first granule of the day
+        """
+        return self.__stitched and len(self.__stitched_files(1)) > 1
+
+    def __stitched_files(self, levelToGet):
+        if not self.__consecutive_files:
+            found = dict((level, self.find_consecutive_files(level)) for level in (1, 2))
+            # Only granules found for both levels are stitched, so a profile index is the same
+            # place in the L1 and the L2 plots. With none in common each level has no files and
+            # get_granule opens the file alone
+            both = set(filename[-25:-4] for filename in found[1]) & \
+                set(filename[-25:-4] for filename in found[2])
+            for level, filenames in found.items():
+                self.__consecutive_files[level] = \
+                    [filename for filename in filenames if filename[-25:-4] in both]
+        return self.__consecutive_files[levelToGet]
+
+    def find_consecutive_files(self, levelToGet=1):
+        """
+        Find the granules of the same product recorded on the same day as the L1 or L2 file, in
+        the same folder. Like :py:meth:`find_my_file` files are matched by name, CALIPSO file
+        names end in the start time of the granule, e.g. ``2017-07-01T00-22-49ZN.hdf``, so the
+        files wanted are those whose names only differ from the file in the time of day
+
+        :param int levelToGet: 1 for the L1 file, 2 for the L2 VFM file
+        :returns: paths to the files in time order, the file itself included, or an empty list
+                  if no file is loaded for the level
+        """
+        filename = self.get_file_name(levelToGet)
+        if filename == "":
+            return []
+        search_path, name = os.path.split(filename)
+        product = name[:-25]
+        day = name[-25:-15]
+        extension = name[-4:]
+
+        matches = [file_name for file_name in os.listdir(search_path or os.curdir)
+                   if len(file_name) == len(name) and  # Same product and version
+                   file_name.startswith(product) and
+                   file_name[-25:-15] == day and  # Recorded the same day
+                   file_name.endswith(extension)]
+        if name not in matches:
+            matches.append(name)
+        # The time in the names sorts the granules in the order they were recorded
+        matches.sort(key=lambda file_name: file_name[-25:-4])
+        logger.info('Found %d granules of %s' % (len(matches), day))
+        return [os.path.join(search_path, file_name) for file_name in matches]
+
+    def iter_profile_blocks(self, dataset, first, last, width=None, levelToGet=1):
+        """
+        Reads the profiles ``first:last`` of a dataset of the L1 or L2 file a chunk at a time,
+        see :py:meth:`tools.granulecache.Granule.iter_blocks`. Each chunk holds whole blocks of
+        *width* profiles, the averaging width for L1 and 15 profile records for L2, so the
+        averaging, VFM unpacking and regridding stages can consume them as they come
+
+        :param str dataset: SDS name, e.g. ``Feature_Classification_Flags``
+        :param int first: first profile (or record for L2) index
+        :param int last: last profile (or record for L2) index, exclusive
+        :param int width: profiles per block, defaults to one record
+        :param int levelToGet: 1 for the L1 file, 2 for the L2 VFM file
+        """
+        return self.get_granule(levelToGet).iter_blocks(dataset, first, last, width)
+
+    def get_granule_cache(self):
+        return self.__granule_cache
+
     def find_my_file(self, in_filename=""):
 
         if in_filename != "":
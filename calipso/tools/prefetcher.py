@@ -0,0 +1,121 @@
+###################################
+#   prefetcher.py
+#
+#   Prepares the windows either side of the one on screen while the user
+#   is looking at it, so a pan usually only has to draw
+###################################
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+import constants
+from log.log import logger
+from plot.prepared_plot import PreparedPlot
+
+
+class Prefetcher(object):
+    """
+    Bounded least recently used cache of :py:class:`plot.prepared_plot.PreparedPlot` windows.
+    After a render is drawn, :py:meth:`prefetch` keeps its window and queues the windows of the
+    same width either side of it on the render worker. :py:meth:`find` then builds any window
+    lying inside a chain of neighbouring cached windows by joining and cropping them, without
+    reading the granule
+
+    Windows are only combined with windows of the same plot type, file and width, since the
+    averaging of the L1 plots depends on the width of the window
+
+    :param worker: :py:class:`tools.renderworker.RenderWorker` the windows are prepared on
+    :param int max_plots: number of windows kept, defaults to ``constants.PREFETCH_WINDOWS``
+    """
+
+    def __init__(self, worker, max_plots=constants.PREFETCH_WINDOWS):
+        self.__worker = worker
+        self.__max_plots = max_plots
+        # (plot type, filename, width, first profile) -> PreparedPlot, most recently used last
+        self.__plots = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def find(self, plot_type, filename, x_range):
+        """
+        Return the prepared window for *x_range* built from cached windows, or ``None`` if the
+        cached windows do not cover it
+
+        :param int plot_type: plot type the window was prepared for
+        :param str filename: file the window was read from
+        :param x_range: Tuple of the first and last profile index of the window
+        :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
+        """
+        kind = (plot_type, filename, x_range[1] - x_range[0])
+        with self.__lock:
+            by_first = dict((plot.get_x_range()[0], (key, plot))
+                            for key, plot in self.__plots.items() if key[:3] == kind)
+            for key, plot in by_first.values():
+                if not plot.get_x_range()[0] <= x_range[0] < plot.get_x_range()[1]:
+                    continue
+                # Follow the windows starting where the previous one stops
+                chain = [(key, plot)]
+                while chain[-1][1].get_x_range()[1] < x_range[1] and \
+                        chain[-1][1].get_x_range()[1] in by_first:
+                    chain.append(by_first[chain[-1][1].get_x_range()[1]])
+                if chain[-1][1].get_x_range()[1] < x_range[1]:
+                    continue
+                for used, _ in chain:
+                    self.__plots[used] = self.__plots.pop(used)
+                try:
+                    return PreparedPlot.join([plot for _, plot in chain]).crop(x_range)
+                except (ValueError, IndexError):
+                    return None
+        return None
+
+    def prefetch(self, plot_type, filename, x_range, prepared, prepare):
+        """
+        Keep the window *prepared* that was just drawn and queue the windows of the same width
+        either side of it on the render worker
+
+        :param int plot_type: plot type of the window
+        :param str filename: file the window was read from
+        :param x_range: Tuple of the first and last profile index the user asked for
+        :param prepared: :py:class:`plot.prepared_plot.PreparedPlot` of the window
+        :param prepare: function taking an x range and returning its
+                        :py:class:`plot.prepared_plot.PreparedPlot`, called on the worker thread
+        """
+        width = x_range[1] - x_range[0]
+        self.__store((plot_type, filename, width), prepared)
+
+        first, last = prepared.get_x_range()
+        # Start the window before on a column boundary, so it lines up with this one
+        per_column = prepared.get_profiles_per_column()
+        before = first - int(round(np.ceil(width / per_column) * per_column))
+        for neighbour in ((last, last + width), (before, first)):
+            if neighbour[0] < 0 or self.find(plot_type, filename, neighbour) is not None:
+                continue
+            self.__worker.submit_background(
+                self.__prefetch_job((plot_type, filename, width), prepare, neighbour))
+
+    def clear(self):
+        with self.__lock:
+            self.__plots.clear()
+
+    def nbytes(self):
+        with self.__lock:
+            return sum(plot.nbytes() for plot in self.__plots.values())
+
+    def __prefetch_job(self, kind, prepare, x_range):
+        def prefetch_neighbour():
+            try:
+                prepared = prepare(x_range)
+            except IndexError:
+                # Past the end of the granule
+                logger.info('Nothing to prefetch at ' + str(x_range))
+                return
+            self.__store(kind, prepared)
+        return prefetch_neighbour
+
+    def __store(self, kind, prepared):
+        key = kind + (prepared.get_x_range()[0],)
+        with self.__lock:
+            self.__plots.pop(key, None)
+            self.__plots[key] = prepared
+            while len(self.__plots) > self.__max_plots:
+                self.__plots.popitem(last=False)
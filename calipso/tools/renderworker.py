@@ -0,0 +1,173 @@
+###################################
+#   renderworker.py
+#
+#   Runs the data preparation of a render (read, decode, average, regrid)
+#   on a background thread so the Tk main loop keeps handling events
+###################################
+from Queue import Queue, Empty
+import threading
+
+from log.log import logger
+
+# Cancel check of the background job running on the worker thread, see check_cancelled
+_background = threading.local()
+
+
+class Cancelled(Exception):
+    """ Raised by :py:func:`check_cancelled` in a background job that a render superseded """
+
+
+def check_cancelled():
+    """
+    Raise :py:class:`Cancelled` if called from a background job that anything has been
+    submitted after. Stages that read a granule a chunk at a time call it between chunks, so a
+    prefetch gives way to a render within a chunk instead of running to its end first. Outside
+    a background job this does nothing
+    """
+    cancelled = getattr(_background, 'cancelled', None)
+    if cancelled is not None and cancelled():
+        raise Cancelled
+
+
+class RenderWorker(object):
+    """
+    A single background thread that runs render jobs one at a time. Only the preparation half
+    of a render runs on the thread. The finished result is handed back to the Tk thread by
+    polling with ``root.after``, where the callbacks passed to :py:meth:`submit` are called
+
+    Every submit starts a new generation and cancels all earlier jobs. Jobs that have not
+    started yet are skipped, and the results of jobs that were already running are dropped
+    when they come back, so only the most recent render ever reaches the canvas. A running
+    background job stops at its next :py:func:`check_cancelled`, so a render never waits for
+    a prefetch to finish
+
+    :param root: Tk root used to schedule the polling
+    """
+
+    # Milliseconds between checks for finished jobs while any are outstanding
+    POLL_INTERVAL = 30
+
+    def __init__(self, root):
+        self.__root = root
+        self.__jobs = Queue()
+        self.__results = Queue()
+        self.__lock = threading.Lock()
+        self.__generation = 0
+        self.__outstanding = 0
+        self.__polling = False
+
+        self.__thread = threading.Thread(target=self.__run, name='RenderWorker')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def submit(self, prepare, on_done, on_error=None):
+        """
+        Cancel any outstanding job and queue *prepare* to run on the worker thread
+
+        :param prepare: function taking no arguments run on the worker thread, must not touch
+                        Tk or matplotlib
+        :param on_done: called on the Tk thread with the return value of *prepare*
+        :param on_error: called on the Tk thread with the exception if *prepare* raises
+        :returns: the generation of the job
+        """
+        with self.__lock:
+            self.__generation += 1
+            self.__outstanding += 1
+            generation = self.__generation
+        self.__jobs.put((generation, prepare, on_done, on_error, False))
+        self.__start_polling()
+        return generation
+
+    def submit_background(self, run):
+        """
+        Queue low priority work, such as prefetching, behind the current render. The job is
+        skipped if anything is submitted before it starts, and stopped at its next
+        :py:func:`check_cancelled` if anything is submitted while it runs. Nothing is handed back
+        to the Tk thread and errors are only logged
+
+        :param run: function taking no arguments run on the worker thread
+        """
+        with self.__lock:
+            generation = self.__generation
+        self.__jobs.put((generation, run, None, None, True))
+
+    def cancel(self):
+        """ Cancel every outstanding job, none of their callbacks will be called """
+        with self.__lock:
+            self.__generation += 1
+
+    def is_current(self, generation):
+        """ Return ``True`` if the job of *generation* has not been cancelled """
+        with self.__lock:
+            return generation == self.__generation
+
+    def is_busy(self):
+        """ Return ``True`` while any job is queued, running or waiting to be handed back """
+        with self.__lock:
+            return self.__outstanding > 0
+
+    def shutdown(self):
+        """ Cancel outstanding jobs and stop the worker thread once its current job finishes """
+        self.cancel()
+        self.__jobs.put(None)
+
+    def __run(self):
+        while True:
+            job = self.__jobs.get()
+            if job is None:
+                return
+            generation, prepare, on_done, on_error, background = job
+            if background:
+                if self.is_current(generation):
+                    self.__run_background(prepare, generation)
+                continue
+            if not self.is_current(generation):
+                # Superseded before it started, nothing to hand back
+                self.__finish()
+                continue
+            try:
+                result, error = prepare(), None
+            except Exception as e:
+                logger.exception('Render job failed')
+                result, error = None, e
+            self.__results.put((generation, result, error, on_done, on_error))
+
+    def __run_background(self, run, generation):
+        _background.cancelled = lambda: not self.is_current(generation)
+        try:
+            run()
+        except Cancelled:
+            logger.info('Background render job cancelled')
+        except Exception:
+            logger.exception('Background render job failed')
+        finally:
+            _background.cancelled = None
+
+    def __finish(self):
+        with self.__lock:
+            self.__outstanding -= 1
+
+    def __start_polling(self):
+        if not self.__polling:
+            self.__polling = True
+            self.__root.after(RenderWorker.POLL_INTERVAL, self.__poll)
+
+    def __poll(self):
+        while True:
+            try:
+                generation, result, error, on_done, on_error = self.__results.get_nowait()
+            except Empty:
+                break
+            self.__finish()
+            if not self.is_current(generation):
+                logger.info('Dropping cancelled render')
+                continue
+            if error is None:
+                on_done(result)
+            elif on_error is not None:
+                on_error(error)
+
+        if self.is_busy():
+            self.__root.after(RenderWorker.POLL_INTERVAL, self.__poll)
+        else:
+            self.__polling = False
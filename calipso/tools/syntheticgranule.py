@@ -0,0 +1,352 @@
+###################################
+#   syntheticgranule.py
+#
+#   Writes made up but realistic L1 and L2 VFM granule pairs, so loading,
+#   rendering and extracting can be load tested and profiled without any
+#   NASA files, e.g.
+#
+#   python -m tools.syntheticgranule /data/synthetic -n 20
+###################################
+import argparse
+from datetime import datetime, timedelta
+import os
+
+import numpy as np
+
+import constants
+from granulestore import store_path, write_granule
+from log.log import logger
+from plot.vfm_row2block import vfm_block2rows, PROFILES_PER_ROW
+
+# Fill value of the L1 float datasets. The -999 fill of the L2 layer products is not used,
+# VOCAL reads none of them and missing VFM data is the invalid feature type instead
+FILL_VALUE = -9999.0
+
+# Records of a full L2 VFM granule and profiles of a full L1 granule
+L2_RECORDS = 3744
+L1_PROFILES = 56000
+
+# A granule covers half an orbit, about 46 minutes of 1/3 km profiles
+PROFILE_SECONDS = 2785.0 / (L2_RECORDS * PROFILES_PER_ROW)
+GRANULE_INTERVAL = timedelta(minutes=49, seconds=20)
+
+# Profiles generated at a time, keeps the float64 temporaries small
+CHUNK_PROFILES = 4096
+
+# Feature types of the Feature_Classification_Flags, see plot.interpret_vfm_type
+INVALID, CLEAR_AIR, CLOUD, AEROSOL, STRATOSPHERIC, SURFACE, SUBSURFACE, NO_SIGNAL = range(8)
+
+SOURCE_NOTE = 'Synthetic granule written by tools.syntheticgranule, the data is in %s\n'
+
+
+def lidar_altitudes():
+    """
+    The 583 Lidar_Data_Altitudes in km, top down, with the spacing of the real ones: 300 m above
+    30.1 km, 180 m to 20.2 km, 60 m to 8.2 km, 30 m to -0.5 km and 300 m below
+    """
+    regions = [(40.0, 30.1, 33), (30.1, 20.2, 55), (20.2, 8.2, 200), (8.2, -0.5, 290),
+               (-0.5, -2.0, 5)]
+    return np.concatenate([np.linspace(top, bottom, n, endpoint=False)
+                           for top, bottom, n in regions])
+
+
+def profile_times(start, count, seconds):
+    """
+    Monotonic Profile_UTC_Time of *count* profiles *seconds* apart from *start*, stored like
+    CALIPSO as yymmdd plus the fraction of the day, one column per profile
+
+    :param datetime start: time of the first profile
+    """
+    elapsed = (start.hour * 3600 + start.minute * 60 + start.second) + np.arange(count) * seconds
+    days = (elapsed // 86400).astype(int)
+    dates = [start.date() + timedelta(days=day) for day in range(days[-1] + 1)]
+    yymmdd = np.array([(d.year - 2000) * 10000 + d.month * 100 + d.day for d in dates], float)
+    return (yymmdd[days] + (elapsed % 86400) / 86400.0)[:, np.newaxis]
+
+
+def _smooth(random, count, scale):
+    """ Smooth noise of unit spread, linear between random knots *scale* profiles apart """
+    knots = random.standard_normal(count // scale + 2)
+    return np.interp(np.arange(count) / float(scale), np.arange(len(knots)), knots)
+
+
+class Scene(object):
+    """
+    The atmosphere below one granule track, one value per profile: surface elevation, at most one
+    cloud layer, a boundary layer of aerosol and polar stratospheric layers. Both the L1 signal
+    and the L2 classification are derived from it, so the pair of granules agree
+
+    :param int count: number of profiles
+    :param latitude: latitude of every profile
+    :param random: ``numpy.random.RandomState`` the scene is drawn from
+    """
+
+    def __init__(self, count, latitude, random):
+        self.latitude = latitude
+        land = _smooth(random, count, 2000) > 0
+        self.surface = np.where(land, np.clip(_smooth(random, count, 400), 0, 4), 0.0)
+
+        self.cloud_top = 2 + 10 * np.clip(0.5 + 0.3 * _smooth(random, count, 300), 0, 1)
+        thickness = 0.3 + 3 * np.clip(0.5 + 0.3 * _smooth(random, count, 100), 0, 1)
+        self.cloud_base = np.maximum(self.cloud_top - thickness, self.surface + 0.3)
+        self.ice = self.cloud_top > 7.5
+        self.opaque = thickness > 2.5
+        cloudy = _smooth(random, count, 250) > 0.2
+        self.cloud_top[~cloudy] = np.nan
+        self.cloud_base[~cloudy] = np.nan
+
+        self.aerosol_top = self.surface + np.clip(1.5 + _smooth(random, count, 600), 0, 4)
+        dusty = land & (np.abs(latitude) > 10) & (np.abs(latitude) < 35)
+        # Aerosol subtypes: clean marine over the ocean, dust or smoke over land
+        self.aerosol_subtype = np.where(~land, 1, np.where(dusty, 2, 6))
+
+        polar = (np.abs(latitude) > 60) & (_smooth(random, count, 1000) > 0.5)
+        self.psc_base = np.where(polar, 16.0, np.nan)
+        self.psc_top = np.where(polar, 22.0, np.nan)
+
+        # Short bursts of profiles with no data
+        self.dropped = np.zeros(count, bool)
+        for first in random.randint(0, count, max(count // 20000, 1)):
+            self.dropped[first:first + random.randint(15, 150)] = True
+
+    def masks(self, profiles, altitude):
+        """
+        Boolean masks, profile x altitude, of the profiles *profiles* at *altitude*: cloud,
+        aerosol, stratospheric layer, surface, subsurface and attenuated below an opaque cloud
+        """
+        z = altitude[np.newaxis, :]
+        column = lambda values: values[profiles][:, np.newaxis]
+        with np.errstate(invalid='ignore'):
+            cloud = (z >= column(self.cloud_base)) & (z <= column(self.cloud_top))
+            attenuated = column(self.opaque) & (z < column(self.cloud_base))
+            psc = (z >= column(self.psc_base)) & (z <= column(self.psc_top))
+        surface = np.abs(z - column(self.surface)) < 0.03
+        subsurface = z < column(self.surface) - 0.03
+        aerosol = (z > column(self.surface)) & (z < column(self.aerosol_top)) & ~cloud
+        return cloud, aerosol, psc, surface, subsurface, attenuated
+
+
+def synthetic_l1(scene, start, altitude, count, random):
+    """
+    Total and perpendicular attenuated backscatter of the first *count* profiles of *scene*: a
+    molecular profile with the layers of the scene added, attenuation below opaque clouds, a
+    surface return, relative noise and the fill value for dropped profiles
+
+    :returns: tuple of the dataset and metadata dictionaries taken by
+              :py:func:`tools.granulestore.write_granule`
+    """
+    total = np.empty((count, len(altitude)), np.float32)
+    perpendicular = np.empty((count, len(altitude)), np.float32)
+    molecular = 1.2e-3 * np.exp(-altitude / 8.0)
+    for first in range(0, count, CHUNK_PROFILES):
+        profiles = np.arange(first, min(first + CHUNK_PROFILES, count))
+        cloud, aerosol, psc, surface, subsurface, attenuated = scene.masks(profiles, altitude)
+        column = lambda values: np.broadcast_to(values[profiles][:, np.newaxis], cloud.shape)
+        ice = column(scene.ice)
+        dust = column(scene.aerosol_subtype == 2)
+
+        beta = np.repeat(molecular[np.newaxis, :], len(profiles), axis=0)
+        depolar = np.full(beta.shape, 0.01)
+        beta[aerosol] += 3e-3
+        depolar[aerosol] = np.where(dust, 0.25, 0.05)[aerosol]
+        beta[cloud] += np.where(ice, 1e-2, 4e-2)[cloud]
+        depolar[cloud] = np.where(ice, 0.4, 0.05)[cloud]
+        beta[psc] += 2e-3
+        depolar[psc] = 0.3
+        beta[attenuated] *= 0.02
+        beta[surface] += 0.1
+        depolar[surface] = 0.1
+        beta[subsurface] = 2e-4
+
+        beta *= 1 + 0.3 * random.standard_normal(beta.shape)
+        beta += 1e-4 * random.standard_normal(beta.shape)
+        dropped = scene.dropped[profiles]
+        total[profiles] = np.where(dropped[:, np.newaxis], FILL_VALUE, beta)
+        perpendicular[profiles] = np.where(dropped[:, np.newaxis], FILL_VALUE, beta * depolar)
+
+    datasets = {
+        'Total_Attenuated_Backscatter_532': total,
+        'Perpendicular_Attenuated_Backscatter_532': perpendicular,
+        'Profile_UTC_Time': profile_times(start, count, PROFILE_SECONDS),
+        'Latitude': scene.latitude[:count].astype(np.float32)[:, np.newaxis],
+        'Longitude': _longitude(start, count)[:, np.newaxis],
+    }
+    return datasets, {'Lidar_Data_Altitudes': altitude}
+
+
+def synthetic_l2(scene, start, altitude, records):
+    """
+    Feature_Classification_Flags of *scene* for *records* records of 15 profiles. Each bin packs
+    its feature type, quality, ice water phase, subtype and horizontal averaging like the VFM
+    product, averaged altitudes keep the first profile of each group
+
+    :returns: tuple of the dataset and metadata dictionaries taken by
+              :py:func:`tools.granulestore.write_granule`
+    """
+    height = altitude[33:-5]
+    count = records * PROFILES_PER_ROW
+    block = np.empty((len(height), count), np.uint16)
+    for first in range(0, count, CHUNK_PROFILES):
+        profiles = np.arange(first, min(first + CHUNK_PROFILES, count))
+        cloud, aerosol, psc, surface, subsurface, attenuated = scene.masks(profiles, height)
+        column = lambda values: np.broadcast_to(values[profiles][:, np.newaxis], cloud.shape)
+
+        kind = np.full(cloud.shape, CLEAR_AIR, np.uint16)
+        kind[aerosol] = AEROSOL
+        kind[psc] = STRATOSPHERIC
+        kind[cloud] = CLOUD
+        kind[attenuated & ~cloud] = NO_SIGNAL
+        kind[surface] = SURFACE
+        kind[subsurface] = SUBSURFACE
+        kind[column(scene.dropped)] = INVALID
+
+        ice, opaque = column(scene.ice), column(scene.opaque)
+        top = column(np.nan_to_num(scene.cloud_top))
+        # Cloud subtypes: cirrus, deep convective, altostratus, altocumulus or broken cumulus
+        cloud_subtype = np.where(ice, np.where(opaque & (top > 10), 7, 6),
+                                 np.where(opaque, np.where(top > 4, 5, 1),
+                                          np.where(top > 4, 4, 3)))
+        subtype = np.zeros(cloud.shape, np.uint16)
+        subtype[cloud] = cloud_subtype[cloud]
+        subtype[aerosol] = column(scene.aerosol_subtype)[aerosol]
+        subtype[psc] = 2
+        phase = np.where(cloud, np.where(ice, 1, 2), 0)
+        # Horizontal averaging: 1/3 km for low clouds, 1 km above, 5 km for aerosol and
+        # 20 km for stratospheric layers
+        averaging = np.where(cloud, np.where(top < 8.2, 1, 2),
+                             np.where(aerosol, 3, np.where(psc, 4, 0)))
+        feature = cloud | aerosol | psc
+        quality = np.where(kind == INVALID, 0, np.where(feature, 2, 3))
+
+        flags = kind | (quality << 3) | (phase << 5) | (np.where(cloud, 3, 0) << 7) | \
+            (subtype << 9) | (feature << 12) | (averaging << 13)
+        block[:, profiles] = flags.T
+
+    # The time and position of a record are those of its first profile
+    datasets = {
+        'Feature_Classification_Flags': vfm_block2rows(block),
+        'Profile_UTC_Time': profile_times(start, records, PROFILE_SECONDS * PROFILES_PER_ROW),
+        'Latitude': scene.latitude[::PROFILES_PER_ROW].astype(np.float32)[:, np.newaxis],
+        'Longitude': _longitude(start, count)[::PROFILES_PER_ROW][:, np.newaxis],
+    }
+    return datasets, {'Lidar_Data_Altitudes': altitude}
+
+
+def _latitude(count, ascending):
+    """ Latitude of a half orbit, between the 82 degree turning points of the CALIPSO orbit """
+    latitude = 82 * np.sin(np.linspace(-np.pi / 2, np.pi / 2, count))
+    return latitude if ascending else -latitude
+
+
+def _longitude(start, count):
+    """ Longitude of a half orbit, drifting 180 degrees west and shifted by the start time """
+    offset = (start - datetime(2000, 1, 1)).total_seconds() / 86400.0 * -360
+    longitude = offset + np.linspace(0, -180, count)
+    return ((longitude + 180) % 360 - 180).astype(np.float32)
+
+
+def granule_names(start):
+    """
+    File names of the L1 and L2 VFM granules starting at *start*, named like the real ones so
+    ``LoadData`` pairs them, e.g. ``CAL_LID_L1-Synthetic-V4-10.2017-07-01T00-00-00ZD.hdf``
+    """
+    stamp = start.strftime('%Y-%m-%dT%H-%M-%S') + 'ZD'
+    return ('CAL_LID_L1-Synthetic-V4-10.%s.hdf' % stamp,
+            'CAL_LID_L2_VFM-Synthetic-V4-20.%s.hdf' % stamp)
+
+
+def write_synthetic(filename, datasets, metadata, directory=constants.GRANULE_STORE_DIR):
+    """
+    Write a synthetic granule where :py:func:`tools.granulestore.open_granule` finds it: a small
+    stand in for the HDF file at *filename*, and the data as its converted copy under
+    *directory*. The stand in is never read, the converted copy is up to date with it
+
+    :param str filename: path of the HDF file the granule poses as
+    :param str directory: root folder of converted granules
+    """
+    path = store_path(filename, directory)
+    with open(filename, 'w') as f:
+        f.write(SOURCE_NOTE % path)
+    stat = os.stat(filename)
+    source = {'source': os.path.abspath(filename), 'size': stat.st_size,
+              'mtime': int(stat.st_mtime)}
+    write_granule(path, datasets, metadata, source)
+    return filename
+
+
+def synthetic_pair(start, ascending=True, l1_profiles=L1_PROFILES, l2_records=L2_RECORDS,
+                   seed=0):
+    """
+    Datasets and metadata of the L1 and L2 VFM granules of one half orbit starting at *start*,
+    both drawn from the same :py:class:`Scene`
+
+    :param datetime start: time of the first profile
+    :param bool ascending: whether the track runs south to north
+    :param int l1_profiles: profiles of the L1 granule
+    :param int l2_records: records of 15 profiles of the L2 VFM granule
+    :param int seed: seed of the scene and the noise
+    :returns: tuple of the L1 and L2 tuples of dataset and metadata dictionaries
+    """
+    random = np.random.RandomState(seed)
+    count = max(l1_profiles, l2_records * PROFILES_PER_ROW)
+    scene = Scene(count, _latitude(count, ascending), random)
+    altitude = lidar_altitudes()
+    return (synthetic_l1(scene, start, altitude, l1_profiles, random),
+            synthetic_l2(scene, start, altitude, l2_records))
+
+
+def generate_pair(output, start, ascending=True, l1_profiles=L1_PROFILES, l2_records=L2_RECORDS,
+                  seed=0, directory=constants.GRANULE_STORE_DIR):
+    """
+    Write the L1 and L2 VFM granules of :py:func:`synthetic_pair` to *output*
+
+    :param str output: folder for the granule files
+    :param str directory: root folder of converted granules
+    :returns: tuple of the L1 and L2 file names
+    """
+    l1_name, l2_name = [os.path.join(output, name) for name in granule_names(start)]
+    logger.info('Writing synthetic granules ' + l1_name + ' and ' + l2_name)
+    l1, l2 = synthetic_pair(start, ascending, l1_profiles, l2_records, seed)
+    write_synthetic(l1_name, *l1, directory=directory)
+    write_synthetic(l2_name, *l2, directory=directory)
+    return l1_name, l2_name
+
+
+def generate(output, count, start=datetime(2017, 7, 1), seed=0, **kwargs):
+    """
+    Write *count* consecutive granule pairs to *output*, alternating ascending and descending
+    tracks. Keyword arguments are passed on to :py:func:`generate_pair`
+
+    :returns: list of tuples of the L1 and L2 file names
+    """
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    return [generate_pair(output, start + i * GRANULE_INTERVAL, i % 2 == 0, seed=seed + i,
+                          **kwargs)
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic CALIPSO granule pairs')
+    parser.add_argument('output', help='folder for the granule files')
+    parser.add_argument('-n', '--count', type=int, default=1, help='granule pairs to write')
+    parser.add_argument('--start', default='2017-07-01T00-00-00',
+                        help='time of the first granule, YYYY-MM-DDTHH-MM-SS')
+    parser.add_argument('--profiles', type=int, default=L1_PROFILES,
+                        help='profiles of each L1 granule')
+    parser.add_argument('--records', type=int, default=L2_RECORDS,
+                        help='records of 15 profiles of each L2 VFM granule')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first granule pair')
+    parser.add_argument('--store', default=constants.GRANULE_STORE_DIR,
+                        help='root folder of converted granules the data is written to')
+    args = parser.parse_args()
+
+    pairs = generate(args.output, args.count, datetime.strptime(args.start, '%Y-%m-%dT%H-%M-%S'),
+                     args.seed, l1_profiles=args.profiles, l2_records=args.records,
+                     directory=args.store)
+    for l1_name, l2_name in pairs:
+        print(l1_name)
+        print(l2_name)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+###################################
+#   tilepyramid.py
+#
+#   Splits a granule into fixed width tiles of prepared plot data, kept on
+#   disk at several resolutions, so wide ranges are composited from tiles
+#   instead of being read and averaged again on every render
+###################################
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+
+import constants
+from log.log import logger
+from plot.downsample import downsample
+from plot.prepared_plot import PreparedPlot
+from plot.renderers import profiles_per_column
+from granulecache import Granule
+
+# Profiles a short last tile is padded back by at a time, an L2 record
+PAD_PROFILES = 15
+# Part of every tile folder name, raise it whenever a change to the code alters what the
+# tiles hold so that tiles saved by earlier versions are prepared again, not loaded
+TILE_VERSION = 1
+
+
+class TilePyramid(object):
+    """
+    Tiles of one plot type of one granule. Level 0 splits the granule into tiles of
+    ``tile_profiles`` profiles, each prepared once with the renderer's prepare function. Every
+    level above joins two neighbouring tiles of the level below and halves their columns, so
+    it covers twice the profiles at half the resolution with the same number of columns
+
+    Tiles are saved as ``.npz`` files under *directory* in a folder named after the stamp of the
+    granule, its file and modification time, and ``TILE_VERSION``, so they outlive the session
+    and are rebuilt if the file or the tile format changes. Loaded tiles are kept as products of the granule. The tiles of other
+    granules are pruned to ``constants.TILE_DIR_BUDGET`` bytes, see :py:func:`prune_tiles`
+
+    The last tile of level 0 may hold fewer profiles than the others. It is reduced to the
+    columns of a full tile by :py:func:`match_columns`, so every tile of a level lines up
+
+    :param granule: :py:class:`tools.granulecache.Granule` or
+                    :py:class:`tools.granulecache.GranuleSequence` the tiles are read from
+    :param str name: name of the plot type, used for the tile folder
+    :param prepare: the renderer's ``prepare_*`` function
+    :param int tile_profiles: profiles per level 0 tile, must be divisible by the averaging
+                              width of the plot and by the 15 profiles of an L2 record
+    :param str directory: root folder of the tiles, defaults to ``constants.TILE_DIR``
+    :param per_column: profiles per column of a full tile, by default that of the renderer
+                       called *name*, see :py:func:`plot.renderers.profiles_per_column`
+    """
+
+    def __init__(self, granule, name, prepare, tile_profiles=constants.TILE_PROFILES,
+                 directory=constants.TILE_DIR, per_column=None):
+        self.__granule = granule
+        self.__name = name
+        self.__prepare = prepare
+        self.__tile_profiles = tile_profiles
+        # Profiles in each column of a full tile, known from the renderer without preparing one
+        if per_column is None:
+            per_column = profiles_per_column(name, (0, tile_profiles))
+        self.__per_column = per_column
+
+        # Drop the tiles of the granules used longest ago before adding any of this one
+        stamp = '%s_v%d' % (granule.get_stamp(), TILE_VERSION)
+        prune_tiles(directory, keep=stamp)
+        self.__directory = os.path.join(directory, stamp, name)
+
+        # Tiles of every level cover the whole granule, level 0 may end with a partial tile
+        self.__num_profiles = granule.get_num_profiles()
+        self.__profiles_per_record = self.__num_profiles // granule.get_num_records()
+        num_tiles = int(np.ceil(float(self.__num_profiles) / tile_profiles))
+        self.__top_level = int(np.ceil(np.log2(max(num_tiles, 1))))
+
+    @staticmethod
+    def from_granule(granule, name, prepare):
+        """
+        Returns the tile pyramid of plot *name* of the granule, kept as a product of the granule
+        so every composite of the plot shares its tiles, its level choice and its tile folder
+
+        :param granule: :py:class:`tools.granulecache.Granule` the tiles are read from
+        :param str name: name of the plot type, used for the tile folder
+        :param prepare: the renderer's ``prepare_*`` function
+        """
+        return granule.get_product(('tile_pyramid', name),
+                                   lambda: TilePyramid(granule, name, prepare))
+
+    def nbytes(self):
+        # The tiles are products of the granule themselves
+        return 0
+
+    def get_top_level(self):
+        """ The coarsest level, a single tile covering the whole granule """
+        return self.__top_level
+
+    def get_num_tiles(self, level):
+        return int(np.ceil(float(self.__num_profiles) / (self.__tile_profiles << level)))
+
+    def choose_level(self, x_range, columns=constants.TILE_TARGET_COLUMNS):
+        """
+        Return the coarsest level that still gives *x_range* at least *columns* columns, so an
+        overview of the whole orbit reads a few coarse tiles and a zoom reads fine ones
+
+        :param x_range: Tuple of the first and last profile index
+        :param int columns: columns wanted across the range, about the width of the canvas
+        """
+        ratio = float(x_range[1] - x_range[0]) / (self.__per_column * columns)
+        level = int(np.floor(np.log2(max(ratio, 1))))
+        return min(level, self.__top_level)
+
+    def composite(self, x_range, columns=constants.TILE_TARGET_COLUMNS):
+        """
+        Build the prepared plot of *x_range* from the tiles of the level chosen by
+        :py:meth:`choose_level`, building any tile that is not on disk yet
+
+        :param x_range: Tuple of the first and last profile index
+        :param int columns: columns wanted across the range
+        :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
+        """
+        first = max(x_range[0], 0)
+        last = min(x_range[1], self.__num_profiles)
+        if last <= first:
+            raise IndexError('Range ' + str(x_range) + ' outside of the granule')
+
+        level = self.choose_level((first, last), columns)
+        span = self.__tile_profiles << level
+        tiles = [self.get_tile(level, i)
+                 for i in range(first // span, min(-(-last // span), self.get_num_tiles(level)))]
+        joined = PreparedPlot.join(tiles)
+        first_covered, last_covered = joined.get_x_range()
+        return joined.crop((max(first, first_covered), min(last, last_covered)))
+
+    def get_tile(self, level, index):
+        """
+        Return tile *index* of *level*, loading it from disk or building it on the first request
+
+        :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
+        """
+        return self.__granule.get_product(('tile', self.__name, level, index),
+                                          lambda: self.__load_or_build(level, index))
+
+    def __load_or_build(self, level, index):
+        path = os.path.join(self.__directory, '%d_%d.npz' % (level, index))
+        if os.path.exists(path):
+            with np.load(path) as tile:
+                return PreparedPlot(tile['data'], tile['latitude'], tile['time'],
+                                    tuple(tile['x_range']))
+
+        if level == 0:
+            first = index * self.__tile_profiles
+            last = min(first + self.__tile_profiles, self.__num_profiles)
+            logger.info('Building %s tile %d of %s' % (self.__name, index, path))
+            tile = self.__prepare_tile(first, last)
+        else:
+            children = [self.get_tile(level - 1, 2 * index)]
+            if 2 * index + 1 < self.get_num_tiles(level - 1):
+                children.append(self.get_tile(level - 1, 2 * index + 1))
+            tile = halve(PreparedPlot.join(children))
+
+        self.__save(path, tile)
+        return tile
+
+    def __prepare_tile(self, first, last):
+        # A range reaching the end of the granule must hold Granule.MIN_END_RECORDS records, a
+        # shorter last tile is prepared from further back and cropped. Going back whole records
+        # of 15 profiles keeps the crop on a column boundary of the 5 profile averages of a
+        # short L1 range
+        short = Granule.MIN_END_RECORDS * self.__profiles_per_record - (last - first)
+        start = max(first - -(-short // PAD_PROFILES) * PAD_PROFILES, 0) if short > 0 else first
+        tile = self.__prepare(self.__granule, (start, last), None)
+        if start < first:
+            tile = tile.crop((first, last))
+        # A partial last tile may be prepared with a narrower average than the full tiles
+        return match_columns(tile, self.__per_column)
+
+    def __save(self, path, tile):
+        if not os.path.isdir(self.__directory):
+            os.makedirs(self.__directory)
+        # Write to a temporary file first so an interrupted save never leaves a partial tile
+        handle, temp = tempfile.mkstemp(suffix='.npz', dir=self.__directory)
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, data=tile.get_data(), latitude=tile.get_latitude(),
+                     time=tile.get_time(), x_range=np.array(tile.get_x_range()))
+        os.rename(temp, path)
+
+
+def match_columns(plot, per_column):
+    """
+    Reduce the columns of a prepared plot to *per_column* profiles each, the same way
+    :py:func:`plot.downsample.downsample` reduces a raster to the canvas, so it lines up with
+    plots of the same width. Trailing profiles that do not fill a column are dropped, a plot
+    whose columns are already that wide or wider is returned as is
+
+    :param plot: :py:class:`plot.prepared_plot.PreparedPlot`
+    :param per_column: profiles per column of the plots it must line up with
+    :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
+    """
+    if plot.get_profiles_per_column() >= per_column:
+        return plot
+    first, last = plot.get_x_range()
+    columns = int((last - first) // per_column)
+    data = plot.get_data()
+    latitude = plot.get_latitude()
+    return PreparedPlot(downsample(data, columns, data.shape[0]),
+                        latitude[(np.arange(columns) * len(latitude)) // columns],
+                        plot.get_time(), (first, first + int(round(columns * per_column))))
+
+
+def prune_tiles(directory=constants.TILE_DIR, budget=constants.TILE_DIR_BUDGET, keep=None):
+    """
+    Delete the tiles of whole granules, those used longest ago first, until the tiles under
+    *directory* take at most *budget* bytes. Each granule has a folder of tiles, which is
+    touched whenever a tile pyramid of the granule is made
+
+    :param str directory: root folder of the tiles
+    :param int budget: most bytes the tiles may take
+    :param str keep: folder of the granule in use, touched and never deleted
+    """
+    if not os.path.isdir(directory):
+        return
+    if keep is not None and os.path.isdir(os.path.join(directory, keep)):
+        os.utime(os.path.join(directory, keep), None)
+
+    folders = []
+    for stamp in os.listdir(directory):
+        path = os.path.join(directory, stamp)
+        if not os.path.isdir(path):
+            continue
+        size = sum(os.path.getsize(os.path.join(root, file_name))
+                   for root, _, files in os.walk(path) for file_name in files)
+        folders.append((os.path.getmtime(path), stamp, path, size))
+
+    total = sum(folder[3] for folder in folders)
+    for _, stamp, path, size in sorted(folders):
+        if total <= budget:
+            break
+        if stamp == keep:
+            continue
+        logger.info('Deleting tiles of ' + stamp)
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def halve(plot):
+    """
+    Halve the columns of a prepared plot. Continuous data is averaged in pairs of columns,
+    integer data such as VFM classes takes the first column of each pair so no class is
+    blended with its neighbour. A trailing odd column is dropped
+
+    :param plot: :py:class:`plot.prepared_plot.PreparedPlot`
+    :rtype: :py:class:`plot.prepared_plot.PreparedPlot`
+    """
+    data = plot.get_data()
+    pairs = data.shape[1] // 2
+    if np.issubdtype(data.dtype, np.integer):
+        halved = data[:, 0:2 * pairs:2]
+    else:
+        with warnings.catch_warnings():
+            # Pairs that are both NaN stay NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            halved = np.nanmean(data[:, :2 * pairs].reshape(data.shape[0], pairs, 2), axis=2)
+
+    first = plot.get_x_range()[0]
+    last = first + int(round(2 * pairs * plot.get_profiles_per_column()))
+    return PreparedPlot(np.ascontiguousarray(halved), plot.get_latitude()[::2],
+                        plot.get_time()[::2], (first, last))